@@ -0,0 +1,38 @@
+"""
+Configuration for Soko Pay
+Loads .env once, before anything reads the environment, and holds the
+settings several modules share. Tuning knobs that belong to one service
+(cache sizes, thresholds, intervals) stay next to that service's code.
+"""
+
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Use /tmp on Heroku (ephemeral filesystem) or local path
+DATABASE_PATH = os.getenv("DATABASE_PATH", "soko_pay.db")
+
+FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:3001")
+
+# Product photos (served under /uploads/products) and trained model files
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads/products")
+MODEL_DIR = os.getenv("MODEL_DIR", "models")
+
+# PayHero Basic Auth token (base64 encoded API_Username:API_Password)
+PAYHERO_AUTH_TOKEN = os.getenv("PAYHERO_AUTH_TOKEN", "")
+PAYHERO_CHANNEL_ID = int(os.getenv("PAYHERO_CHANNEL_ID", "5520"))
+PAYHERO_BASE_URL = os.getenv("PAYHERO_BASE_URL", "https://backend.payhero.co.ke/api/v2")
+CALLBACK_URL = os.getenv("CALLBACK_URL", "https://soko-pay.vercel.app/api/payhero/callback")
+
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-pro")
+
+# "auto" asks for application/json output when the SDK and model support
+# it (gemini-1.5+ with google-generativeai >= 0.5); "1"/"0" force it
+GEMINI_JSON_MODE = os.getenv("GEMINI_JSON_MODE", "auto")
+
+# Seconds after startup before the Gemini SDK and geopy are imported in the
+# background (they're imported on first use until then)
+WARMUP_DELAY_SECONDS = float(os.getenv("WARMUP_DELAY_SECONDS", "1"))
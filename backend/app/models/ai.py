@@ -0,0 +1,103 @@
+"""
+Response schemas for Gemini features
+Every Gemini reply is validated against one of these before it is used;
+unknown keys are dropped and numbers sent as strings are coerced
+"""
+
+from pydantic import BaseModel, BeforeValidator, ConfigDict, Field
+from typing import Annotated, Literal, Optional, List
+
+def _round_float(value):
+    return round(value) if isinstance(value, float) else value
+
+# 0-100 score; the model sometimes answers 72.5 or "72"
+Score = Annotated[int, BeforeValidator(_round_float), Field(ge=0, le=100)]
+
+def _lower(value):
+    return value.strip().lower() if isinstance(value, str) else value
+
+Level = Annotated[Literal["low", "medium", "high"], BeforeValidator(_lower)]
+
+class GeminiResponse(BaseModel):
+    model_config = ConfigDict(extra="ignore", coerce_numbers_to_str=True)
+
+class FraudAssessment(GeminiResponse):
+    risk_score: Score
+    risk_level: Level
+    reason: str
+    flags: List[str] = []
+
+class EnhancedFraudAssessment(FraudAssessment):
+    recommendation: str = ""
+    confidence: Score = 50
+
+class BatchFraudAssessment(FraudAssessment):
+    index: int = Field(..., ge=0)
+
+class OptimizedDescription(GeminiResponse):
+    optimized_description: str
+    key_points: List[str] = []
+    tone: str = "neutral"
+    estimated_engagement_increase: str = "0%"
+    suggestions: List[str] = []
+
+class Categorization(GeminiResponse):
+    category: str
+    subcategory: Optional[str] = None
+    confidence: Score
+    alternative_categories: List[str] = []
+    reason: str = ""
+
+class BatchCategorization(Categorization):
+    index: int = Field(..., ge=0)
+
+class SimilarProduct(GeminiResponse):
+    id: str
+    name: str
+    price_difference: str = "unknown"
+    match_score: Score
+    is_duplicate: bool = False
+
+class SimilarProducts(GeminiResponse):
+    similar_products: List[SimilarProduct] = []
+    market_positioning: str = "unknown"
+    recommendation: str = ""
+
+class SellerQuality(GeminiResponse):
+    seller_score: Score
+    trust_level: str
+    strengths: List[str] = []
+    improvements: List[str] = []
+    recommendation: str = ""
+    risk_level: Level = "medium"
+
+class DisputeAnalysis(GeminiResponse):
+    buyer_claim_strength: Score
+    seller_defense_strength: Score
+    likely_winner: str
+    recommended_resolution: str
+    confidence: Score = 50
+    reasoning: str = ""
+
+class SupportAnswer(GeminiResponse):
+    response: str
+    category: str = "other"
+    urgency: Level = "medium"
+    suggests_escalation: bool = False
+    helpful_links: List[str] = []
+
+class MarketTips(GeminiResponse):
+    popular_features: List[str] = []
+    seller_tips: List[str] = []
+    forecast: str = ""
+
+class ContentPolicyCheck(GeminiResponse):
+    is_safe: bool
+    confidence: Score = 50
+    violations: List[str] = []
+    severity: str = "none"
+    action: str
+    reason: str = ""
+
+class RecommendationMessage(GeminiResponse):
+    message: str = Field(..., min_length=1)
@@ -1,7 +1,7 @@
 from pydantic import BaseModel, Field
 from enum import Enum
 from datetime import datetime
-from typing import Optional, List
+from typing import Dict, Optional, List
 
 class OrderStatus(str, Enum):
     PENDING = "pending"
@@ -52,6 +52,11 @@ class FraudCheck(BaseModel):
     reason: str
     flags: list[str] = []
 
+class BatchFraudCheckRequest(BaseModel):
+    use_ai: bool = Field(default=False, description="Use Gemini instead of rule-based scoring only")
+    chunk_size: int = Field(default=500, ge=1, le=5000, description="Orders read and written per chunk")
+    pack_size: int = Field(default=20, ge=1, le=50, description="Listings per Gemini request")
+
 class LocationUpdate(BaseModel):
     latitude: float = Field(..., description="Latitude coordinate")
     longitude: float = Field(..., description="Longitude coordinate")
@@ -137,6 +142,9 @@ class PhotoUploadResponse(BaseModel):
     message: str
     photo_url: str
     file_size_kb: float
+    sha256: Optional[str] = None
+    deduplicated: bool = False
+    sizes: Optional[Dict[str, str]] = None  # WebP derivative URLs: thumb, card, display
 
 class PaymentResponse(BaseModel):
     message: str
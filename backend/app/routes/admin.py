@@ -0,0 +1,56 @@
+from fastapi import APIRouter, HTTPException, Query
+from typing import Optional
+from app.services.query_profiler import query_profiler
+from app.services.tracing import tracer
+
+router = APIRouter()
+
+
+@router.get("/admin/query-profile")
+async def get_query_profile(
+    limit: int = Query(20, ge=1, le=200),
+    order_by: str = Query("total", pattern="^(total|p95|max|calls)$")
+):
+    """
+    Admin: Slowest SQL statements, grouped by fingerprint.
+
+    Needs QUERY_PROFILING=1. Each fingerprint has call and slow-call
+    counts, total/mean time, p50/p95/p99/max in ms, and - for statements
+    that scan a whole table - the EXPLAIN QUERY PLAN.
+    """
+    return query_profiler.report(limit=limit, order_by=order_by)
+
+
+@router.delete("/admin/query-profile")
+async def reset_query_profile():
+    """Admin: Clear collected query timings (e.g. after adding an index)"""
+    query_profiler.reset()
+    return {"status": "reset"}
+
+
+@router.get("/admin/traces")
+async def list_traces(
+    limit: int = Query(50, ge=1, le=500),
+    min_ms: float = Query(0, ge=0),
+    name: Optional[str] = None
+):
+    """
+    Admin: Recent sampled request traces, newest first.
+
+    Each trace shows its duration and the time spent per span family
+    (sqlite, gemini, payhero). Filter with min_ms=5000 for slow requests
+    or name=/api/payhero/callback for one route.
+    """
+    return {
+        **tracer.stats,
+        "traces": tracer.recent(limit=limit, min_ms=min_ms, name=name)
+    }
+
+
+@router.get("/admin/traces/{trace_id}")
+async def get_trace(trace_id: str):
+    """Admin: Every span of one trace, with offsets from the start of the request"""
+    trace = tracer.get(trace_id)
+    if not trace:
+        raise HTTPException(status_code=404, detail="Trace not found (not sampled, or aged out of the buffer)")
+    return trace
@@ -3,21 +3,31 @@ AI-powered endpoints for Soko Pay
 Exposes Gemini AI features via REST API
 """
 
+import json
 from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
-from typing import Optional, List
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from typing import AsyncIterator, Optional, List
 from app.services.ai_enhanced import (
     check_fraud_risk_enhanced,
     optimize_product_description,
-    categorize_product,
     find_similar_products,
     score_seller_quality,
     analyze_dispute,
     handle_support_query,
-    generate_market_insights,
     check_content_policy,
-    get_product_recommendations
+    generate_recommendation_message,
+    stream_product_description,
+    stream_support_query
 )
+from app.services.categorizer import categorize, categorize_batch
+from app.services.gemini_gateway import gemini_gateway
+from app.services.gemini_scheduler import gemini_scheduler
+from app.services.market_insights import get_market_insights
+from app.services.recommender import recommend_for_buyer
+from app.services.seller_stats import get_seller_stats, summarize_seller
+from app.services.similarity_index import find_similar_listings, similarity_index
+from app.utils.single_flight import single_flight
 
 router = APIRouter()
 
@@ -47,14 +57,19 @@ class CategorizationRequest(BaseModel):
     description: str
 
 
+class BatchCategorizationRequest(BaseModel):
+    products: List[CategorizationRequest] = Field(..., min_length=1, max_length=1000)
+
+
 class SellerQualityRequest(BaseModel):
-    seller_name: str
-    product_count: int
-    avg_price: float
-    product_photos_rate: float  # 0-1
-    description_quality: str
-    product_variety: int
     phone: str
+    # Only used for sellers with no order history on Soko Pay yet
+    seller_name: Optional[str] = None
+    product_count: Optional[int] = None
+    avg_price: Optional[float] = None
+    product_photos_rate: Optional[float] = None  # 0-1
+    description_quality: Optional[str] = None
+    product_variety: Optional[int] = None
 
 
 class DisputeAnalysisRequest(BaseModel):
@@ -79,7 +94,8 @@ class ContentCheckRequest(BaseModel):
 
 class MarketInsightsRequest(BaseModel):
     category: str
-    recent_products: List[dict]
+    # Ignored - insights are computed from Soko Pay's own order history
+    recent_products: Optional[List[dict]] = None
 
 
 # ============================================================================
@@ -144,7 +160,8 @@ async def categorize_endpoint(request: CategorizationRequest):
     """
     Automatically categorize product.
     
-    Useful when seller doesn't select a category.
+    Useful when seller doesn't select a category. Answered by the local
+    categorizer; Gemini is only asked when it isn't confident.
     
     Returns:
     - category: primary category
@@ -154,7 +171,7 @@ async def categorize_endpoint(request: CategorizationRequest):
     - reason: why this categorization
     """
     try:
-        result = await categorize_product(
+        result = await categorize(
             request.product_name,
             request.description
         )
@@ -166,17 +183,41 @@ async def categorize_endpoint(request: CategorizationRequest):
         raise HTTPException(status_code=500, detail=f"Categorization error: {str(e)}")
 
 
+@router.post("/ai/categorize/batch")
+async def categorize_batch_endpoint(request: BatchCategorizationRequest):
+    """
+    Categorize up to 1000 products in one call.
+
+    Returns one result per product, in order, in the same shape as
+    /ai/categorize.
+    """
+    try:
+        results = await categorize_batch([product.dict() for product in request.products])
+        return {
+            "status": "success",
+            "data": results
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Categorization error: {str(e)}")
+
+
 @router.post("/ai/find-similar")
 async def find_similar_endpoint(
     product_name: str,
     price: float,
     category: str,
+    description: str = "",
+    limit: int = 10,
+    exclude_order_id: Optional[str] = None,
     existing_products: Optional[List[dict]] = None
 ):
     """
     Find similar products in database.
     
     Helps detect duplicate listings and compare with competing products.
+    Searches every listing on Soko Pay through the in-memory similarity
+    index; existing_products is only sent to the AI while the index is
+    still being built at startup.
     
     Returns:
     - similar_products: list of matches with scores
@@ -184,12 +225,22 @@ async def find_similar_endpoint(
     - recommendation: pricing advice
     """
     try:
-        result = await find_similar_products(
-            product_name,
-            price,
-            category,
-            existing_products or []
-        )
+        if similarity_index.ready:
+            result = find_similar_listings(
+                product_name,
+                price,
+                category,
+                description=description,
+                limit=max(1, min(limit, 50)),
+                exclude_order_id=exclude_order_id
+            )
+        else:
+            result = await find_similar_products(
+                product_name,
+                price,
+                category,
+                existing_products or []
+            )
         return {
             "status": "success",
             "data": result
@@ -204,6 +255,8 @@ async def seller_quality_endpoint(request: SellerQualityRequest):
     Score seller quality and trustworthiness.
     
     Helps buyers make trust decisions and helps sellers improve.
+    Sellers with order history are scored from their materialized
+    stats; the AI is only asked about sellers we haven't seen yet.
     
     Returns:
     - seller_score: 0-100
@@ -214,7 +267,11 @@ async def seller_quality_endpoint(request: SellerQualityRequest):
     - risk_level: low/medium/high
     """
     try:
-        result = await score_seller_quality(request.dict())
+        stats = get_seller_stats(request.phone)
+        if stats:
+            result = summarize_seller(stats)
+        else:
+            result = await score_seller_quality(request.dict(exclude_none=True))
         return {
             "status": "success",
             "data": result
@@ -223,6 +280,23 @@ async def seller_quality_endpoint(request: SellerQualityRequest):
         raise HTTPException(status_code=500, detail=f"Seller scoring error: {str(e)}")
 
 
+@router.get("/ai/seller-quality/{phone}")
+async def seller_quality_by_phone(phone: str):
+    """
+    Score a seller from their Soko Pay order history.
+
+    Same response as POST /ai/seller-quality, read from seller_stats.
+    """
+    stats = get_seller_stats(phone)
+    if not stats:
+        raise HTTPException(status_code=404, detail="No order history for this seller")
+
+    return {
+        "status": "success",
+        "data": summarize_seller(stats)
+    }
+
+
 @router.post("/ai/analyze-dispute")
 async def analyze_dispute_endpoint(request: DisputeAnalysisRequest):
     """
@@ -278,6 +352,57 @@ async def support_query_endpoint(request: SupportQueryRequest):
         raise HTTPException(status_code=500, detail=f"Support query error: {str(e)}")
 
 
+async def _sse(events: AsyncIterator[dict]) -> AsyncIterator[str]:
+    """Format streamed AI events as Server-Sent Events"""
+    async for event in events:
+        payload = {key: value for key, value in event.items() if key != "type"}
+        yield f"event: {event['type']}\ndata: {json.dumps(payload)}\n\n"
+
+
+def _event_stream(events: AsyncIterator[dict]) -> StreamingResponse:
+    return StreamingResponse(
+        _sse(events),
+        media_type="text/event-stream",
+        # Stop proxies (nginx) from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.post("/ai/optimize-description/stream")
+async def optimize_description_stream_endpoint(request: DescriptionOptimizationRequest):
+    """
+    Streaming version of /ai/optimize-description (Server-Sent Events).
+
+    Events:
+    - delta: {"field": "optimized_description", "text": "..."} as it is written
+    - field: {"field": name, "value": value} as each field completes
+    - done: {"data": full result, same as /ai/optimize-description}
+    - error: {"data": fallback result}
+    """
+    return _event_stream(stream_product_description(
+        request.description,
+        request.product_name,
+        request.category
+    ))
+
+
+@router.post("/ai/support/stream")
+async def support_query_stream_endpoint(request: SupportQueryRequest):
+    """
+    Streaming version of /ai/support (Server-Sent Events).
+
+    The answer text arrives as "delta" events for the "response" field,
+    followed by "field" events, then "done" (or "error") with the full answer.
+    """
+    context = {}
+    if request.order_id:
+        context["order_id"] = request.order_id
+    if request.buyer_name:
+        context["buyer_name"] = request.buyer_name
+
+    return _event_stream(stream_support_query(request.query, context))
+
+
 @router.post("/ai/check-content")
 async def check_content_endpoint(request: ContentCheckRequest):
     """
@@ -308,22 +433,37 @@ async def market_insights_endpoint(request: MarketInsightsRequest):
     """
     Generate market insights for a category.
     
-    Helps sellers understand trends and pricing.
+    Helps sellers understand trends and pricing. Numbers come from
+    per-category rollups of all Soko Pay orders; the AI only writes
+    the tips and forecast.
     
     Returns:
     - avg_price: category average
     - price_range: min/max
+    - price_percentiles: p25/p50/p75/p90
+    - weekly_volume: listings/orders/completed per week (last 8 weeks)
     - trend: declining/stable/growing
     - demand_level: low/moderate/high/very_high
+    - completion_rate / dispute_rate: share of paid orders
     - popular_features: trending attributes
     - seller_tips: actionable advice
     - forecast: 3-month outlook
     """
     try:
-        result = await generate_market_insights(
-            request.category,
-            request.recent_products
-        )
+        result = await get_market_insights(request.category)
+        return {
+            "status": "success",
+            "data": result
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Market insights error: {str(e)}")
+
+
+@router.get("/ai/market-insights/{category}")
+async def market_insights_by_category(category: str):
+    """Same as POST /ai/market-insights"""
+    try:
+        result = await get_market_insights(category)
         return {
             "status": "success",
             "data": result
@@ -335,22 +475,46 @@ async def market_insights_endpoint(request: MarketInsightsRequest):
 @router.post("/ai/recommendations")
 async def recommendations_endpoint(
     buyer_profile: dict,
-    recent_purchases: Optional[List[str]] = None
+    recent_purchases: Optional[List[str]] = None,
+    limit: int = 5,
+    personalize: bool = False
 ):
     """
     Get personalized product recommendations.
     
-    Increases engagement and sales.
+    Increases engagement and sales. Recommendations come from what
+    other Soko Pay buyers bought alongside this buyer's purchases
+    (buyer_profile["phone"]) and what's popular in their area. With
+    personalize=true the AI writes the message.
     
     Returns:
     - recommendations: list of suggested products
     - message: personalized message for buyer
     """
     try:
-        result = await get_product_recommendations(
-            buyer_profile,
-            recent_purchases or []
+        result = recommend_for_buyer(
+            buyer_profile.get("phone") or buyer_profile.get("buyer_phone"),
+            recent_purchases or [],
+            region=buyer_profile.get("region"),
+            limit=max(1, min(limit, 50))
         )
+        if personalize and result["recommendations"]:
+            message = await generate_recommendation_message(buyer_profile, result["recommendations"])
+            if message:
+                result["message"] = message
+        return {
+            "status": "success",
+            "data": result
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Recommendation error: {str(e)}")
+
+
+@router.get("/ai/recommendations/{buyer_phone}")
+async def recommendations_by_phone(buyer_phone: str, limit: int = 5):
+    """Recommendations for a buyer from their order history (no AI)"""
+    try:
+        result = recommend_for_buyer(buyer_phone, limit=max(1, min(limit, 50)))
         return {
             "status": "success",
             "data": result
@@ -429,3 +593,19 @@ async def get_capabilities():
             }
         ]
     }
+
+
+@router.get("/ai/stats")
+async def get_ai_stats():
+    """
+    AI call statistics: how many identical concurrent calls were coalesced
+    into one Gemini request, per function; the Gemini scheduler's
+    per-priority queue times and shed counts; and per-feature Gemini
+    latency, token counts and parse-failure rates.
+    """
+    return {
+        "status": "success",
+        "single_flight": single_flight.stats,
+        "scheduler": gemini_scheduler.stats,
+        "gateway": gemini_gateway.stats
+    }
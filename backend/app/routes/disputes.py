@@ -1,6 +1,9 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from database import get_db
+from app.services.ledger import record_release, record_refund
+from app.services.order_events import on_order_event
+from app.utils.money import split_platform_fee
 
 router = APIRouter()
 
@@ -35,6 +38,8 @@ async def raise_dispute(order_id: str, dispute: DisputeRequest):
             VALUES (?, 'dispute_raised', ?)
         """, (order_id, dispute.reason))
 
+        on_order_event(dict(order), "disputed", conn=conn)
+
         conn.commit()
 
     return {
@@ -91,6 +96,19 @@ async def resolve_dispute(order_id: str, resolution: str = "refund"):
             VALUES (?, 'dispute_resolved', ?)
         """, (order_id, resolution))
 
+        if resolution == "release":
+            # Same release record as confirm-delivery so settlement picks it up
+            platform_fee, seller_amount = split_platform_fee(order["product_price"])
+            cursor.execute("""
+                INSERT INTO transactions (order_id, type, amount, status, metadata)
+                VALUES (?, 'funds_released', ?, 'success', ?)
+            """, (order_id, float(seller_amount), f"Platform fee: {platform_fee} KES"))
+            record_release(dict(order), conn=conn)
+            on_order_event(dict(order), "completed", conn=conn)
+        else:
+            record_refund(dict(order), conn=conn)
+            on_order_event(dict(order), "refunded", conn=conn)
+
         conn.commit()
 
     return {
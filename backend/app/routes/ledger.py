@@ -0,0 +1,32 @@
+from fastapi import APIRouter, HTTPException
+from app.services.ledger import get_balance, get_order_entries, verify_ledger
+from database import get_order_by_id
+
+router = APIRouter()
+
+
+@router.get("/ledger/balances/{account}")
+async def get_account_balance(account: str):
+    """
+    Get the running balance of a ledger account.
+
+    Accounts: escrow, platform:fees, mpesa:collections, mpesa:disbursements,
+    seller:{phone}, buyer:{phone}
+    """
+    return get_balance(account)
+
+
+@router.get("/ledger/orders/{order_id}")
+async def get_order_ledger(order_id: str):
+    """Get the ledger entries (hold, release, fee, refund) for an order."""
+    if not get_order_by_id(order_id):
+        raise HTTPException(status_code=404, detail="Order not found")
+
+    entries = get_order_entries(order_id)
+    return {"order_id": order_id, "entries": entries, "count": len(entries)}
+
+
+@router.post("/ledger/verify")
+async def verify_ledger_endpoint():
+    """Admin: Replay the ledger and check it against the materialized balances."""
+    return verify_ledger()
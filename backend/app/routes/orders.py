@@ -1,13 +1,16 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File
+from fastapi import APIRouter, HTTPException, UploadFile, File, BackgroundTasks, Header
 from datetime import datetime
 import uuid
-import os
 import json
-import shutil
-from pathlib import Path
-from app.models.order import Product, Order, CreatePaymentLinkResponse, OrderStatus, PhotoUploadResponse
+from typing import Optional
+from app.config import FRONTEND_URL
+from app.models.order import Product, Order, CreatePaymentLinkResponse, OrderStatus, PhotoUploadResponse, BatchFraudCheckRequest
 from database import create_order, get_order_by_id, get_db, update_order_status
 from app.services.ai_fraud import check_fraud_risk
+from app.services.order_events import on_order_event
+from app.services.photo_storage import PHOTO_EXTENSIONS, PhotoTooLarge, save_upload
+from app.services.photo_derivatives import derivative_urls, generate_derivatives
+from app.services.fraud_batch import claim_rescore_job, create_rescore_job, get_rescore_job, run_rescore_job
 
 router = APIRouter()
 
@@ -24,8 +27,7 @@ async def create_payment_link(product: Product):
         order_id = f"SP{uuid.uuid4().hex[:12].upper()}"
         
         # Create payment link using configured frontend URL
-        frontend_url = os.getenv("FRONTEND_URL", "http://localhost:3001")
-        payment_link = f"{frontend_url}/pay/{order_id}"
+        payment_link = f"{FRONTEND_URL}/pay/{order_id}"
         
         # Extract location if provided
         seller_lat = product.seller_location.latitude if product.seller_location else None
@@ -52,6 +54,17 @@ async def create_payment_link(product: Product):
         if not order:
             raise HTTPException(status_code=500, detail="Failed to create order")
         
+        on_order_event({
+            "id": order_id,
+            "seller_phone": product.seller_phone,
+            "seller_name": product.seller_name,
+            "product_name": product.name,
+            "product_description": product.description,
+            "product_price": product.price,
+            "product_category": product.category,
+            "product_photos": product_photos_json
+        }, "created")
+        
         # Run Gemini AI fraud detection
         try:
             fraud_result = await check_fraud_risk({
@@ -116,6 +129,48 @@ async def track_order(order_id: str):
         delivered_at=order["delivered_at"]
     )
 
+@router.post("/fraud-check/batch")
+async def batch_fraud_check(request: BatchFraudCheckRequest, background_tasks: BackgroundTasks):
+    """
+    Admin: Re-score fraud risk for every order in the background.
+    
+    Use after changing fraud rules. Rule-based by default; set use_ai to
+    pack pack_size listings into each Gemini request.
+    Poll GET /fraud-check/batch/{job_id} for progress.
+    """
+    job = create_rescore_job(request.use_ai, request.chunk_size, request.pack_size)
+    background_tasks.add_task(run_rescore_job, job["id"])
+    return {"message": "Rescore job started", "job": job}
+
+@router.get("/fraud-check/batch/{job_id}")
+async def batch_fraud_check_status(job_id: str):
+    """Admin: Progress of a batch re-scoring job."""
+    job = get_rescore_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Rescore job not found")
+    return {"job": job}
+
+@router.post("/fraud-check/batch/{job_id}/resume")
+async def resume_batch_fraud_check(job_id: str, background_tasks: BackgroundTasks):
+    """
+    Admin: Resume an interrupted or failed re-scoring job from its checkpoint.
+
+    A job left 'running' by a worker that died (no heartbeat for
+    RESCORE_STALE_SECONDS) can be resumed too; a live one can't.
+    """
+    job = get_rescore_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Rescore job not found")
+    if job["status"] == "completed":
+        raise HTTPException(status_code=400, detail="Job is already completed")
+
+    runner_id = claim_rescore_job(job_id)
+    if not runner_id:
+        raise HTTPException(status_code=409, detail="Job is already running")
+
+    background_tasks.add_task(run_rescore_job, job_id, runner_id=runner_id)
+    return {"message": "Rescore job resumed", "job": get_rescore_job(job_id)}
+
 @router.post("/fraud-check/{order_id}")
 async def fraud_check(order_id: str):
     """
@@ -168,12 +223,24 @@ async def get_qr_code(order_id: str):
     }
 
 @router.post("/upload-photo", response_model=PhotoUploadResponse)
-async def upload_product_photo(file: UploadFile = File(...)):
+async def upload_product_photo(
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    x_content_sha256: Optional[str] = Header(None)
+):
     """
     Upload a product photo for a seller's listing.
     
     Supports: JPG, PNG, WebP (max 5MB each)
     Returns: Photo URL/path to use in create-payment-link
+
+    Photos are stored by content hash, so uploading the same photo again
+    returns the same URL. Clients can send the file's SHA-256 in the
+    X-Content-SHA256 header to skip storing a photo we already have.
+
+    WebP thumb/card/display sizes are rendered in the background; their
+    URLs are returned in `sizes` and are generated on first request if
+    the background job hasn't finished yet.
     
     Example usage:
     1. Upload photo: POST /api/upload-photo -> returns photo_url
@@ -182,78 +249,33 @@ async def upload_product_photo(file: UploadFile = File(...)):
     """
     try:
         # Validate file type
-        allowed_types = ["image/jpeg", "image/png", "image/webp"]
-        if file.content_type not in allowed_types:
+        if file.content_type not in PHOTO_EXTENSIONS:
             raise HTTPException(
                 status_code=400, 
                 detail=f"Invalid file type. Allowed: JPG, PNG, WebP. Got: {file.content_type}"
             )
         
-        # Read file content
-        content = await file.read()
-        file_size_bytes = len(content)
-        
-        # Validate file size (max 5MB)
-        max_size_bytes = 5 * 1024 * 1024
-        if file_size_bytes > max_size_bytes:
-            raise HTTPException(
-                status_code=413,
-                detail=f"File too large: {file_size_bytes / 1024 / 1024:.1f}MB (max 5MB)"
-            )
-        
-        # Create uploads directory if it doesn't exist
-        uploads_dir = Path("uploads/products")
-        uploads_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Generate unique filename
-        file_ext = file.filename.split('.')[-1].lower()
-        unique_filename = f"{uuid.uuid4().hex}_{datetime.utcnow().timestamp()}.{file_ext}"
-        file_path = uploads_dir / unique_filename
-        
-        # Save file
-        with open(file_path, "wb") as f:
-            f.write(content)
-        
-        # Return URL path (relative path for serving)
-        photo_url = f"/uploads/products/{unique_filename}"
+        # Stream to disk in chunks; stops as soon as the 5MB cap is crossed
+        try:
+            saved = await save_upload(file, file.content_type, expected_sha256=x_content_sha256)
+        except PhotoTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+
+        if not saved["deduplicated"]:
+            extension = PHOTO_EXTENSIONS[file.content_type]
+            background_tasks.add_task(generate_derivatives, saved["sha256"], extension)
         
         return PhotoUploadResponse(
             status="success",
-            message=f"Photo uploaded successfully",
-            photo_url=photo_url,
-            file_size_kb=round(file_size_bytes / 1024, 2)
+            message="Photo already uploaded" if saved["deduplicated"] else "Photo uploaded successfully",
+            photo_url=saved["url"],
+            file_size_kb=round(saved["size"] / 1024, 2),
+            sha256=saved["sha256"],
+            deduplicated=saved["deduplicated"],
+            sizes=derivative_urls(saved["sha256"])
         )
     
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error uploading photo: {str(e)}")
-
-@router.get("/uploads/products/{filename}")
-async def serve_product_photo(filename: str):
-    """
-    Serve uploaded product photos.
-    
-    Called when frontend displays product images.
-    Example: GET /api/uploads/products/abc123.jpg
-    """
-    try:
-        file_path = Path("uploads/products") / filename
-        
-        if not file_path.exists():
-            raise HTTPException(status_code=404, detail="Photo not found")
-        
-        # Security: Ensure the file is within the uploads directory
-        if not str(file_path.resolve()).startswith(str(Path("uploads/products").resolve())):
-            raise HTTPException(status_code=403, detail="Access denied")
-        
-        # For production, you'd return a FileResponse
-        # For now, return file info
-        return {
-            "filename": filename,
-            "file_path": str(file_path),
-            "exists": file_path.exists()
-        }
-    
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error serving photo: {str(e)}")
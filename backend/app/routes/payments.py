@@ -3,13 +3,19 @@ from datetime import datetime
 from app.models.order import PaymentRequest, PaymentResponse, DeliveryConfirmation, OrderStatus
 from app.services.payhero import initiate_payment, process_callback
 from app.services.ai_fraud import check_fraud_risk
-from database import get_order_by_id, update_order_status, log_transaction, get_db
+from app.services.ledger import record_escrow_hold, record_release
+from app.services.order_events import on_order_event
+from app.services.seller_stats import get_seller_reputation
+from app.services.velocity import get_device_id, record_payment_attempt, get_transaction_velocity
+from app.utils.risk_scoring import calculate_composite_risk
+from app.utils.money import split_platform_fee
+from database import get_order_by_id, update_order_status, log_transaction, get_db, claim_order_status
 import json
 
 router = APIRouter()
 
 @router.post("/pay/{order_id}", response_model=PaymentResponse)
-async def pay_for_order(order_id: str, payment_request: PaymentRequest):
+async def pay_for_order(order_id: str, payment_request: PaymentRequest, request: Request):
     """
     Initiate payment for an order via M-Pesa STK push.
     
@@ -43,17 +49,22 @@ async def pay_for_order(order_id: str, payment_request: PaymentRequest):
                 detail=payment_result.get("message", "Payment initiation failed")
             )
         
+        # Count this attempt for seller/buyer/device velocity checks
+        device_id = get_device_id(request.headers, request.client.host if request.client else None)
+        record_payment_attempt(order["seller_phone"], payment_request.buyer_phone, device_id)
+        
         # Update order with buyer details and PayHero reference
         with get_db() as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 UPDATE orders 
-                SET buyer_phone = ?, buyer_name = ?, payhero_ref = ?
+                SET buyer_phone = ?, buyer_name = ?, payhero_ref = ?, buyer_device_id = ?
                 WHERE id = ?
             """, (
                 payment_request.buyer_phone,
                 payment_request.buyer_name,
                 payment_result.get("reference"),
+                device_id,
                 order_id
             ))
             conn.commit()
@@ -83,6 +94,9 @@ async def payhero_callback(request: Request):
     
     PayHero sends this when payment is completed.
     Updates order status to 'paid' and triggers fraud detection.
+
+    PayHero re-sends callbacks, so only the first success for a pending
+    order does any work; repeats answer "Callback already processed".
     """
     try:
         callback_data = await request.json()
@@ -103,7 +117,25 @@ async def payhero_callback(request: Request):
         
         # Check payment status
         if processed.get("status") == "success":
-            # Run AI fraud detection before releasing to "paid"
+            # Claim pending -> paid together with the escrow hold, so a
+            # repeated (or concurrent duplicate) callback can't re-run fraud
+            # checks, seller stats or the hold, and a hold that fails to post
+            # leaves the order pending for PayHero's redelivery to retry
+            if order["status"] != "pending":
+                return {"status": "success", "message": "Callback already processed"}
+            with get_db() as conn:
+                if not claim_order_status(order_id, "pending", "paid", conn=conn):
+                    return {"status": "success", "message": "Callback already processed"}
+                conn.execute(
+                    "UPDATE orders SET paid_at = ? WHERE id = ?",
+                    (datetime.now().isoformat(), order_id)
+                )
+                # Buyer's money is now held in escrow
+                record_escrow_hold(order, conn=conn)
+                on_order_event(order, "paid", conn=conn)
+                conn.commit()
+
+            # Run AI fraud detection and store it on the paid order
             try:
                 fraud_result = await check_fraud_risk({
                     "product_name": order["product_name"],
@@ -130,8 +162,29 @@ async def payhero_callback(request: Request):
                     metadata=json.dumps(fraud_result)
                 )
                 
+                # Combine AI score with transaction velocity
+                velocity = get_transaction_velocity(
+                    order["seller_phone"],
+                    order.get("buyer_phone"),
+                    order.get("buyer_device_id")
+                )
+                composite = calculate_composite_risk(
+                    fraud_result.get("risk_score", 0),
+                    seller_reputation=get_seller_reputation(order["seller_phone"]),
+                    transaction_velocity=velocity["velocity"]
+                )
+                composite["velocity_counts"] = velocity["counts"]
+                
+                log_transaction(
+                    order_id=order_id,
+                    transaction_type="composite_risk",
+                    amount=order["product_price"],
+                    status=composite["recommendation"],
+                    metadata=json.dumps(composite)
+                )
+                
                 # If high risk, flag for review instead of auto-releasing
-                if fraud_result.get("risk_score", 0) >= 70:
+                if fraud_result.get("risk_score", 0) >= 70 or composite["recommendation"] == "block":
                     log_transaction(
                         order_id=order_id,
                         transaction_type="high_risk_flagged",
@@ -140,19 +193,8 @@ async def payhero_callback(request: Request):
                         metadata=f"AI flagged: {fraud_result.get('reason')}"
                     )
             except Exception as fraud_err:
+                # Order is already paid; it just has no fraud score
                 print(f"Fraud detection warning (non-blocking): {fraud_err}")
-                # Still mark as paid even if fraud check fails
-                update_order_status(order_id, "paid")
-            
-            # Update paid_at timestamp
-            with get_db() as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    UPDATE orders 
-                    SET paid_at = ?
-                    WHERE id = ?
-                """, (datetime.now().isoformat(), order_id))
-                conn.commit()
             
             # Log successful transaction
             log_transaction(
@@ -230,39 +272,33 @@ async def confirm_delivery(order_id: str, confirmation: DeliveryConfirmation):
     #     if not gps_verified:
     #         raise HTTPException(status_code=400, detail="GPS verification failed")
     
-    # Update status
-    update_order_status(order_id, "delivered")
-    
-    # Update delivered_at timestamp
+    # Calculate platform fee (3%) - actual payout happens in the settlement cycle
+    platform_fee, seller_amount = split_platform_fee(order["product_price"])
+
+    # Claim shipped -> completed (funds released) in the same transaction
+    # as the release, so two concurrent confirmations release and count
+    # the order once
     with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            UPDATE orders 
-            SET delivered_at = ?
-            WHERE id = ?
-        """, (datetime.now().isoformat(), order_id))
+        if not claim_order_status(order_id, "shipped", "completed", conn=conn):
+            raise HTTPException(status_code=409, detail="Delivery already confirmed")
+        conn.execute(
+            "UPDATE orders SET delivered_at = ? WHERE id = ?",
+            (datetime.now().isoformat(), order_id)
+        )
+        record_release(order, conn=conn)
+        on_order_event(order, "completed", conn=conn)
+
+        # Log fund release transaction
+        conn.execute("""
+            INSERT INTO transactions (order_id, type, amount, status, metadata)
+            VALUES (?, 'funds_released', ?, 'success', ?)
+        """, (order_id, float(seller_amount), f"Platform fee: {platform_fee} KES"))
         conn.commit()
     
-    # Mark as completed (funds released)
-    update_order_status(order_id, "completed")
-    
-    # Log fund release transaction
-    # Calculate platform fee (3%)
-    platform_fee = order["product_price"] * 0.03
-    seller_amount = order["product_price"] - platform_fee
-    
-    log_transaction(
-        order_id=order_id,
-        transaction_type="funds_released",
-        amount=seller_amount,
-        status="success",
-        metadata=f"Platform fee: {platform_fee} KES"
-    )
-    
     return {
         "message": "Delivery confirmed. Funds released to seller.",
         "order_id": order_id,
         "status": "completed",
-        "seller_payout": seller_amount,
-        "platform_fee": platform_fee
+        "seller_payout": float(seller_amount),
+        "platform_fee": float(platform_fee)
     }
@@ -0,0 +1,133 @@
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import Response
+import asyncio
+import os
+import re
+from typing import Optional
+from app.services.photo_storage import UPLOAD_DIR
+from app.services.photo_derivatives import DERIVATIVE_SIZES, ensure_derivative
+from app.services.photo_cache import photo_cache
+from app.utils.http_files import (
+    IMMUTABLE_CACHE_CONTROL, FileRangeResponse, RangeNotSatisfiable, etag_matches, parse_range
+)
+
+router = APIRouter()
+
+# ab/cd/<sha256>.jpg, or a derivative ab/cd/<sha256>_card.webp
+_CONTENT_ADDRESSED = re.compile(r"^([0-9a-f]{2})/([0-9a-f]{2})/([0-9a-f]{64})(?:_([a-z]+))?\.(jpg|png|webp)$")
+
+# Photos uploaded before content addressing: <uuid>_<timestamp>.jpg
+_LEGACY_NAME = re.compile(r"^[A-Za-z0-9_-]+\.(jpg|jpeg|png|webp)$")
+
+MEDIA_TYPES = {"jpg": "image/jpeg", "jpeg": "image/jpeg", "png": "image/png", "webp": "image/webp"}
+
+# A derivative URL answered with the original (not decodable yet) mustn't be cached forever
+FALLBACK_CACHE_CONTROL = "public, max-age=300"
+
+
+def _not_modified(etag: str, cache_control: str) -> Response:
+    return Response(status_code=304, headers={"etag": etag, "cache-control": cache_control})
+
+
+def _send(request: Request, path: str, size: int, etag: str, media_type: str, cache_control: str,
+          content: Optional[bytes] = None) -> Response:
+    """Full or ranged response, from memory when content is given, else from disk"""
+    headers = {"etag": etag, "cache-control": cache_control, "accept-ranges": "bytes"}
+
+    byte_range = None
+    if_range = request.headers.get("if-range")
+    if if_range is None or if_range.strip() == etag:
+        try:
+            byte_range = parse_range(request.headers.get("range"), size)
+        except RangeNotSatisfiable:
+            return Response(status_code=416, headers={**headers, "content-range": f"bytes */{size}"})
+
+    if content is None:
+        return FileRangeResponse(path, size, byte_range, headers=headers, media_type=media_type)
+    if byte_range is None:
+        return Response(content, headers=headers, media_type=media_type)
+    start, end = byte_range
+    headers["content-range"] = f"bytes {start}-{end}/{size}"
+    return Response(content[start:end + 1], status_code=206, headers=headers, media_type=media_type)
+
+
+def _read_small(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@router.api_route("/uploads/products/{filename:path}", methods=["GET", "HEAD"], include_in_schema=False)
+@router.api_route("/api/uploads/products/{filename:path}", methods=["GET", "HEAD"])
+async def serve_product_photo(filename: str, request: Request):
+    """
+    Serve a product photo or one of its WebP sizes.
+
+    Registered ahead of the /uploads static mount. Content-addressed
+    photos get a strong ETag from their hash and an immutable
+    Cache-Control, so a revalidation is answered 304 without touching the
+    disk. Range requests are supported; small hot files (thumbnails,
+    cards) are served from an in-memory LRU.
+
+    Derivatives (<sha256>_thumb.webp, _card.webp, _display.webp) that
+    don't exist yet are rendered on this request; if that isn't possible
+    the original is served instead.
+
+    Example: GET /uploads/products/3f/a2/3fa2...c9_card.webp
+    """
+    cache_control = IMMUTABLE_CACHE_CONTROL
+    match = _CONTENT_ADDRESSED.match(filename)
+
+    if match:
+        shard1, shard2, sha256, size_name, extension = match.groups()
+        if not sha256.startswith(shard1 + shard2):
+            raise HTTPException(status_code=404, detail="Photo not found")
+        if size_name is not None and (size_name not in DERIVATIVE_SIZES or extension != "webp"):
+            raise HTTPException(status_code=404, detail="Photo not found")
+
+        etag = f'"{sha256}-{size_name}"' if size_name else f'"{sha256}"'
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return _not_modified(etag, cache_control)
+
+        path = os.path.join(UPLOAD_DIR, filename)
+        media_type = MEDIA_TYPES[extension]
+        cached = photo_cache.get(path)
+        if cached is not None:
+            content, media_type = cached
+            return _send(request, path, len(content), etag, media_type, cache_control, content)
+
+        if size_name is not None and await ensure_derivative(sha256, size_name) is None:
+            # Not decodable (or Pillow missing): fall back to the original
+            for original_extension in ("jpg", "png", "webp"):
+                original = os.path.join(UPLOAD_DIR, shard1, shard2, f"{sha256}.{original_extension}")
+                if await asyncio.to_thread(os.path.exists, original):
+                    path, media_type = original, MEDIA_TYPES[original_extension]
+                    etag, cache_control = f'"{sha256}"', FALLBACK_CACHE_CONTROL
+                    break
+            else:
+                raise HTTPException(status_code=404, detail="Photo not found")
+
+    elif _LEGACY_NAME.match(filename):
+        path = os.path.join(UPLOAD_DIR, filename)
+        media_type = MEDIA_TYPES[filename.rsplit(".", 1)[1]]
+        etag = None
+
+    else:
+        raise HTTPException(status_code=404, detail="Photo not found")
+
+    try:
+        stat_result = await asyncio.to_thread(os.stat, path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Photo not found")
+
+    if etag is None:
+        # Legacy names are unique per upload and never rewritten, so mtime+size is as good as a hash
+        etag = f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return _not_modified(etag, cache_control)
+
+    if cache_control == IMMUTABLE_CACHE_CONTROL and photo_cache.cacheable(stat_result.st_size):
+        content = await asyncio.to_thread(_read_small, path)
+        photo_cache.put(path, content, media_type)
+        return _send(request, path, len(content), etag, media_type, cache_control, content)
+
+    return _send(request, path, stat_result.st_size, etag, media_type, cache_control)
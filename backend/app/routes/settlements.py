@@ -0,0 +1,78 @@
+import asyncio
+
+from fastapi import APIRouter, HTTPException, Query
+from datetime import datetime
+from typing import Optional
+from app.services.ledger import InsufficientBalanceError
+from app.services.settlement import (
+    run_settlement_cycle,
+    submit_batch,
+    get_batch,
+    get_batch_items,
+    list_batches
+)
+
+router = APIRouter()
+
+
+@router.post("/settlements/run")
+async def run_settlement(
+    window_start: Optional[datetime] = Query(None, description="Include releases at or after this time (UTC)"),
+    window_end: Optional[datetime] = Query(None, description="Include releases before this time (UTC, default now)")
+):
+    """
+    Admin: Run a settlement cycle.
+
+    Aggregates all unpaid fund releases in the window per seller and
+    produces a single payout batch. Runs in a worker thread so a large
+    cycle doesn't block other requests.
+    """
+    try:
+        batch = await asyncio.to_thread(run_settlement_cycle, window_start, window_end)
+    except InsufficientBalanceError as e:
+        # Ledger says a seller is owed less than this batch would pay them
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Settlement error: {str(e)}")
+
+    if not batch:
+        return {"message": "Nothing to settle", "batch": None}
+
+    return {"message": "Settlement batch created", "batch": batch}
+
+
+@router.get("/settlements")
+async def list_settlements(limit: int = Query(50, ge=1, le=500)):
+    """Admin: List recent payout batches."""
+    batches = list_batches(limit)
+    return {"batches": batches, "count": len(batches)}
+
+
+@router.get("/settlements/{batch_id}")
+async def get_settlement(
+    batch_id: str,
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0)
+):
+    """Admin: Get a payout batch with its per-seller lines."""
+    batch = get_batch(batch_id)
+    if not batch:
+        raise HTTPException(status_code=404, detail="Payout batch not found")
+
+    return {
+        "batch": batch,
+        "items": get_batch_items(batch_id, limit=limit, offset=offset)
+    }
+
+
+@router.post("/settlements/{batch_id}/retry")
+async def retry_settlement(batch_id: str):
+    """Admin: Resubmit a failed payout batch."""
+    batch = get_batch(batch_id)
+    if not batch:
+        raise HTTPException(status_code=404, detail="Payout batch not found")
+
+    if batch["status"] == "submitted":
+        raise HTTPException(status_code=400, detail="Payout batch already submitted")
+
+    return {"batch": await asyncio.to_thread(submit_batch, batch_id)}
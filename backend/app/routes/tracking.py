@@ -87,10 +87,8 @@ async def update_location(order_id: str, location: LocationUpdate):
         }
         
         # Add ETA if this is delivery person tracking
+        # (buyer location isn't stored yet, so there is no ETA until it is)
         if location.tracker_type == "delivery_person":
-            buyer_lat = float(Query(None))  # Will need to be stored in database
-            buyer_lon = float(Query(None))
-            
             if buyer_lat and buyer_lon:
                 eta = estimate_delivery_time(
                     location.latitude,
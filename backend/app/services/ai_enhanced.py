@@ -3,20 +3,26 @@ Enhanced Gemini AI services for Soko Pay
 Handles fraud detection, content optimization, analysis, and recommendations
 """
 
-import google.generativeai as genai
-import os
-from dotenv import load_dotenv
 import json
-from typing import List, Dict, Optional
+from typing import AsyncIterator, List, Dict, Optional
 
-load_dotenv()
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+from pydantic import ValidationError
+
+from app.models.ai import (
+    BatchCategorization, Categorization, ContentPolicyCheck, DisputeAnalysis, EnhancedFraudAssessment, MarketTips,
+    OptimizedDescription, RecommendationMessage, SellerQuality, SimilarProducts, SupportAnswer
+)
+from app.services.gemini_gateway import gemini_gateway
+from app.services.gemini_scheduler import Priority
+from app.services.metrics import FALLBACKS
+from app.utils.single_flight import coalesce
 
 
 # ============================================================================
 # 1. FRAUD DETECTION (Enhanced)
 # ============================================================================
 
+@coalesce
 async def check_fraud_risk_enhanced(order_data: dict) -> dict:
     """
     Enhanced fraud detection with more detailed analysis.
@@ -77,22 +83,13 @@ async def check_fraud_risk_enhanced(order_data: dict) -> dict:
     """
 
     try:
-        model = genai.GenerativeModel('gemini-pro')
-        response = model.generate_content(prompt)
-        result_text = response.text.strip()
-
-        # Clean markdown
-        if result_text.startswith("```json"):
-            result_text = result_text[7:]
-        if result_text.startswith("```"):
-            result_text = result_text[3:]
-        if result_text.endswith("```"):
-            result_text = result_text[:-3]
-
-        result = json.loads(result_text.strip())
-        return result
+        result = await gemini_gateway.generate_json(
+            "fraud_check_enhanced", prompt, Priority.MODERATION, EnhancedFraudAssessment
+        )
+        return result.model_dump()
 
     except Exception as e:
+        FALLBACKS.labels(path="fraud_check_enhanced").inc()
         print(f"Enhanced fraud detection error: {e}")
         return {
             "risk_score": 50,
@@ -108,20 +105,8 @@ async def check_fraud_risk_enhanced(order_data: dict) -> dict:
 # 2. PRODUCT DESCRIPTION OPTIMIZATION (NEW)
 # ============================================================================
 
-async def optimize_product_description(description: str, product_name: str, category: str) -> dict:
-    """
-    Improve product description for better sales and trust.
-    
-    Uses Gemini to rewrite descriptions that:
-    - Are more engaging and detailed
-    - Include key selling points
-    - Match Kenya market language
-    - Build buyer confidence
-    
-    Returns:
-        Optimized description and suggestions
-    """
-    prompt = f"""
+def _description_prompt(description: str, product_name: str, category: str) -> str:
+    return f"""
     You are a product description copywriter for Soko Pay (Kenya's social commerce).
     Improve this product description to increase sales and buyer trust:
 
@@ -149,31 +134,74 @@ async def optimize_product_description(description: str, product_name: str, cate
     }}
     """
 
+
+def _description_fallback(description: str, error: Exception) -> dict:
+    return {
+        "optimized_description": description,
+        "key_points": [],
+        "tone": "neutral",
+        "estimated_engagement_increase": "0%",
+        "suggestions": [f"Error: {str(error)}"]
+    }
+
+
+@coalesce
+async def optimize_product_description(description: str, product_name: str, category: str) -> dict:
+    """
+    Improve product description for better sales and trust.
+    
+    Uses Gemini to rewrite descriptions that:
+    - Are more engaging and detailed
+    - Include key selling points
+    - Match Kenya market language
+    - Build buyer confidence
+    
+    Returns:
+        Optimized description and suggestions
+    """
     try:
-        model = genai.GenerativeModel('gemini-pro')
-        response = model.generate_content(prompt)
-        result_text = response.text.strip()
+        result = await gemini_gateway.generate_json(
+            "optimize_description",
+            _description_prompt(description, product_name, category),
+            Priority.SELLER_TOOLS,
+            OptimizedDescription
+        )
+        return result.model_dump()
+
+    except Exception as e:
+        FALLBACKS.labels(path="optimize_description").inc()
+        return _description_fallback(description, e)
 
-        if result_text.startswith("```"):
-            result_text = result_text[result_text.find("{"):result_text.rfind("}")+1]
 
-        result = json.loads(result_text)
-        return result
+async def stream_product_description(description: str, product_name: str, category: str) -> AsyncIterator[dict]:
+    """
+    optimize_product_description, streamed as Gemini writes it.
 
+    Yields:
+        {"type": "delta", "field": "optimized_description", "text": str} as
+        the description is written, {"type": "field", ...} as each other
+        field completes, then {"type": "done", "data": <full result>}.
+        On failure the last event is {"type": "error", "data": <fallback>}.
+    """
+    try:
+        async for event in gemini_gateway.stream_json(
+            "optimize_description_stream",
+            _description_prompt(description, product_name, category),
+            Priority.SELLER_TOOLS,
+            OptimizedDescription
+        ):
+            yield event
     except Exception as e:
-        return {
-            "optimized_description": description,
-            "key_points": [],
-            "tone": "neutral",
-            "estimated_engagement_increase": "0%",
-            "suggestions": [f"Error: {str(e)}"]
-        }
+        FALLBACKS.labels(path="optimize_description_stream").inc()
+        print(f"Description streaming error: {e}")
+        yield {"type": "error", "data": _description_fallback(description, e)}
 
 
 # ============================================================================
 # 3. AUTOMATIC PRODUCT CATEGORIZATION (NEW)
 # ============================================================================
 
+@coalesce
 async def categorize_product(product_name: str, description: str) -> dict:
     """
     Automatically categorize product using AI.
@@ -200,11 +228,10 @@ async def categorize_product(product_name: str, description: str) -> dict:
     """
 
     try:
-        model = genai.GenerativeModel('gemini-pro')
-        response = model.generate_content(prompt)
-        result = json.loads(response.text.strip())
-        return result
+        result = await gemini_gateway.generate_json("categorize", prompt, Priority.SELLER_TOOLS, Categorization)
+        return result.model_dump()
     except Exception as e:
+        FALLBACKS.labels(path="categorize").inc()
         return {
             "category": "Other",
             "subcategory": None,
@@ -214,10 +241,70 @@ async def categorize_product(product_name: str, description: str) -> dict:
         }
 
 
+async def categorize_products_packed(products: List[dict]) -> List[Optional[dict]]:
+    """
+    Categorize several products with one Gemini prompt.
+
+    Args:
+        products: [{"product_name": str, "description": str}]
+
+    Returns:
+        One result per product, in order (categorize_product shape), or
+        None for listings the AI skipped or answered malformed
+    """
+    listings = [
+        {
+            "index": i,
+            "product_name": product.get("product_name"),
+            "description": product.get("description")
+        }
+        for i, product in enumerate(products)
+    ]
+    prompt = f"""
+    Categorize EACH of these products accurately for Soko Pay:
+
+    {json.dumps(listings, indent=2)}
+
+    VALID CATEGORIES: Electronics, Clothes & Fashion, Home & Garden, Sports, 
+    Books & Media, Toys & Games, Tools & Hardware, Motors & Parts, Beauty & Health, Other
+
+    Return ONLY a JSON array with one object per product:
+    [
+        {{
+            "index": <product index>,
+            "category": "<primary category>",
+            "subcategory": "<optional sub-category>",
+            "confidence": <0-100>,
+            "alternative_categories": ["<alt1>", "<alt2>"],
+            "reason": "<why this category>"
+        }}
+    ]
+    """
+
+    results: List[Optional[dict]] = [None] * len(products)
+    try:
+        items = await gemini_gateway.generate_json("categorize_batch", prompt, Priority.SELLER_TOOLS)
+    except Exception as e:
+        print(f"Batch categorization warning (non-blocking): {e}")
+        items = []
+
+    # Validated one by one so a single malformed item doesn't lose the pack
+    for item in items if isinstance(items, list) else []:
+        try:
+            result = BatchCategorization.model_validate(item)
+        except ValidationError:
+            continue
+        if result.index < len(products):
+            results[result.index] = result.model_dump(exclude={"index"})
+    FALLBACKS.labels(path="categorize_batch").inc(results.count(None))
+    return results
+
+
 # ============================================================================
 # 4. PRODUCT COMPARISON & MATCHING (NEW)
 # ============================================================================
 
+@coalesce
 async def find_similar_products(product_name: str, price: float, category: str, existing_products: List[dict]) -> dict:
     """
     Find similar products in database to check for duplicate listings/comparisons.
@@ -254,11 +341,10 @@ async def find_similar_products(product_name: str, price: float, category: str,
     """
 
     try:
-        model = genai.GenerativeModel('gemini-pro')
-        response = model.generate_content(prompt)
-        result = json.loads(response.text.strip())
-        return result
+        result = await gemini_gateway.generate_json("find_similar", prompt, Priority.SELLER_TOOLS, SimilarProducts)
+        return result.model_dump()
     except Exception as e:
+        FALLBACKS.labels(path="find_similar").inc()
         return {"similar_products": [], "market_positioning": "unknown", "recommendation": ""}
 
 
@@ -266,6 +352,7 @@ async def find_similar_products(product_name: str, price: float, category: str,
 # 5. SELLER QUALITY SCORING (NEW)
 # ============================================================================
 
+@coalesce
 async def score_seller_quality(seller_data: dict) -> dict:
     """
     Score seller quality based on multiple factors.
@@ -309,11 +396,10 @@ async def score_seller_quality(seller_data: dict) -> dict:
     """
 
     try:
-        model = genai.GenerativeModel('gemini-pro')
-        response = model.generate_content(prompt)
-        result = json.loads(response.text.strip())
-        return result
+        result = await gemini_gateway.generate_json("seller_quality", prompt, Priority.SELLER_TOOLS, SellerQuality)
+        return result.model_dump()
     except Exception as e:
+        FALLBACKS.labels(path="seller_quality").inc()
         return {
             "seller_score": 50,
             "trust_level": "moderate",
@@ -328,6 +414,7 @@ async def score_seller_quality(seller_data: dict) -> dict:
 # 6. DISPUTE RESOLUTION ANALYSIS (NEW)
 # ============================================================================
 
+@coalesce
 async def analyze_dispute(dispute_data: dict) -> dict:
     """
     Analyze dispute details to recommend resolution.
@@ -367,11 +454,10 @@ async def analyze_dispute(dispute_data: dict) -> dict:
     """
 
     try:
-        model = genai.GenerativeModel('gemini-pro')
-        response = model.generate_content(prompt)
-        result = json.loads(response.text.strip())
-        return result
+        result = await gemini_gateway.generate_json("analyze_dispute", prompt, Priority.MODERATION, DisputeAnalysis)
+        return result.model_dump()
     except Exception as e:
+        FALLBACKS.labels(path="analyze_dispute").inc()
         return {
             "buyer_claim_strength": 50,
             "seller_defense_strength": 50,
@@ -386,17 +472,12 @@ async def analyze_dispute(dispute_data: dict) -> dict:
 # 7. CUSTOMER SUPPORT CHATBOT (NEW)
 # ============================================================================
 
-async def handle_support_query(query: str, context: Optional[dict] = None) -> dict:
-    """
-    Handle customer support queries using Gemini.
-    
-    Can answer FAQs, help with orders, provide guidance.
-    """
+def _support_prompt(query: str, context: Optional[dict] = None) -> str:
     context_text = ""
     if context:
         context_text = f"\n\nCONTEXT: {json.dumps(context, indent=2)}"
 
-    prompt = f"""
+    return f"""
     You are a helpful customer support agent for Soko Pay (Kenya's social commerce escrow platform).
     
     CUSTOMER QUERY: {query}
@@ -419,70 +500,88 @@ async def handle_support_query(query: str, context: Optional[dict] = None) -> di
     }}
     """
 
+
+SUPPORT_FALLBACK = {
+    "response": "I'm having trouble processing your request. Please contact our team directly.",
+    "category": "support_error",
+    "urgency": "medium",
+    "suggests_escalation": True,
+    "helpful_links": []
+}
+
+
+@coalesce
+async def handle_support_query(query: str, context: Optional[dict] = None) -> dict:
+    """
+    Handle customer support queries using Gemini.
+    
+    Can answer FAQs, help with orders, provide guidance.
+    """
     try:
-        model = genai.GenerativeModel('gemini-pro')
-        response = model.generate_content(prompt)
-        result = json.loads(response.text.strip())
-        return result
+        result = await gemini_gateway.generate_json(
+            "support", _support_prompt(query, context), Priority.ASSISTANT, SupportAnswer
+        )
+        return result.model_dump()
     except Exception as e:
-        return {
-            "response": "I'm having trouble processing your request. Please contact our team directly.",
-            "category": "support_error",
-            "urgency": "medium",
-            "suggests_escalation": True,
-            "helpful_links": []
-        }
+        FALLBACKS.labels(path="support").inc()
+        return dict(SUPPORT_FALLBACK)
+
+
+async def stream_support_query(query: str, context: Optional[dict] = None) -> AsyncIterator[dict]:
+    """
+    handle_support_query, streamed: the "response" text arrives as deltas,
+    the other fields as they complete, then a "done" event with the full
+    answer (or an "error" event carrying the fallback answer).
+    """
+    try:
+        async for event in gemini_gateway.stream_json(
+            "support_stream", _support_prompt(query, context), Priority.ASSISTANT, SupportAnswer
+        ):
+            yield event
+    except Exception as e:
+        FALLBACKS.labels(path="support_stream").inc()
+        print(f"Support streaming error: {e}")
+        yield {"type": "error", "data": dict(SUPPORT_FALLBACK)}
 
 
 # ============================================================================
 # 8. MARKET INSIGHTS & TRENDS (NEW)
 # ============================================================================
 
-async def generate_market_insights(product_category: str, recent_products: List[dict]) -> dict:
+@coalesce
+async def generate_market_insights(product_category: str, market_stats: dict) -> dict:
     """
-    Generate market insights for a category.
+    Write the narrative part of a category's market insights.
     
-    Helps sellers understand trends and pricing.
+    The numbers (prices, trend, demand) are computed from order history
+    by app/services/market_insights.py; the AI only turns them into tips.
     """
     prompt = f"""
-    Analyze market trends in Soko Pay for {product_category}.
+    You are advising sellers on Soko Pay, a Kenyan social-commerce escrow platform.
+    Here are the market statistics for {product_category}, computed from real orders:
 
-    RECENT PRODUCTS IN THIS CATEGORY:
-    {json.dumps(recent_products[:20], indent=2)}
+    {json.dumps(market_stats, indent=2)}
 
-    ANALYZE:
-    1. Price trends (rising/falling/stable)
-    2. Popular features/attributes
-    3. Demand signals
-    4. Seller competition
-    5. Buyer expectations
+    Based ONLY on these numbers, give sellers practical advice.
 
     RETURN JSON:
     {{
-        "avg_price": <number>,
-        "price_range": {{"min": <number>, "max": <number>}},
-        "trend": "<declining|stable|growing>",
-        "demand_level": "<low|moderate|high|very_high>",
         "popular_features": ["<feature1>", "<feature2>"],
-        "seller_tips": ["<tip1>", "<tip2>"],
-        "forecast": "<3-month outlook>"
+        "seller_tips": ["<tip1>", "<tip2>", "<tip3>"],
+        "forecast": "<3-month outlook in one sentence>"
     }}
     """
 
     try:
-        model = genai.GenerativeModel('gemini-pro')
-        response = model.generate_content(prompt)
-        result = json.loads(response.text.strip())
-        return result
+        result = await gemini_gateway.generate_json("market_insights", prompt, Priority.SELLER_TOOLS, MarketTips)
+        return result.model_dump()
     except Exception as e:
+        FALLBACKS.labels(path="market_insights").inc()
+        print(f"Market tips AI error: {e}")
         return {
-            "avg_price": 0,
-            "price_range": {"min": 0, "max": 0},
-            "trend": "unknown",
-            "demand_level": "unknown",
             "popular_features": [],
             "seller_tips": [],
-            "forecast": "Insufficient data"
+            "forecast": ""
         }
 
 
@@ -490,6 +589,7 @@ async def generate_market_insights(product_category: str, recent_products: List[
 # 9. CONTENT MODERATION (NEW)
 # ============================================================================
 
+@coalesce
 async def check_content_policy(content: str, content_type: str) -> dict:
     """
     Check if content violates policies.
@@ -521,11 +621,10 @@ async def check_content_policy(content: str, content_type: str) -> dict:
     """
 
     try:
-        model = genai.GenerativeModel('gemini-pro')
-        response = model.generate_content(prompt)
-        result = json.loads(response.text.strip())
-        return result
+        result = await gemini_gateway.generate_json("content_policy", prompt, Priority.MODERATION, ContentPolicyCheck)
+        return result.model_dump()
     except Exception as e:
+        FALLBACKS.labels(path="content_policy").inc()
         return {
             "is_safe": True,
             "confidence": 0,
@@ -540,47 +639,37 @@ async def check_content_policy(content: str, content_type: str) -> dict:
 # 10. PERSONALIZED RECOMMENDATIONS (NEW)
 # ============================================================================
 
-async def get_product_recommendations(buyer_profile: dict, recent_purchases: List[str]) -> dict:
+@coalesce
+async def generate_recommendation_message(buyer_profile: dict, recommendations: List[dict]) -> Optional[str]:
     """
-    Get personalized product recommendations for buyer.
+    Write a personalized message for recommendations.
     
-    Increases engagement and sales.
+    The recommendations themselves come from order history
+    (app/services/recommender.py); the AI only words the message.
+    Returns None if the AI is unavailable.
     """
     prompt = f"""
-    Generate personalized product recommendations for this Soko Pay buyer.
+    Write a short, friendly message (max 2 sentences) for a Soko Pay buyer in Kenya
+    introducing these recommended products.
 
     BUYER PROFILE:
     {json.dumps(buyer_profile, indent=2)}
 
-    RECENT PURCHASES:
-    {json.dumps(recent_purchases, indent=2)}
-
-    RECOMMENDATIONS SHOULD:
-    1. Match buyer's past interests
-    2. Include varied price points
-    3. Be realistic/available in Kenya
-    4. Include categories they haven't bought
-    5. Match their budget
+    RECOMMENDED PRODUCTS:
+    {json.dumps([{"product_type": r["product_type"], "why": r["why_recommended"]} for r in recommendations], indent=2)}
 
     RETURN JSON:
     {{
-        "recommendations": [
-            {{
-                "product_type": "<type>",
-                "category": "<category>",
-                "estimated_price_range": {{"min": <num>, "max": <num>}},
-                "why_recommended": "<reason>",
-                "search_keywords": ["<keyword1>"]
-            }}
-        ],
         "message": "<personalized message to buyer>"
     }}
     """
 
     try:
-        model = genai.GenerativeModel('gemini-pro')
-        response = model.generate_content(prompt)
-        result = json.loads(response.text.strip())
-        return result
+        result = await gemini_gateway.generate_json(
+            "recommendation_message", prompt, Priority.ASSISTANT, RecommendationMessage
+        )
+        return result.message
     except Exception as e:
-        return {"recommendations": [], "message": "Unable to generate recommendations at this time"}
+        FALLBACKS.labels(path="recommendation_message").inc()
+        print(f"Recommendation message AI error: {e}")
+        return None
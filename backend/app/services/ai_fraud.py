@@ -1,13 +1,21 @@
-import google.generativeai as genai
-import os
-from dotenv import load_dotenv
+import asyncio
 import json
+from typing import List, Optional
 
-load_dotenv()
+from pydantic import ValidationError
 
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+from app.models.ai import BatchFraudAssessment, FraudAssessment
+from app.services.fraud_model import triage
+from app.services.fraud_rules import RulePack, get_rule_pack
+from app.services.gemini_gateway import gemini_gateway
+from app.services.gemini_scheduler import Priority
+from app.services.metrics import FALLBACKS
+from app.utils.single_flight import coalesce
 
+REQUIRED_FRAUD_KEYS = ["risk_score", "risk_level", "reason", "flags"]
 
+
+@coalesce
 async def check_fraud_risk(order_data: dict) -> dict:
     """
     Use Gemini AI to detect fraudulent transactions.
@@ -30,6 +38,11 @@ async def check_fraud_risk(order_data: dict) -> dict:
         }
     """
 
+    # First stage: confident local answers skip Gemini entirely
+    local_result = local_fraud_detection(order_data)
+    if local_result:
+        return local_result
+
     prompt = f"""
     You are a fraud detection AI for an e-commerce platform in Kenya.
     Analyze this transaction for fraud risk:
@@ -67,67 +80,73 @@ async def check_fraud_risk(order_data: dict) -> dict:
     """
 
     try:
-        model = genai.GenerativeModel('gemini-pro')
-        response = model.generate_content(prompt)
-
-        result_text = response.text.strip()
-
-        # Remove markdown code blocks if present
-        if result_text.startswith("```json"):
-            result_text = result_text[7:]
-        if result_text.startswith("```"):
-            result_text = result_text[3:]
-        if result_text.endswith("```"):
-            result_text = result_text[:-3]
-
-        result = json.loads(result_text.strip())
-
-        # Validate structure
-        required_keys = ["risk_score", "risk_level", "reason", "flags"]
-        if not all(key in result for key in required_keys):
-            raise ValueError("Invalid response structure from AI")
-
-        return result
+        result = await gemini_gateway.generate_json("fraud_check", prompt, Priority.FRAUD, FraudAssessment)
+        return result.model_dump()
 
     except Exception as e:
         print(f"AI fraud detection error: {e}")
         # Fallback to rule-based detection
+        FALLBACKS.labels(path="fraud_check").inc()
         return fallback_fraud_detection(order_data)
 
 
-def fallback_fraud_detection(order_data: dict) -> dict:
-    """Rule-based fraud detection (backup if AI fails)."""
-    risk_score = 0
-    flags = []
+def risk_level_for(risk_score: int) -> str:
+    """Map a 0-100 risk score to low / medium / high."""
+    if risk_score < 40:
+        return "low"
+    if risk_score < 70:
+        return "medium"
+    return "high"
 
-    description = order_data.get('description', '').lower()
-    price = order_data.get('price', 0)
-    product_name = order_data.get('product_name', '').lower()
 
-    # Check for suspicious keywords
-    suspicious_terms = [
-        'no refund', 'pay now', 'limited time', 'urgent',
-        'cash only', 'meet parking lot', 'wire transfer'
-    ]
+def local_fraud_detection(order_data: dict, rule_pack: RulePack = None, rules: Optional[dict] = None) -> Optional[dict]:
+    """
+    First-stage screen with the local classifier (see app/services/fraud_model.py).
+
+    Args:
+        order_data: Product and seller information
+        rule_pack: Rule pack to score with (default: the current one)
+        rules: This listing's fallback_fraud_detection result, if already computed
+
+    Returns:
+        A result in the check_fraud_risk shape when the model is confident,
+        or None when the listing should go to Gemini.
+    """
+    rules = rules or fallback_fraud_detection(order_data, rule_pack)
+    decision, probability = triage(order_data, rules["risk_level"])
+    if decision == "uncertain":
+        return None
+
+    if decision == "risky":
+        risk_score = max(rules["risk_score"], round(probability * 100))
+        flags = rules["flags"] + ["local_model_high_risk"]
+    else:
+        risk_score = rules["risk_score"]
+        flags = rules["flags"]
 
-    for term in suspicious_terms:
-        if term in description:
-            risk_score += 20
-            flags.append(f"suspicious_term:{term}")
-
-    # Check price anomalies for electronics
-    price_benchmarks = {
-        'iphone': 50000,
-        'macbook': 60000,
-        'samsung tv': 30000,
-        'playstation': 40000,
-        'ps5': 40000,
+    return {
+        "risk_score": risk_score,
+        "risk_level": risk_level_for(risk_score),
+        "reason": f"Local model ({probability:.0%} fraud probability). {rules['reason']}",
+        "flags": flags
     }
 
-    for item, min_price in price_benchmarks.items():
-        if item in product_name and price < min_price:
-            risk_score += 30
-            flags.append(f"price_too_low_for_{item.replace(' ', '_')}")
+
+def fallback_fraud_detection(order_data: dict, rule_pack: RulePack = None) -> dict:
+    """
+    Rule-based fraud detection (backup if AI fails).
+
+    Scam phrases and price benchmarks come from the compiled rule pack
+    (see app/services/fraud_rules.py); each text is scanned once.
+    """
+    rule_pack = rule_pack or get_rule_pack()
+
+    description = (order_data.get('description') or '').lower()
+    price = order_data.get('price') or 0
+    product_name = (order_data.get('product_name') or '').lower()
+
+    # Suspicious phrases and price anomalies for known products
+    risk_score, flags = rule_pack.evaluate(description, product_name, price)
 
     # Very cheap items (possible bait)
     if price < 100:
@@ -141,14 +160,7 @@ def fallback_fraud_detection(order_data: dict) -> dict:
 
     # Cap at 100
     risk_score = min(risk_score, 100)
-
-    # Determine risk level
-    if risk_score < 40:
-        risk_level = "low"
-    elif risk_score < 70:
-        risk_level = "medium"
-    else:
-        risk_level = "high"
+    risk_level = risk_level_for(risk_score)
 
     reason = f"Rule-based detection: {', '.join(flags) if flags else 'No major red flags'}"
 
@@ -160,6 +172,112 @@ def fallback_fraud_detection(order_data: dict) -> dict:
     }
 
 
+def fallback_fraud_detection_batch(orders: List[dict]) -> List[dict]:
+    """Rule-based detection for a whole chunk of orders (same rule pack for the chunk)."""
+    rule_pack = get_rule_pack()
+    return [fallback_fraud_detection(order_data, rule_pack) for order_data in orders]
+
+
+def _screen_batch(orders: List[dict], results: List[dict]) -> List[int]:
+    """
+    Replace rule results with the local model's where it is confident.
+
+    Returns:
+        Indexes of the listings that still need Gemini
+    """
+    escalate = []
+    for i, order_data in enumerate(orders):
+        local_result = local_fraud_detection(order_data, rules=results[i])
+        if local_result:
+            results[i] = local_result
+        else:
+            escalate.append(i)
+    return escalate
+
+
+async def check_fraud_risk_batch(orders: List[dict], use_ai: bool = True, pack_size: int = 20) -> List[dict]:
+    """
+    Score many listings, packing up to `pack_size` into one Gemini prompt.
+
+    Args:
+        orders: List of order_data dicts (same shape as check_fraud_risk)
+        use_ai: If False, only run the rule-based detection
+        pack_size: Listings per Gemini request
+
+    Returns:
+        One result per input order, in order. Listings the local model is
+        confident about never reach Gemini; ones the AI skipped or answered
+        malformed fall back to rule-based detection.
+    """
+    # CPU-bound scoring of the whole chunk runs off the event loop
+    results = await asyncio.to_thread(fallback_fraud_detection_batch, orders)
+    if not use_ai:
+        return results
+
+    # Only listings the local model is unsure about are sent to Gemini
+    escalate = await asyncio.to_thread(_screen_batch, orders, results)
+
+    for start in range(0, len(escalate), pack_size):
+        pack_indexes = escalate[start:start + pack_size]
+        pack = [orders[i] for i in pack_indexes]
+        listings = [
+            {
+                "index": i,
+                "product_name": order_data.get('product_name'),
+                "price": order_data.get('price'),
+                "description": order_data.get('description'),
+                "seller_phone": order_data.get('seller_phone')
+            }
+            for i, order_data in enumerate(pack)
+        ]
+
+        prompt = f"""
+    You are a fraud detection AI for an e-commerce platform in Kenya.
+    Analyze EACH of these listings independently for fraud risk:
+
+    {json.dumps(listings, indent=2)}
+
+    Common scam patterns in Kenya:
+    - "Pay now, no refunds" -> High risk
+    - Prices way below market value -> High risk
+    - Vague descriptions -> Medium risk
+    - Electronics priced <50% market value -> High risk
+
+    Return ONLY a JSON array with one object per listing:
+    [
+        {{
+            "index": <listing index>,
+            "risk_score": <0-100>,
+            "risk_level": "<low|medium|high>",
+            "reason": "<brief explanation>",
+            "flags": ["<flag1>", "<flag2>"]
+        }}
+    ]
+    """
+
+        try:
+            # Bulk re-screening queues behind live order/payment checks
+            items = await gemini_gateway.generate_json("fraud_check_batch", prompt, Priority.MODERATION)
+
+            # Validated one by one so a single malformed item doesn't lose the pack
+            answered = set()
+            for item in items if isinstance(items, list) else []:
+                try:
+                    assessment = BatchFraudAssessment.model_validate(item)
+                except ValidationError:
+                    continue
+                if assessment.index < len(pack):
+                    results[pack_indexes[assessment.index]] = assessment.model_dump(include=set(REQUIRED_FRAUD_KEYS))
+                    answered.add(assessment.index)
+            FALLBACKS.labels(path="fraud_check_batch").inc(len(pack) - len(answered))
+
+        except Exception as e:
+            print(f"AI batch fraud detection error: {e}")
+            FALLBACKS.labels(path="fraud_check_batch").inc(len(pack))
+
+    return results
+
+
 # Quick test function
 if __name__ == "__main__":
     import asyncio
@@ -0,0 +1,328 @@
+"""
+Local product categorizer for Soko Pay
+Multinomial naive Bayes over hashed n-grams, trained from
+orders.product_category; Gemini is only asked when it isn't confident
+"""
+
+import asyncio
+import gzip
+import json
+import math
+import os
+import random
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from app.config import MODEL_DIR
+from app.services.ai_enhanced import categorize_product, categorize_products_packed
+from app.utils.text_features import DEFAULT_FEATURE_BITS, hash_feature, tokenize, word_ngrams
+from database import get_db
+
+CATEGORIZER_PATH = os.path.join(MODEL_DIR, "categorizer.json.gz")
+
+# Below this confidence (0-100) the listing is sent to Gemini instead
+CATEGORIZER_MIN_CONFIDENCE = float(os.getenv("CATEGORIZER_MIN_CONFIDENCE", "60"))
+
+# Per batch call, at most MAX_AI_LISTINGS of those go to Gemini, PACK_SIZE
+# per prompt with the prompts sent concurrently; the rest keep the local guess
+CATEGORIZER_MAX_AI_LISTINGS = int(os.getenv("CATEGORIZER_MAX_AI_LISTINGS", "100"))
+CATEGORIZER_PACK_SIZE = int(os.getenv("CATEGORIZER_PACK_SIZE", "20"))
+
+# Laplace smoothing for feature counts
+SMOOTHING = 0.1
+
+
+def category_features(product_name: str, description: str, bits: int = DEFAULT_FEATURE_BITS) -> List[int]:
+    """Hashed feature indexes for a listing (repeats count as extra evidence)"""
+    features = word_ngrams(tokenize(product_name), "n:")
+    features.extend("d:" + token for token in tokenize(description))
+    return [hash_feature(feature, bits) for feature in features]
+
+
+class CategoryModel:
+    """
+    Multinomial naive Bayes.
+
+    Stores log P(feature | category) only for features seen with that
+    category; unseen features use the category's smoothed default.
+    """
+
+    def __init__(self, categories: List[str], priors: List[float], log_probs: List[Dict[int, float]],
+                 unseen: List[float], bits: int = DEFAULT_FEATURE_BITS, meta: Optional[dict] = None):
+        self.categories = categories
+        self.priors = priors
+        self.log_probs = log_probs
+        self.unseen = unseen
+        self.bits = bits
+        self.meta = meta or {}
+
+    def predict_features(self, features: List[int]) -> List[Tuple[str, float]]:
+        """(category, probability) for every category, most likely first"""
+        scores = []
+        for prior, log_probs, unseen in zip(self.priors, self.log_probs, self.unseen):
+            scores.append(prior + sum(log_probs.get(index, unseen) for index in features))
+
+        top = max(scores)
+        exps = [math.exp(score - top) for score in scores]
+        total = sum(exps)
+        return sorted(
+            ((category, e / total) for category, e in zip(self.categories, exps)),
+            key=lambda item: item[1],
+            reverse=True
+        )
+
+    def predict(self, product_name: str, description: str) -> List[Tuple[str, float]]:
+        return self.predict_features(category_features(product_name, description, self.bits))
+
+    def save(self, path: str = CATEGORIZER_PATH) -> int:
+        """Write the model as gzipped JSON. Returns the file size in bytes."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        payload = {
+            "bits": self.bits,
+            "categories": self.categories,
+            "priors": [round(p, 5) for p in self.priors],
+            "unseen": [round(u, 5) for u in self.unseen],
+            "log_probs": [
+                {str(index): round(lp, 4) for index, lp in log_probs.items()}
+                for log_probs in self.log_probs
+            ],
+            "meta": self.meta,
+        }
+        tmp_path = f"{path}.part"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(payload, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+        return os.path.getsize(path)
+
+    @classmethod
+    def load(cls, path: str = CATEGORIZER_PATH) -> "CategoryModel":
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            payload = json.load(f)
+        return cls(
+            categories=payload["categories"],
+            priors=payload["priors"],
+            log_probs=[{int(index): lp for index, lp in log_probs.items()} for log_probs in payload["log_probs"]],
+            unseen=payload["unseen"],
+            bits=payload["bits"],
+            meta=payload.get("meta", {}),
+        )
+
+
+def train_categorizer(samples: List[Tuple[str, str, str]], bits: int = DEFAULT_FEATURE_BITS) -> CategoryModel:
+    """
+    Count features per category and turn them into smoothed log probabilities.
+
+    Args:
+        samples: (product_name, description, category) triples
+
+    Returns:
+        Trained CategoryModel
+    """
+    doc_counts: Dict[str, int] = {}
+    feature_counts: Dict[str, Dict[int, int]] = {}
+    totals: Dict[str, int] = {}
+    vocabulary = set()
+
+    for product_name, description, category in samples:
+        doc_counts[category] = doc_counts.get(category, 0) + 1
+        counts = feature_counts.setdefault(category, {})
+        for index in category_features(product_name, description, bits):
+            counts[index] = counts.get(index, 0) + 1
+            totals[category] = totals.get(category, 0) + 1
+            vocabulary.add(index)
+
+    categories = sorted(doc_counts)
+    vocab_size = len(vocabulary) or 1
+    priors, log_probs, unseen = [], [], []
+    for category in categories:
+        denominator = totals[category] + SMOOTHING * vocab_size
+        priors.append(math.log(doc_counts[category] / len(samples)))
+        log_probs.append({
+            index: math.log((count + SMOOTHING) / denominator)
+            for index, count in feature_counts[category].items()
+        })
+        unseen.append(math.log(SMOOTHING / denominator))
+
+    return CategoryModel(categories, priors, log_probs, unseen, bits, meta={
+        "trained_at": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()),
+        "samples": len(samples),
+    })
+
+
+# ============================================================================
+# Serving
+# ============================================================================
+
+_category_model: Optional[CategoryModel] = None
+_load_attempted = False
+
+
+def load_categorizer(path: str = CATEGORIZER_PATH) -> Optional[CategoryModel]:
+    """Load the saved model (called at startup). Without one, every listing goes to Gemini."""
+    global _category_model, _load_attempted
+    _load_attempted = True
+    if not os.path.exists(path):
+        print(f"Categorizer not found at {path} - categorization uses Gemini")
+        _category_model = None
+        return None
+    try:
+        _category_model = CategoryModel.load(path)
+        print(f"Categorizer loaded: {len(_category_model.categories)} categories, trained {_category_model.meta.get('trained_at')}")
+    except Exception as e:
+        print(f"Categorizer load warning (non-blocking): {e}")
+        _category_model = None
+    return _category_model
+
+
+def get_categorizer() -> Optional[CategoryModel]:
+    if not _load_attempted:
+        load_categorizer()
+    return _category_model
+
+
+def predict_categories(products: List[dict]) -> List[Optional[dict]]:
+    """
+    Categorize many listings locally.
+
+    Args:
+        products: [{"product_name": str, "description": str}]
+
+    Returns:
+        One result per product in the /ai/categorize shape, or None for
+        every product when no model is loaded
+    """
+    model = get_categorizer()
+    if model is None:
+        return [None] * len(products)
+
+    results = []
+    for product in products:
+        ranked = model.predict(product.get("product_name"), product.get("description"))
+        category, probability = ranked[0]
+        results.append({
+            "category": category,
+            "subcategory": None,
+            "confidence": round(probability * 100),
+            "alternative_categories": [alt for alt, p in ranked[1:3] if p >= 0.01],
+            "reason": "Matched against categories of past Soko Pay listings"
+        })
+    return results
+
+
+def _uncategorized() -> dict:
+    return {
+        "category": "Other",
+        "subcategory": None,
+        "confidence": 0,
+        "alternative_categories": [],
+        "reason": "No local model and the AI did not answer"
+    }
+
+
+async def categorize_batch(products: List[dict]) -> List[dict]:
+    """
+    Categorize many listings, asking Gemini only below CATEGORIZER_MIN_CONFIDENCE.
+
+    Unsure listings are packed CATEGORIZER_PACK_SIZE to a Gemini prompt and
+    the prompts sent together. Only the CATEGORIZER_MAX_AI_LISTINGS least
+    confident go to Gemini; the rest keep the local guess.
+
+    Args:
+        products: [{"product_name": str, "description": str}]
+
+    Returns:
+        One /ai/categorize result per product, in order. If Gemini fails
+        for a listing, the local guess is returned rather than "Other".
+    """
+    results = predict_categories(products)
+    escalate = [
+        i for i, local in enumerate(results)
+        if not local or local["confidence"] < CATEGORIZER_MIN_CONFIDENCE
+    ]
+    escalate.sort(key=lambda i: results[i]["confidence"] if results[i] else -1)
+    escalate = escalate[:CATEGORIZER_MAX_AI_LISTINGS]
+
+    packs = [escalate[start:start + CATEGORIZER_PACK_SIZE] for start in range(0, len(escalate), CATEGORIZER_PACK_SIZE)]
+    answers = await asyncio.gather(*(categorize_products_packed([products[i] for i in pack]) for pack in packs))
+    for pack, pack_answers in zip(packs, answers):
+        for i, answer in zip(pack, pack_answers):
+            if answer and (answer["confidence"] or not results[i]):
+                results[i] = answer
+
+    return [result or _uncategorized() for result in results]
+
+
+async def categorize(product_name: str, description: str) -> dict:
+    """Categorize one listing, asking Gemini only below CATEGORIZER_MIN_CONFIDENCE"""
+    local = predict_categories([{"product_name": product_name, "description": description}])[0]
+    if local and local["confidence"] >= CATEGORIZER_MIN_CONFIDENCE:
+        return local
+
+    result = await categorize_product(product_name, description)
+    return local if local and not result.get("confidence") else result
+
+
+# ============================================================================
+# Training data
+# ============================================================================
+
+def labeled_listings() -> Iterator[Tuple[str, str, str]]:
+    """Stream (product_name, description, category) for categorized orders"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT product_name, product_description, product_category
+            FROM orders
+            WHERE product_category IS NOT NULL AND product_category != ''
+            ORDER BY id
+        """)
+        while True:
+            rows = cursor.fetchmany(1000)
+            if not rows:
+                break
+            for row in rows:
+                yield row["product_name"], row["product_description"] or "", row["product_category"]
+
+
+# Train from order history:
+#   python -m app.services.categorizer [--holdout 0.2] [--output models/categorizer.json.gz]
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Train the local product categorizer")
+    parser.add_argument("--holdout", type=float, default=0.2, help="Share of orders kept for evaluation")
+    parser.add_argument("--output", default=CATEGORIZER_PATH)
+    args = parser.parse_args()
+
+    samples = list(labeled_listings())
+    if not samples:
+        raise SystemExit("No categorized orders to train on")
+
+    random.Random(7).shuffle(samples)
+    split = int(len(samples) * (1 - args.holdout))
+    train, held_out = samples[:split], samples[split:]
+
+    started = time.perf_counter()
+    model = train_categorizer(train)
+    print(f"Trained on {len(train)} orders ({len(model.categories)} categories) in {time.perf_counter() - started:.1f}s")
+
+    if held_out:
+        correct = confident = confident_correct = 0
+        started = time.perf_counter()
+        for product_name, description, category in held_out:
+            predicted, probability = model.predict(product_name, description)[0]
+            correct += int(predicted == category)
+            if probability * 100 >= CATEGORIZER_MIN_CONFIDENCE:
+                confident += 1
+                confident_correct += int(predicted == category)
+        elapsed = time.perf_counter() - started
+        print(json.dumps({
+            "samples": len(held_out),
+            "accuracy": round(correct / len(held_out), 4),
+            "answered_locally": round(confident / len(held_out), 4),
+            "local_accuracy": round(confident_correct / confident, 4) if confident else None,
+            "microseconds_per_listing": round(elapsed / len(held_out) * 1e6, 1),
+        }, indent=2))
+
+    size = model.save(args.output)
+    print(f"Saved {args.output} ({size / 1024:.1f} KB)")
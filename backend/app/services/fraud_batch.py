@@ -0,0 +1,307 @@
+"""
+Batch fraud re-scoring for Soko Pay
+Streams orders in keyset-paginated chunks with resumable checkpoints
+"""
+
+import asyncio
+import json
+import os
+import time
+import uuid
+from typing import Callable, List, Optional
+
+from app.services.ai_fraud import check_fraud_risk_batch
+from database import get_db
+
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_PACK_SIZE = 20
+
+# A running job touches updated_at this often; one that hasn't for
+# RESCORE_STALE_SECONDS is taken to have lost its worker and can be resumed
+RESCORE_HEARTBEAT_SECONDS = float(os.getenv("RESCORE_HEARTBEAT_SECONDS", "30"))
+RESCORE_STALE_SECONDS = float(os.getenv("RESCORE_STALE_SECONDS", "120"))
+
+# Statuses a job can be (re)started from, besides a stale 'running'
+RESUMABLE_STATUSES = ("pending", "interrupted", "failed")
+
+
+class RescoreJobLost(Exception):
+    """Another runner claimed the job (ours was presumed dead)"""
+
+
+def order_to_fraud_input(order: dict) -> dict:
+    """Map an orders row to the order_data shape the fraud detectors expect"""
+    return {
+        "product_name": order["product_name"],
+        "price": order["product_price"],
+        "description": order["product_description"],
+        "seller_phone": order["seller_phone"],
+        "category": order["product_category"] or "Other"
+    }
+
+
+# ============================================================================
+# Jobs
+# ============================================================================
+
+def create_rescore_job(
+    use_ai: bool = False,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    pack_size: int = DEFAULT_PACK_SIZE
+) -> dict:
+    """Register a new re-scoring job over all orders"""
+    job_id = f"FJ{uuid.uuid4().hex[:12].upper()}"
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM orders")
+        total = cursor.fetchone()[0]
+        cursor.execute("""
+            INSERT INTO fraud_rescore_jobs (id, status, use_ai, chunk_size, pack_size, total)
+            VALUES (?, 'pending', ?, ?, ?, ?)
+        """, (job_id, int(use_ai), chunk_size, pack_size, total))
+        conn.commit()
+    return get_rescore_job(job_id)
+
+
+def get_rescore_job(job_id: str) -> Optional[dict]:
+    """Get job progress by ID"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT *, status = 'running' AND updated_at < datetime('now', ?) AS stale
+            FROM fraud_rescore_jobs WHERE id = ?
+        """, (f"-{RESCORE_STALE_SECONDS} seconds", job_id))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        job = dict(row)
+        job["use_ai"] = bool(job["use_ai"])
+        job["stale"] = bool(job["stale"])
+        job["progress_percent"] = round(job["processed"] / job["total"] * 100, 1) if job["total"] else 100.0
+        return job
+
+
+def claim_rescore_job(job_id: str) -> Optional[str]:
+    """
+    Mark a job running under a new runner ID, unless a live runner has it.
+
+    Pending, interrupted and failed jobs can be claimed, and so can a
+    running job whose heartbeat is older than RESCORE_STALE_SECONDS. The
+    claim is one conditional UPDATE, so two resumes can't both win.
+
+    Returns:
+        The runner ID to pass to run_rescore_job, or None if the job is
+        missing, completed or still running
+    """
+    runner_id = uuid.uuid4().hex
+    placeholders = ", ".join("?" * len(RESUMABLE_STATUSES))
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            UPDATE fraud_rescore_jobs
+            SET status = 'running', runner_id = ?, error = NULL, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND (
+                status IN ({placeholders})
+                OR (status = 'running' AND updated_at < datetime('now', ?))
+            )
+        """, (runner_id, job_id, *RESUMABLE_STATUSES, f"-{RESCORE_STALE_SECONDS} seconds"))
+        conn.commit()
+        return runner_id if cursor.rowcount == 1 else None
+
+
+def interrupt_stale_rescore_jobs() -> int:
+    """
+    Startup: mark running jobs whose worker stopped heartbeating as interrupted.
+
+    Returns:
+        Number of jobs marked
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE fraud_rescore_jobs
+            SET status = 'interrupted', runner_id = NULL, updated_at = CURRENT_TIMESTAMP
+            WHERE status = 'running' AND updated_at < datetime('now', ?)
+        """, (f"-{RESCORE_STALE_SECONDS} seconds",))
+        conn.commit()
+        return cursor.rowcount
+
+
+def _set_status(job_id: str, runner_id: str, status: str, error: Optional[str] = None) -> bool:
+    """Update the job's status if `runner_id` still owns it"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE fraud_rescore_jobs
+            SET status = ?, error = ?, updated_at = CURRENT_TIMESTAMP,
+                finished_at = CASE WHEN ? IN ('completed', 'failed') THEN CURRENT_TIMESTAMP ELSE finished_at END
+            WHERE id = ? AND runner_id = ?
+        """, (status, error, status, job_id, runner_id))
+        conn.commit()
+        return cursor.rowcount == 1
+
+
+def _heartbeat(job_id: str, runner_id: str) -> bool:
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE fraud_rescore_jobs SET updated_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND runner_id = ? AND status = 'running'
+        """, (job_id, runner_id))
+        conn.commit()
+        return cursor.rowcount == 1
+
+
+async def _run_heartbeat(job_id: str, runner_id: str):
+    """Keep the job fresh while a slow chunk (e.g. Gemini calls) is in flight"""
+    while True:
+        await asyncio.sleep(RESCORE_HEARTBEAT_SECONDS)
+        if not await asyncio.to_thread(_heartbeat, job_id, runner_id):
+            return
+
+
+def _fetch_chunk(after_id: Optional[str], limit: int) -> List[dict]:
+    """Next chunk of orders after the checkpoint (keyset pagination on id)"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT id, product_name, product_price, product_description,
+                   seller_phone, product_category
+            FROM orders
+            WHERE id > ?
+            ORDER BY id
+            LIMIT ?
+        """, (after_id or "", limit))
+        return [dict(row) for row in cursor.fetchall()]
+
+
+def _write_chunk(job_id: str, runner_id: str, orders: List[dict], results: List[dict]) -> int:
+    """
+    Write scores and advance the checkpoint in one transaction.
+
+    Raises:
+        RescoreJobLost: another runner owns the job; nothing is written
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.executemany("""
+            UPDATE orders
+            SET fraud_risk_score = ?, fraud_risk_level = ?, fraud_flags = ?
+            WHERE id = ?
+        """, [
+            (
+                result.get("risk_score"),
+                result.get("risk_level"),
+                json.dumps(result.get("flags", [])),
+                order["id"]
+            )
+            for order, result in zip(orders, results)
+        ])
+        updated = cursor.rowcount
+        cursor.execute("""
+            UPDATE fraud_rescore_jobs
+            SET last_order_id = ?, processed = processed + ?, updated = updated + ?,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND runner_id = ?
+        """, (orders[-1]["id"], len(orders), updated, job_id, runner_id))
+        if cursor.rowcount != 1:
+            conn.rollback()
+            raise RescoreJobLost(job_id)
+        conn.commit()
+    return updated
+
+
+async def run_rescore_job(
+    job_id: str,
+    progress: Optional[Callable[[dict], None]] = None,
+    runner_id: Optional[str] = None
+) -> dict:
+    """
+    Run (or resume) a re-scoring job until every order has been scored.
+
+    Each chunk's score writes and checkpoint are committed together, so a
+    crashed or interrupted job resumes from the last finished chunk.
+    Reads, scoring and writes run in worker threads, so the API stays
+    responsive while a job runs (it is started as a background task). The
+    job heartbeats while it runs; checkpoints are only written by the
+    runner that holds the claim, so two runners never score the same job.
+
+    Args:
+        job_id: Job created by create_rescore_job
+        progress: Optional callback, called with the job dict after each chunk
+        runner_id: Claim from claim_rescore_job; claimed here if not given
+
+    Returns:
+        Final job dict (unchanged if the job is completed or another runner has it)
+    """
+    job = get_rescore_job(job_id)
+    if not job:
+        raise ValueError(f"Rescore job {job_id} not found")
+    if runner_id is None:
+        runner_id = claim_rescore_job(job_id)
+        if runner_id is None:
+            return job
+        job = get_rescore_job(job_id)
+
+    started = time.perf_counter()
+    heartbeat = asyncio.create_task(_run_heartbeat(job_id, runner_id))
+
+    try:
+        after_id = job["last_order_id"]
+        while True:
+            orders = await asyncio.to_thread(_fetch_chunk, after_id, job["chunk_size"])
+            if not orders:
+                break
+
+            results = await check_fraud_risk_batch(
+                [order_to_fraud_input(order) for order in orders],
+                use_ai=job["use_ai"],
+                pack_size=job["pack_size"]
+            )
+            await asyncio.to_thread(_write_chunk, job_id, runner_id, orders, results)
+            after_id = orders[-1]["id"]
+
+            if progress:
+                current = get_rescore_job(job_id)
+                current["elapsed_seconds"] = round(time.perf_counter() - started, 2)
+                progress(current)
+
+        _set_status(job_id, runner_id, "completed")
+    except RescoreJobLost:
+        print(f"Rescore job {job_id} was taken over by another runner; stopping")
+    except asyncio.CancelledError:
+        _set_status(job_id, runner_id, "interrupted")
+        raise
+    except Exception as e:
+        print(f"Rescore job {job_id} failed: {e}")
+        _set_status(job_id, runner_id, "failed", str(e))
+    finally:
+        heartbeat.cancel()
+
+    return get_rescore_job(job_id)
+
+
+# Re-score from the command line:
+#   python -m app.services.fraud_batch [--ai] [--chunk-size N] [--pack-size N] [--resume JOB_ID]
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Re-score fraud risk for all orders")
+    parser.add_argument("--ai", action="store_true", help="Use Gemini (packed prompts) instead of rules only")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--pack-size", type=int, default=DEFAULT_PACK_SIZE)
+    parser.add_argument("--resume", metavar="JOB_ID", help="Resume an interrupted, failed or stale job")
+    args = parser.parse_args()
+
+    if args.resume:
+        job_id = args.resume
+    else:
+        job_id = create_rescore_job(args.ai, args.chunk_size, args.pack_size)["id"]
+        print(f"Started rescore job {job_id}")
+
+    def print_progress(job):
+        rate = job["processed"] / job["elapsed_seconds"] if job["elapsed_seconds"] else 0
+        print(f"  {job['processed']}/{job['total']} ({job['progress_percent']}%) - {rate:.0f} orders/s")
+
+    final = asyncio.run(run_rescore_job(job_id, progress=print_progress))
+    print(json.dumps(final, indent=2))
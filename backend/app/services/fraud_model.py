@@ -0,0 +1,297 @@
+"""
+Local fraud classifier for Soko Pay
+Hashed n-gram logistic regression trained on past fraud scores; screens
+listings so only uncertain ones are sent to Gemini
+"""
+
+import gzip
+import json
+import math
+import os
+import random
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from app.config import MODEL_DIR
+from app.utils.text_features import (
+    DEFAULT_FEATURE_BITS, hashed_features, price_bucket, tokenize, word_ngrams
+)
+from database import get_db
+
+FRAUD_MODEL_PATH = os.path.join(MODEL_DIR, "fraud_model.json.gz")
+
+# Stored scores at or above this (medium/high) are the "risky" class
+RISKY_LABEL_SCORE = 40
+
+# Probabilities outside this band are answered locally, inside go to Gemini
+FRAUD_MODEL_CLEAN_BELOW = float(os.getenv("FRAUD_MODEL_CLEAN_BELOW", "0.1"))
+FRAUD_MODEL_RISKY_ABOVE = float(os.getenv("FRAUD_MODEL_RISKY_ABOVE", "0.9"))
+
+
+def fraud_features(order_data: dict) -> List[str]:
+    """String features for one listing (same order_data shape as check_fraud_risk)"""
+    name_tokens = tokenize(order_data.get("product_name"))
+    features = word_ngrams(name_tokens, "n:")
+    features.extend(word_ngrams(tokenize(order_data.get("description")), "d:"))
+    features.append(price_bucket(order_data.get("price") or 0))
+    features.extend(f"{price_bucket(order_data.get('price') or 0)}:{token}" for token in name_tokens)
+    features.append(f"c:{(order_data.get('category') or 'other').lower()}")
+    return features
+
+
+class FraudModel:
+    """Sparse logistic regression over hashed features"""
+
+    def __init__(self, weights: Optional[Dict[int, float]] = None, bias: float = 0.0,
+                 bits: int = DEFAULT_FEATURE_BITS, meta: Optional[dict] = None):
+        self.weights = weights or {}
+        self.bias = bias
+        self.bits = bits
+        self.meta = meta or {}
+
+    def _score(self, vector: Dict[int, float]) -> float:
+        weights = self.weights
+        z = self.bias + sum(weights.get(index, 0.0) * value for index, value in vector.items())
+        # Clamp so exp() can't overflow on extreme inputs
+        return 1.0 / (1.0 + math.exp(-max(-30.0, min(30.0, z))))
+
+    def predict(self, order_data: dict) -> float:
+        """Probability that the listing is medium/high risk"""
+        return self._score(hashed_features(fraud_features(order_data), self.bits))
+
+    def save(self, path: str = FRAUD_MODEL_PATH) -> int:
+        """Write non-zero weights as gzipped JSON. Returns the file size in bytes."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        kept = sorted((index, round(w, 5)) for index, w in self.weights.items() if abs(w) >= 1e-4)
+        payload = {
+            "bits": self.bits,
+            "bias": round(self.bias, 6),
+            "indexes": [index for index, _ in kept],
+            "weights": [w for _, w in kept],
+            "meta": self.meta,
+        }
+        tmp_path = f"{path}.part"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(payload, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+        return os.path.getsize(path)
+
+    @classmethod
+    def load(cls, path: str = FRAUD_MODEL_PATH) -> "FraudModel":
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            payload = json.load(f)
+        return cls(
+            weights=dict(zip(payload["indexes"], payload["weights"])),
+            bias=payload["bias"],
+            bits=payload["bits"],
+            meta=payload.get("meta", {}),
+        )
+
+
+def train_model(
+    samples: List[Tuple[dict, int]],
+    epochs: int = 8,
+    learning_rate: float = 0.5,
+    l2: float = 1e-6,
+    bits: int = DEFAULT_FEATURE_BITS,
+    seed: int = 42
+) -> FraudModel:
+    """
+    Fit a FraudModel with plain SGD.
+
+    Args:
+        samples: (order_data, label) pairs, label 1 for medium/high risk
+        epochs: Passes over the data (learning rate decays each pass)
+        learning_rate: Initial step size
+        l2: L2 penalty, applied to the weights a sample touches
+
+    Returns:
+        Trained FraudModel
+    """
+    vectors = [(hashed_features(fraud_features(order_data), bits), label) for order_data, label in samples]
+    positives = sum(label for _, label in vectors)
+    model = FraudModel(bits=bits, meta={
+        "trained_at": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()),
+        "samples": len(vectors),
+        "positives": positives,
+    })
+    # Start from the base rate so early updates aren't spent learning it
+    if 0 < positives < len(vectors):
+        model.bias = math.log(positives / (len(vectors) - positives))
+
+    rng = random.Random(seed)
+    weights = model.weights
+    for epoch in range(epochs):
+        rng.shuffle(vectors)
+        step = learning_rate / (1 + epoch)
+        for vector, label in vectors:
+            gradient = model._score(vector) - label
+            model.bias -= step * gradient
+            for index, value in vector.items():
+                w = weights.get(index, 0.0)
+                weights[index] = w - step * (gradient * value + l2 * w)
+
+    return model
+
+
+# ============================================================================
+# Serving
+# ============================================================================
+
+_fraud_model: Optional[FraudModel] = None
+_load_attempted = False
+
+
+def load_fraud_model(path: str = FRAUD_MODEL_PATH) -> Optional[FraudModel]:
+    """Load the saved model (called at startup). Without one, every listing escalates."""
+    global _fraud_model, _load_attempted
+    _load_attempted = True
+    if not os.path.exists(path):
+        print(f"Fraud model not found at {path} - all listings go to Gemini")
+        _fraud_model = None
+        return None
+    try:
+        _fraud_model = FraudModel.load(path)
+        print(f"Fraud model loaded: {len(_fraud_model.weights)} weights, trained {_fraud_model.meta.get('trained_at')}")
+    except Exception as e:
+        print(f"Fraud model load warning (non-blocking): {e}")
+        _fraud_model = None
+    return _fraud_model
+
+
+def get_fraud_model() -> Optional[FraudModel]:
+    if not _load_attempted:
+        load_fraud_model()
+    return _fraud_model
+
+
+def triage(order_data: dict, rule_level: str) -> Tuple[str, Optional[float]]:
+    """
+    Decide whether a listing needs Gemini.
+
+    A listing is "clean" only if the model is confident AND the rule-based
+    check also found it low risk; "risky" if the model is confident it is
+    medium/high risk. Everything else is "uncertain" and escalates.
+
+    Args:
+        order_data: Listing (same shape as check_fraud_risk)
+        rule_level: risk_level from fallback_fraud_detection
+
+    Returns:
+        (decision, probability) - probability is None without a model
+    """
+    model = get_fraud_model()
+    if model is None:
+        return "uncertain", None
+
+    probability = model.predict(order_data)
+    if probability < FRAUD_MODEL_CLEAN_BELOW and rule_level == "low":
+        return "clean", probability
+    if probability > FRAUD_MODEL_RISKY_ABOVE:
+        return "risky", probability
+    return "uncertain", probability
+
+
+# ============================================================================
+# Training data and evaluation
+# ============================================================================
+
+def labeled_orders() -> Iterator[Tuple[dict, int]]:
+    """Stream (order_data, label) for every order that has a stored fraud score"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT product_name, product_price AS price, product_description AS description,
+                   seller_phone, product_category AS category, fraud_risk_score
+            FROM orders
+            WHERE fraud_risk_score IS NOT NULL
+            ORDER BY id
+        """)
+        while True:
+            rows = cursor.fetchmany(1000)
+            if not rows:
+                break
+            for row in rows:
+                order_data = dict(row)
+                label = int(order_data.pop("fraud_risk_score") >= RISKY_LABEL_SCORE)
+                yield order_data, label
+
+
+def evaluate(model: FraudModel, samples: List[Tuple[dict, int]], rule_levels: List[str]) -> dict:
+    """
+    Held-out report for a model.
+
+    Args:
+        model: Model to evaluate
+        samples: (order_data, label) pairs not used for training
+        rule_levels: fallback_fraud_detection risk_level per sample
+
+    Returns:
+        {
+            "samples": int,
+            "agreement": float (model at 0.5 vs stored label),
+            "answered_locally": int,
+            "gemini_call_reduction": float (share of listings not escalated),
+            "local_agreement": float (locally answered listings matching the label),
+            "microseconds_per_listing": float
+        }
+    """
+    global _fraud_model, _load_attempted
+    previous = (_fraud_model, _load_attempted)
+    _fraud_model, _load_attempted = model, True
+
+    try:
+        agree = local = local_agree = 0
+        started = time.perf_counter()
+        for (order_data, label), rule_level in zip(samples, rule_levels):
+            decision, probability = triage(order_data, rule_level)
+            agree += int((probability >= 0.5) == bool(label))
+            if decision != "uncertain":
+                local += 1
+                local_agree += int((decision == "risky") == bool(label))
+        elapsed = time.perf_counter() - started
+    finally:
+        _fraud_model, _load_attempted = previous
+
+    total = len(samples) or 1
+    return {
+        "samples": len(samples),
+        "agreement": round(agree / total, 4),
+        "answered_locally": local,
+        "gemini_call_reduction": round(local / total, 4),
+        "local_agreement": round(local_agree / local, 4) if local else None,
+        "microseconds_per_listing": round(elapsed / total * 1e6, 1),
+    }
+
+
+# Train from stored fraud scores:
+#   python -m app.services.fraud_model [--holdout 0.2] [--epochs 8] [--output models/fraud_model.json.gz]
+if __name__ == "__main__":
+    import argparse
+
+    from app.services.ai_fraud import fallback_fraud_detection
+
+    parser = argparse.ArgumentParser(description="Train the local fraud classifier")
+    parser.add_argument("--holdout", type=float, default=0.2, help="Share of orders kept for evaluation")
+    parser.add_argument("--epochs", type=int, default=8)
+    parser.add_argument("--output", default=FRAUD_MODEL_PATH)
+    args = parser.parse_args()
+
+    samples = list(labeled_orders())
+    if not samples:
+        raise SystemExit("No orders with fraud scores to train on")
+
+    random.Random(7).shuffle(samples)
+    split = int(len(samples) * (1 - args.holdout))
+    train, held_out = samples[:split], samples[split:]
+
+    started = time.perf_counter()
+    model = train_model(train, epochs=args.epochs)
+    print(f"Trained on {len(train)} orders in {time.perf_counter() - started:.1f}s")
+
+    if held_out:
+        rule_levels = [fallback_fraud_detection(order_data)["risk_level"] for order_data, _ in held_out]
+        print(json.dumps(evaluate(model, held_out, rule_levels), indent=2))
+
+    size = model.save(args.output)
+    print(f"Saved {args.output} ({size / 1024:.1f} KB)")
@@ -0,0 +1,245 @@
+"""
+Compiled rule packs for rule-based fraud detection
+Scam phrases and price benchmarks are loaded from JSON files, compiled into
+one trie-shaped regex per term set and reloaded when the files change
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+FRAUD_RULES_DIR = os.getenv(
+    "FRAUD_RULES_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "fraud_rules")
+)
+
+# How often (at most) the rule files' mtimes are checked
+FRAUD_RULES_RELOAD_SECONDS = float(os.getenv("FRAUD_RULES_RELOAD_SECONDS", "5"))
+
+PHRASES_FILE = "scam_phrases.json"
+BENCHMARKS_FILE = "price_benchmarks.json"
+
+# Below this many terms a plain `term in text` loop beats the compiled regex
+MIN_COMPILED_TERMS = 24
+
+DEFAULT_PHRASE_WEIGHT = 20
+PRICE_BENCHMARK_WEIGHT = 30
+
+
+# ============================================================================
+# Multi-pattern matcher
+# ============================================================================
+
+def _trie_pattern(terms: List[str]) -> str:
+    """
+    Regex alternation shaped like a trie of the terms.
+
+    Shared prefixes are matched once, so the regex engine does one
+    character comparison per trie edge instead of one per term. Longer
+    continuations are tried before ending, so the match is the longest
+    term starting at a position.
+    """
+    trie: dict = {}
+    for term in terms:
+        node = trie
+        for char in term:
+            node = node.setdefault(char, {})
+        node[""] = True
+
+    def build(node: dict) -> str:
+        ends_here = "" in node
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if ends_here:
+            if len(branches) == 1 and len(branches[0]) > 1:
+                body = "(?:" + body + ")"
+            return body + "?"
+        return body
+
+    return build(trie)
+
+
+class TermMatcher:
+    """
+    Finds every term occurring in a text in one pass.
+
+    All terms are compiled into a single trie regex. search() skips ahead
+    to the next position where a term starts and returns the longest term
+    there; shorter terms at the same start are its prefixes and come from
+    a precomputed table. Scanning resumes one character later, so matches
+    may overlap ("tuma pesa kwanza" also reports "pesa kwanza").
+
+    Tiny term sets (under MIN_COMPILED_TERMS) are scanned with `in`
+    instead, which is faster than the regex at that size.
+    """
+
+    def __init__(self, terms: List[str]):
+        self.terms = list(dict.fromkeys(term.lower() for term in terms if term))
+        self._index = {term: i for i, term in enumerate(self.terms)}
+        self._prefixes: Dict[str, Tuple[int, ...]] = {
+            term: tuple(
+                self._index[term[:end]] for end in range(1, len(term) + 1)
+                if term[:end] in self._index
+            )
+            for term in self.terms
+        }
+        self._regex = re.compile(_trie_pattern(self.terms)) if len(self.terms) >= MIN_COMPILED_TERMS else None
+
+    def match(self, text: str) -> List[int]:
+        """Indexes (into self.terms) of every term found in `text`, in term order"""
+        if not text:
+            return []
+        if self._regex is None:
+            return [i for i, term in enumerate(self.terms) if term in text]
+        found = set()
+        search = self._regex.search
+        m = search(text)
+        while m:
+            found.update(self._prefixes[m.group()])
+            m = search(text, m.start() + 1)
+        return sorted(found)
+
+
+# ============================================================================
+# Rule packs
+# ============================================================================
+
+class RulePack:
+    """One loaded, compiled set of scam phrases and price benchmarks"""
+
+    def __init__(self, phrases: List[dict], benchmarks: List[dict], version: str = ""):
+        self.version = version
+
+        weights: Dict[str, int] = {}
+        for rule in phrases:
+            term = rule["term"].lower().strip()
+            weights[term] = max(weights.get(term, 0), int(rule.get("weight", DEFAULT_PHRASE_WEIGHT)))
+        self.phrase_matcher = TermMatcher(list(weights))
+        self.phrase_weights = [weights[term] for term in self.phrase_matcher.terms]
+
+        min_prices: Dict[str, float] = {}
+        for rule in benchmarks:
+            item = rule["item"].lower().strip()
+            min_prices[item] = max(min_prices.get(item, 0), float(rule["min_price"]))
+        self.benchmark_matcher = TermMatcher(list(min_prices))
+        self.min_prices = [min_prices[item] for item in self.benchmark_matcher.terms]
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "version": self.version,
+            "phrases": len(self.phrase_matcher.terms),
+            "benchmarks": len(self.benchmark_matcher.terms),
+        }
+
+    def evaluate(self, description: str, product_name: str, price: float) -> Tuple[int, List[str]]:
+        """
+        Score phrase and price-benchmark hits for one listing.
+
+        Args:
+            description: Lowercased listing description
+            product_name: Lowercased product name
+            price: Listing price (KES)
+
+        Returns:
+            (risk_score, flags) before the generic price checks and capping
+        """
+        risk_score = 0
+        flags = []
+
+        for i in self.phrase_matcher.match(description):
+            risk_score += self.phrase_weights[i]
+            flags.append(f"suspicious_term:{self.phrase_matcher.terms[i]}")
+
+        for i in self.benchmark_matcher.match(product_name):
+            if price < self.min_prices[i]:
+                item = self.benchmark_matcher.terms[i]
+                risk_score += PRICE_BENCHMARK_WEIGHT
+                flags.append(f"price_too_low_for_{item.replace(' ', '_')}")
+
+        return risk_score, flags
+
+
+def load_rule_pack(rules_dir: str = FRAUD_RULES_DIR) -> RulePack:
+    """Read and compile the rule files in `rules_dir`"""
+    with open(os.path.join(rules_dir, PHRASES_FILE), encoding="utf-8") as f:
+        phrases = json.load(f)["phrases"]
+    with open(os.path.join(rules_dir, BENCHMARKS_FILE), encoding="utf-8") as f:
+        benchmarks = json.load(f)["benchmarks"]
+    return RulePack(phrases, benchmarks, version=_files_version(rules_dir))
+
+
+def _files_version(rules_dir: str) -> str:
+    mtimes = []
+    for name in (PHRASES_FILE, BENCHMARKS_FILE):
+        try:
+            mtimes.append(str(os.stat(os.path.join(rules_dir, name)).st_mtime_ns))
+        except OSError:
+            mtimes.append("missing")
+    return ":".join(mtimes)
+
+
+class RulePackLoader:
+    """
+    Holds the current rule pack and swaps in a new one when the files change.
+
+    Reloads are checked at most every FRAUD_RULES_RELOAD_SECONDS. A pack
+    that fails to load or compile is logged and the previous pack stays in
+    use, so a bad edit to the rule files never disables detection.
+    """
+
+    def __init__(self, rules_dir: str = FRAUD_RULES_DIR, reload_seconds: float = FRAUD_RULES_RELOAD_SECONDS):
+        self.rules_dir = rules_dir
+        self.reload_seconds = reload_seconds
+        self._pack: Optional[RulePack] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> RulePack:
+        now = time.monotonic()
+        if self._pack is not None and now - self._checked_at < self.reload_seconds:
+            return self._pack
+
+        with self._lock:
+            if self._pack is not None and now - self._checked_at < self.reload_seconds:
+                return self._pack
+            self._checked_at = now
+
+            version = _files_version(self.rules_dir)
+            if self._pack is not None and version == self._pack.version:
+                return self._pack
+
+            try:
+                pack = load_rule_pack(self.rules_dir)
+                if self._pack is not None:
+                    print(f"Fraud rules reloaded: {pack.stats}")
+                self._pack = pack
+            except Exception as e:
+                if self._pack is None:
+                    raise
+                print(f"Fraud rules reload warning (keeping previous pack): {e}")
+                # Don't retry the same broken files on every call
+                self._pack.version = version
+
+        return self._pack
+
+
+rule_pack_loader = RulePackLoader()
+
+
+def get_rule_pack() -> RulePack:
+    """Current compiled rule pack (hot-reloaded)"""
+    return rule_pack_loader.get()
+
+
+# Check and time the rule files from the command line:
+#   python -m app.services.fraud_rules
+if __name__ == "__main__":
+    started = time.perf_counter()
+    pack = load_rule_pack()
+    print(f"Compiled {pack.stats} in {(time.perf_counter() - started) * 1000:.1f} ms")
@@ -0,0 +1,384 @@
+"""
+Gemini gateway for Soko Pay
+The one place that talks to Gemini: shared model instances, scheduling,
+JSON parsing with schema validation, and per-feature metrics
+"""
+
+import asyncio
+import json
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import fields as dataclass_fields, is_dataclass
+from typing import Any, AsyncIterator, Dict, Optional, Type, TypeVar
+
+from pydantic import BaseModel, ValidationError
+
+from app.config import GEMINI_API_KEY, GEMINI_JSON_MODE, GEMINI_MODEL
+from app.services.gemini_scheduler import Priority, gemini_scheduler
+from app.services.metrics import GEMINI_PARSE_FAILURES, GEMINI_SCHEDULED, outbound_timer, register_refresh
+from app.services.tracing import span, start_span
+from app.utils.incremental_json import IncrementalJSONParser
+
+# Latency samples kept per feature for percentiles
+LATENCY_SAMPLES = 1000
+
+Schema = TypeVar("Schema", bound=BaseModel)
+
+_FENCE = re.compile(r"```(?:json)?", re.IGNORECASE)
+
+
+class GeminiParseError(ValueError):
+    """Gemini answered, but not with JSON matching the feature's schema"""
+
+
+def extract_json(text: str) -> Any:
+    """
+    Pull the first JSON object or array out of a model reply.
+
+    Handles markdown fences anywhere in the text, prose before or after
+    the JSON, and trailing commas before a closing bracket.
+    """
+    if text is None:
+        raise GeminiParseError("Empty response")
+    cleaned = _FENCE.sub("", text).strip()
+
+    starts = [i for i in (cleaned.find("{"), cleaned.find("[")) if i >= 0]
+    if not starts:
+        raise GeminiParseError(f"No JSON in response: {cleaned[:80]!r}")
+    start = min(starts)
+
+    decoder = json.JSONDecoder()
+    try:
+        return decoder.raw_decode(cleaned, start)[0]
+    except json.JSONDecodeError:
+        pass
+    try:
+        return decoder.raw_decode(re.sub(r",\s*([}\]])", r"\1", cleaned), start)[0]
+    except json.JSONDecodeError as e:
+        raise GeminiParseError(f"Invalid JSON in response: {e}") from e
+
+
+def parse_response(text: str, schema: Type[Schema]) -> Schema:
+    """extract_json plus validation against a pydantic schema"""
+    data = extract_json(text)
+    try:
+        return schema.model_validate(data)
+    except ValidationError as e:
+        raise GeminiParseError(f"Response doesn't match {schema.__name__}: {e.error_count()} error(s)") from e
+
+
+_genai = None
+
+
+def _sdk():
+    """
+    google.generativeai, imported on first use.
+
+    The import takes ~0.7s (it pulls in the generated API clients and
+    IPython), so it's kept off the startup path; app/services/warmup.py
+    triggers it in the background once the server is up.
+    """
+    global _genai
+    if _genai is None:
+        import google.generativeai as genai
+        _genai = genai
+    return _genai
+
+
+def _sdk_supports_json_mode() -> bool:
+    config = getattr(_sdk().types, "GenerationConfig", None)
+    if config is None or not is_dataclass(config):
+        return False
+    return "response_mime_type" in {field.name for field in dataclass_fields(config)}
+
+
+def _json_mode_enabled(model_name: str) -> bool:
+    if GEMINI_JSON_MODE in ("0", "false", "off"):
+        return False
+    if GEMINI_JSON_MODE in ("1", "true", "on"):
+        return True
+    legacy = model_name in ("gemini-pro", "gemini-1.0-pro") or model_name.startswith("gemini-1.0")
+    return not legacy and _sdk_supports_json_mode()
+
+
+class _FeatureMetrics:
+    __slots__ = ("calls", "errors", "parse_failures", "prompt_tokens", "output_tokens",
+                 "tokens_estimated", "latencies", "first_chunks")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.parse_failures = 0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self.tokens_estimated = False
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.first_chunks = deque(maxlen=LATENCY_SAMPLES)  # Streaming calls only
+
+
+class GeminiGateway:
+    """
+    Model registry plus the generate/parse path every AI feature uses.
+
+    Models are created once (at startup, or on first use) and reused; the
+    SDK's GenerativeModel is safe to share between threads. Calls go
+    through the priority scheduler, so rate limiting and load shedding
+    apply to every feature.
+    """
+
+    def __init__(self, model_name: str = GEMINI_MODEL, scheduler=gemini_scheduler):
+        self.model_name = model_name
+        self.scheduler = scheduler
+        self.json_mode = False
+        self._models: Dict[str, Any] = {}
+        self._metrics: Dict[str, _FeatureMetrics] = {}
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """
+        Import and configure the SDK and create the shared models.
+
+        Runs once, from the startup warm-up or the first AI call, whichever
+        comes first; later calls return straight away.
+        """
+        with self._start_lock:
+            if self._models:
+                return
+            genai = _sdk()
+            genai.configure(api_key=GEMINI_API_KEY)
+            self.json_mode = _json_mode_enabled(self.model_name)
+            models = {"text": genai.GenerativeModel(self.model_name)}
+            if self.json_mode:
+                models["json"] = genai.GenerativeModel(
+                    self.model_name,
+                    generation_config={"response_mime_type": "application/json"}
+                )
+            else:
+                models["json"] = models["text"]
+            self._models = models
+        print(f"Gemini gateway ready: {self.model_name} (JSON mode {'on' if self.json_mode else 'off'})")
+
+    def model(self, kind: str = "json"):
+        if not self._models:
+            self.start()
+        return self._models[kind]
+
+    async def _model_async(self, kind: str = "json"):
+        if not self._models:
+            # First AI call beat the warm-up: import the SDK off the event loop
+            await asyncio.to_thread(self.start)
+        return self._models[kind]
+
+    def _feature(self, feature: str) -> _FeatureMetrics:
+        metrics = self._metrics.get(feature)
+        if metrics is None:
+            metrics = self._metrics[feature] = _FeatureMetrics()
+        return metrics
+
+    def _record_tokens(self, metrics: _FeatureMetrics, prompt: str, response, output_text: Optional[str] = None):
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None and getattr(usage, "prompt_token_count", None) is not None:
+            metrics.prompt_tokens += usage.prompt_token_count
+            metrics.output_tokens += getattr(usage, "candidates_token_count", 0) or 0
+            return
+
+        # Older SDKs don't report usage; ~4 characters per token
+        metrics.tokens_estimated = True
+        metrics.prompt_tokens += len(prompt) // 4
+        if output_text is None:
+            try:
+                output_text = response.text
+            except Exception:
+                output_text = ""
+        metrics.output_tokens += len(output_text) // 4
+
+    async def generate(self, feature: str, prompt: str, priority: Priority, kind: str = "json"):
+        """
+        Send one prompt and return the raw SDK response.
+
+        Raises whatever the SDK or scheduler raises (including
+        GeminiOverloaded); callers fall back as before.
+        """
+        metrics = self._feature(feature)
+        metrics.calls += 1
+        model = await self._model_async(kind)
+
+        def timed_call():
+            started = time.perf_counter()
+            with outbound_timer("gemini", feature), span("gemini.request", "client", model=self.model_name):
+                response = model.generate_content(prompt)
+            return response, time.perf_counter() - started
+
+        # Span includes the scheduler queue; gemini.request inside it is the call itself
+        with span("gemini.generate", feature=feature, priority=priority.name.lower()):
+            try:
+                response, elapsed = await self.scheduler.call(priority, timed_call)
+            except Exception:
+                metrics.errors += 1
+                raise
+        metrics.latencies.append(elapsed)
+        self._record_tokens(metrics, prompt, response)
+        return response
+
+    async def generate_json(self, feature: str, prompt: str, priority: Priority,
+                            schema: Optional[Type[Schema]] = None):
+        """
+        Send a prompt and parse the reply.
+
+        Args:
+            feature: Metrics label, e.g. "fraud_check"
+            prompt: Full prompt text
+            priority: Scheduler priority
+            schema: Pydantic model to validate against; None returns the
+                    raw parsed JSON (for callers validating item by item)
+
+        Returns:
+            Validated schema instance, or the parsed JSON
+
+        Raises:
+            GeminiParseError: reply wasn't valid JSON / didn't match the schema
+        """
+        response = await self.generate(feature, prompt, priority)
+        try:
+            return parse_response(response.text, schema) if schema else extract_json(response.text)
+        except GeminiParseError:
+            self._feature(feature).parse_failures += 1
+            raise
+        except ValueError as e:
+            # response.text raises ValueError when the reply was blocked
+            self._feature(feature).parse_failures += 1
+            raise GeminiParseError(str(e)) from e
+
+    async def generate_text(self, feature: str, prompt: str, priority: Priority) -> str:
+        response = await self.generate(feature, prompt, priority, kind="text")
+        return response.text
+
+    async def stream_json(self, feature: str, prompt: str, priority: Priority,
+                          schema: Type[Schema]) -> AsyncIterator[dict]:
+        """
+        Stream a JSON reply as it is generated.
+
+        The SDK's blocking stream is read in a worker thread and handed to
+        the event loop chunk by chunk; chunks go through an
+        IncrementalJSONParser so callers can forward fields (and string
+        fields token by token) before the reply is complete.
+
+        Yields:
+            IncrementalJSONParser events ("delta" / "field"), then
+            {"type": "done", "data": <validated schema dict>}
+
+        Raises:
+            GeminiOverloaded, SDK errors, or GeminiParseError if the full
+            reply doesn't validate - callers send their fallback then
+        """
+        metrics = self._feature(feature)
+        metrics.calls += 1
+        model = await self._model_async("json")
+
+        try:
+            await self.scheduler.acquire(priority)
+        except Exception:
+            metrics.errors += 1
+            raise
+
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+        finished = object()
+        holder = {}
+
+        def produce():
+            try:
+                with outbound_timer("gemini", feature):
+                    response = holder["response"] = model.generate_content(prompt, stream=True)
+                    for chunk in response:
+                        if stop.is_set():
+                            break
+                        loop.call_soon_threadsafe(queue.put_nowait, chunk.text)
+                loop.call_soon_threadsafe(queue.put_nowait, finished)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+
+        started = time.perf_counter()
+        # Not made current: this generator's context is the consumer's between yields
+        stream_span = start_span("gemini.stream", "client", feature=feature, model=self.model_name)
+        worker = asyncio.ensure_future(asyncio.to_thread(produce))
+        parser = IncrementalJSONParser()
+        parts = []
+        try:
+            while True:
+                item = await queue.get()
+                if item is finished:
+                    break
+                if isinstance(item, Exception):
+                    metrics.errors += 1
+                    self.scheduler.record_error(priority, item)
+                    stream_span.record_error(item)
+                    raise item
+                if not parts:
+                    metrics.first_chunks.append(time.perf_counter() - started)
+                    stream_span.set("first_chunk_ms", round((time.perf_counter() - started) * 1000, 1))
+                parts.append(item)
+                for event in parser.feed(item):
+                    yield event
+        finally:
+            # Client went away or the stream failed: let the worker stop early
+            stop.set()
+            stream_span.finish()
+
+        await worker
+        metrics.latencies.append(time.perf_counter() - started)
+        text = "".join(parts)
+        self._record_tokens(metrics, prompt, holder.get("response"), text)
+        try:
+            result = parse_response(text, schema)
+        except GeminiParseError:
+            metrics.parse_failures += 1
+            raise
+        yield {"type": "done", "data": result.model_dump()}
+
+    @property
+    def stats(self) -> dict:
+        """Per-feature calls, error and parse-failure rates, latency percentiles (ms) and tokens"""
+        features = {}
+        for feature, metrics in sorted(self._metrics.items()):
+            latencies = sorted(metrics.latencies)
+
+            def percentile(p: float) -> float:
+                return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 1) if latencies else 0.0
+
+            answered = metrics.calls - metrics.errors
+            first_chunks = sorted(metrics.first_chunks)
+            features[feature] = {
+                "calls": metrics.calls,
+                "errors": metrics.errors,
+                "parse_failures": metrics.parse_failures,
+                "parse_failure_rate": round(metrics.parse_failures / answered, 4) if answered else 0.0,
+                "latency_ms_p50": percentile(0.50),
+                "latency_ms_p95": percentile(0.95),
+                "first_chunk_ms_p50": round(first_chunks[len(first_chunks) // 2] * 1000, 1) if first_chunks else None,
+                "prompt_tokens": metrics.prompt_tokens,
+                "output_tokens": metrics.output_tokens,
+                "tokens_estimated": metrics.tokens_estimated,
+            }
+        return {
+            "model": self.model_name,
+            "json_mode": self.json_mode,
+            "features": features,
+        }
+
+
+gemini_gateway = GeminiGateway()
+
+
+def _export_metrics():
+    for feature, metrics in gemini_gateway._metrics.items():
+        GEMINI_PARSE_FAILURES.labels(feature=feature).set(metrics.parse_failures)
+    for priority, counts in gemini_gateway.scheduler.stats["priorities"].items():
+        GEMINI_SCHEDULED.labels(priority=priority, decision="admitted").set(counts["admitted"])
+        GEMINI_SCHEDULED.labels(priority=priority, decision="shed").set(counts["shed"])
+
+
+register_refresh(_export_metrics)
@@ -0,0 +1,240 @@
+"""
+Gemini rate limiter and priority scheduler for Soko Pay
+Every GenerativeModel call waits here for a token, so chatbot bursts can't
+starve fraud checks on payment and we stay under the API key's quota
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from collections import deque
+from enum import IntEnum
+from typing import Any, Callable, Dict, List, Optional
+
+
+class Priority(IntEnum):
+    """Lower value is served first"""
+    FRAUD = 0          # Fraud checks on order creation and payment
+    MODERATION = 1     # Content policy, disputes, on-demand fraud review
+    SELLER_TOOLS = 2   # Descriptions, categories, similar products, insights
+    ASSISTANT = 3      # Support chatbot and recommendation messages
+
+
+# Sustained Gemini calls per minute across all features, and how many can
+# go out back to back after a quiet period
+GEMINI_RATE_PER_MINUTE = float(os.getenv("GEMINI_RATE_PER_MINUTE", "60"))
+GEMINI_BURST = int(os.getenv("GEMINI_BURST", "10"))
+
+# Longest a call may wait for a token before it is shed (seconds). Lower
+# priorities give up sooner, so under overload they fall back first.
+QUEUE_DEADLINES = {
+    Priority.FRAUD: float(os.getenv("GEMINI_DEADLINE_FRAUD", "10")),
+    Priority.MODERATION: float(os.getenv("GEMINI_DEADLINE_MODERATION", "5")),
+    Priority.SELLER_TOOLS: float(os.getenv("GEMINI_DEADLINE_SELLER_TOOLS", "3")),
+    Priority.ASSISTANT: float(os.getenv("GEMINI_DEADLINE_ASSISTANT", "2")),
+}
+
+# Queue times kept per priority for percentiles
+QUEUE_TIME_SAMPLES = 1000
+
+
+class GeminiOverloaded(Exception):
+    """Raised when a call is shed instead of waiting past its deadline"""
+
+
+class TokenBucket:
+    """Classic token bucket: refills at `rate` tokens/second up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self) -> bool:
+        self._refill(time.monotonic())
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def seconds_until_token(self) -> float:
+        self._refill(time.monotonic())
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def drain(self):
+        """Empty the bucket (after a quota error, back off for a full refill)"""
+        self._refill(time.monotonic())
+        self.tokens = min(self.tokens, 0.0)
+
+
+class _Waiter:
+    __slots__ = ("priority", "future", "enqueued", "timer")
+
+    def __init__(self, priority: Priority, future: asyncio.Future):
+        self.priority = priority
+        self.future = future
+        self.enqueued = time.monotonic()
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class GeminiScheduler:
+    """
+    Token bucket plus a priority queue.
+
+    A call takes a token straight away if one is free and nobody is queued;
+    otherwise it queues behind higher (and earlier same-) priority calls.
+    Calls still queued at their priority's deadline are shed with
+    GeminiOverloaded, and a call whose estimated wait already exceeds its
+    deadline is shed on arrival, so the caller can use its fallback at once.
+    """
+
+    def __init__(self, rate_per_minute: float = GEMINI_RATE_PER_MINUTE, burst: int = GEMINI_BURST,
+                 deadlines: Optional[Dict[Priority, float]] = None):
+        self.bucket = TokenBucket(rate_per_minute / 60.0, burst)
+        self.deadlines = dict(deadlines or QUEUE_DEADLINES)
+        self._heap: List[tuple] = []
+        self._sequence = itertools.count()
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+        self._metrics = {
+            priority: {"admitted": 0, "shed": 0, "quota_errors": 0, "queue_times": deque(maxlen=QUEUE_TIME_SAMPLES)}
+            for priority in Priority
+        }
+
+    def _queued_ahead_of(self, priority: Priority) -> int:
+        return sum(1 for _, _, waiter in self._heap if waiter.priority <= priority and not waiter.future.done())
+
+    def _admit(self, waiter: _Waiter):
+        if waiter.timer:
+            waiter.timer.cancel()
+        metrics = self._metrics[waiter.priority]
+        metrics["admitted"] += 1
+        metrics["queue_times"].append(time.monotonic() - waiter.enqueued)
+        waiter.future.set_result(None)
+
+    def _shed(self, waiter: _Waiter):
+        if waiter.future.done():
+            return
+        self._metrics[waiter.priority]["shed"] += 1
+        waiter.future.set_exception(GeminiOverloaded(
+            f"Gemini queue wait exceeded {self.deadlines[waiter.priority]:.0f}s for {waiter.priority.name.lower()} calls"
+        ))
+
+    def _dispatch(self):
+        """Hand free tokens to the best queued callers; re-arm a timer for the next token"""
+        self._wakeup = None
+        while self._heap:
+            waiter = self._heap[0][2]
+            if waiter.future.done():  # Shed or cancelled while queued
+                heapq.heappop(self._heap)
+                continue
+            if not self.bucket.try_take():
+                break
+            heapq.heappop(self._heap)
+            self._admit(waiter)
+
+        if self._heap and self._wakeup is None:
+            loop = asyncio.get_running_loop()
+            self._wakeup = loop.call_later(self.bucket.seconds_until_token(), self._dispatch)
+
+    async def acquire(self, priority: Priority):
+        """
+        Wait for permission to make one Gemini call.
+
+        Raises:
+            GeminiOverloaded: the wait would exceed (or did exceed) the deadline
+        """
+        if not self._heap and self.bucket.try_take():
+            metrics = self._metrics[priority]
+            metrics["admitted"] += 1
+            metrics["queue_times"].append(0.0)
+            return
+
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(priority, loop.create_future())
+        deadline = self.deadlines[priority]
+
+        # Everything ahead of us needs a token first
+        ahead = self._queued_ahead_of(priority)
+        estimated_wait = self.bucket.seconds_until_token() + ahead / self.bucket.rate
+        if estimated_wait > deadline:
+            self._metrics[priority]["shed"] += 1
+            raise GeminiOverloaded(
+                f"Gemini queue is full for {priority.name.lower()} calls (~{estimated_wait:.0f}s wait)"
+            )
+
+        waiter.timer = loop.call_later(deadline, self._shed, waiter)
+        heapq.heappush(self._heap, (int(priority), next(self._sequence), waiter))
+        if self._wakeup is None:
+            self._dispatch()
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.timer:
+                waiter.timer.cancel()
+            raise
+
+    async def call(self, priority: Priority, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Run a blocking Gemini call (e.g. model.generate_content) in a thread
+        once the scheduler admits it.
+
+        A quota error (HTTP 429 / ResourceExhausted) empties the bucket so
+        the calls behind it back off instead of hitting the same error.
+        """
+        await self.acquire(priority)
+        try:
+            return await asyncio.to_thread(func, *args, **kwargs)
+        except Exception as e:
+            self.record_error(priority, e)
+            raise
+
+    def record_error(self, priority: Priority, error: Exception):
+        """Note a failed Gemini call; quota errors drain the bucket"""
+        if _is_quota_error(error):
+            self._metrics[priority]["quota_errors"] += 1
+            self.bucket.drain()
+            print(f"Gemini quota error ({priority.name.lower()}): {error}")
+
+    @property
+    def stats(self) -> dict:
+        """Per-priority admitted/shed counts and queue-time percentiles (ms)"""
+        priorities = {}
+        for priority, metrics in self._metrics.items():
+            times = sorted(metrics["queue_times"])
+
+            def percentile(p: float) -> float:
+                return round(times[min(len(times) - 1, int(len(times) * p))] * 1000, 1) if times else 0.0
+
+            priorities[priority.name.lower()] = {
+                "admitted": metrics["admitted"],
+                "shed": metrics["shed"],
+                "quota_errors": metrics["quota_errors"],
+                "queued": sum(1 for _, _, waiter in self._heap
+                              if waiter.priority == priority and not waiter.future.done()),
+                "deadline_seconds": self.deadlines[priority],
+                "queue_ms_p50": percentile(0.50),
+                "queue_ms_p95": percentile(0.95),
+                "queue_ms_max": round(times[-1] * 1000, 1) if times else 0.0,
+            }
+        return {
+            "rate_per_minute": round(self.bucket.rate * 60, 1),
+            "burst": self.bucket.capacity,
+            "tokens_available": round(self.bucket.tokens, 2),
+            "priorities": priorities,
+        }
+
+
+def _is_quota_error(error: Exception) -> bool:
+    text = f"{type(error).__name__} {error}"
+    return "ResourceExhausted" in text or "429" in text or "quota" in text.lower()
+
+
+gemini_scheduler = GeminiScheduler()
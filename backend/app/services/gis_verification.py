@@ -1,10 +1,14 @@
-from geopy.distance import geodesic
 from typing import Tuple, Optional, Dict, List
 from datetime import datetime, timedelta
 import math
 import json
 
 
+def warm_up():
+    """Import geopy ahead of the first distance calculation (called after startup)"""
+    import geopy.distance  # noqa: F401
+
+
 def calculate_distance(
     seller_lat: float,
     seller_lon: float,
@@ -23,6 +27,9 @@ def calculate_distance(
     Returns:
         Distance in kilometers (rounded to 2 decimals)
     """
+    # Imported here so startup doesn't wait for geopy (see warm_up)
+    from geopy.distance import geodesic
+
     seller_coords = (seller_lat, seller_lon)
     buyer_coords = (buyer_lat, buyer_lon)
 
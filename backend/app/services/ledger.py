@@ -0,0 +1,447 @@
+"""
+Double-entry escrow ledger for Soko Pay
+Append-only entries in integer cents with materialized running balances
+"""
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.utils.money import split_platform_fee, to_cents, from_cents
+from database import get_db
+
+# Ledger accounts
+MPESA_COLLECTIONS = "mpesa:collections"      # Money in from buyers' STK pushes
+MPESA_DISBURSEMENTS = "mpesa:disbursements"  # Money out to sellers/buyers
+ESCROW = "escrow"                            # Held until delivery or dispute resolution
+PLATFORM_FEES = "platform:fees"              # Soko Pay's 3% cut
+
+
+def seller_account(seller_phone: str) -> str:
+    return f"{SELLER_PREFIX}{seller_phone}"
+
+
+def buyer_account(buyer_phone: Optional[str], order_id: str) -> str:
+    """Refund account; keyed by order when the buyer's phone is unknown"""
+    if buyer_phone:
+        return f"buyer:{buyer_phone}"
+    return f"buyer:order:{order_id}"
+
+
+SELLER_PREFIX = "seller:"
+
+# Rows streamed per fetchmany() when replaying the ledger
+REPLAY_CHUNK_SIZE = 10000
+
+# Accounts per IN (...) lookup (SQLite caps bound parameters per statement)
+BALANCE_LOOKUP_CHUNK = 500
+
+# Order statuses whose buyer has paid, i.e. whose money reached escrow
+PAID_STATUSES = ("paid", "shipped", "delivered", "completed", "disputed", "refunded")
+
+# (account, entry_type, amount_cents) - positive increases the account balance
+LedgerLine = Tuple[str, str, int]
+
+
+class UnbalancedJournalError(ValueError):
+    pass
+
+
+class InsufficientBalanceError(ValueError):
+    """A payout would take a seller account below zero"""
+
+
+# ============================================================================
+# Posting
+# ============================================================================
+
+def _journal_exists(cursor, journal_id: str) -> bool:
+    cursor.execute("SELECT 1 FROM ledger_entries WHERE journal_id = ? LIMIT 1", (journal_id,))
+    return cursor.fetchone() is not None
+
+
+def post_journal(
+    journal_id: str,
+    lines: List[LedgerLine],
+    order_id: Optional[str] = None,
+    conn=None,
+    check: Optional[Callable] = None
+) -> bool:
+    """
+    Append a balanced journal and update running balances atomically.
+
+    Journal IDs are deterministic (e.g. "hold:SP123"), so posting the
+    same event twice - a re-delivered PayHero callback, say - is a no-op.
+
+    Args:
+        journal_id: Unique journal identifier
+        lines: (account, entry_type, amount_cents) tuples summing to zero
+        order_id: Order the journal belongs to, if any
+        conn: Existing connection to post inside the caller's transaction.
+              The caller is then responsible for committing.
+        check: Called with the cursor before posting (not for a journal
+               that already exists); raise to refuse the journal
+
+    Returns:
+        True if the journal was posted, False if it already existed
+    """
+    lines = [line for line in lines if line[2] != 0]
+    if not lines:
+        return False
+    if sum(line[2] for line in lines) != 0:
+        raise UnbalancedJournalError(f"Journal {journal_id} does not sum to zero")
+
+    def _post(connection):
+        cursor = connection.cursor()
+        if _journal_exists(cursor, journal_id):
+            return False
+        if check is not None:
+            check(cursor)
+
+        cursor.executemany("""
+            INSERT INTO ledger_entries (journal_id, order_id, entry_type, account, amount_cents)
+            VALUES (?, ?, ?, ?, ?)
+        """, [(journal_id, order_id, entry_type, account, amount) for account, entry_type, amount in lines])
+
+        cursor.executemany("""
+            INSERT INTO ledger_balances (account, balance_cents, entry_count, updated_at)
+            VALUES (?, ?, 1, CURRENT_TIMESTAMP)
+            ON CONFLICT(account) DO UPDATE SET
+                balance_cents = balance_cents + excluded.balance_cents,
+                entry_count = entry_count + 1,
+                updated_at = CURRENT_TIMESTAMP
+        """, [(account, amount) for account, _, amount in lines])
+        return True
+
+    if conn is not None:
+        return _post(conn)
+
+    with get_db() as own_conn:
+        try:
+            posted = _post(own_conn)
+            own_conn.commit()
+            return posted
+        except Exception:
+            own_conn.rollback()
+            raise
+
+
+def record_escrow_hold(order: dict, conn=None) -> bool:
+    """Buyer's payment lands in escrow."""
+    gross = to_cents(order["product_price"])
+    return post_journal(f"hold:{order['id']}", [
+        (MPESA_COLLECTIONS, "escrow_hold", -gross),
+        (ESCROW, "escrow_hold", gross),
+    ], order_id=order["id"], conn=conn)
+
+
+def record_release(order: dict, conn=None) -> bool:
+    """Escrow released: seller is owed the net amount, platform keeps the fee."""
+    fee, net = split_platform_fee(order["product_price"])
+    return post_journal(f"release:{order['id']}", [
+        (ESCROW, "release", -(to_cents(fee) + to_cents(net))),
+        (seller_account(order["seller_phone"]), "release", to_cents(net)),
+        (PLATFORM_FEES, "fee", to_cents(fee)),
+    ], order_id=order["id"], conn=conn)
+
+
+def record_refund(order: dict, conn=None) -> bool:
+    """Escrow returned to the buyer in full."""
+    gross = to_cents(order["product_price"])
+    return post_journal(f"refund:{order['id']}", [
+        (ESCROW, "refund", -gross),
+        (buyer_account(order["buyer_phone"], order["id"]), "refund", gross),
+    ], order_id=order["id"], conn=conn)
+
+
+def _balances(cursor, accounts: List[str]) -> Dict[str, int]:
+    balances = {}
+    for i in range(0, len(accounts), BALANCE_LOOKUP_CHUNK):
+        chunk = accounts[i:i + BALANCE_LOOKUP_CHUNK]
+        cursor.execute(
+            f"SELECT account, balance_cents FROM ledger_balances WHERE account IN ({','.join('?' * len(chunk))})",
+            chunk
+        )
+        balances.update({row[0]: row[1] for row in cursor.fetchall()})
+    return balances
+
+
+def record_payout(batch_id: str, seller_net_cents: Dict[str, int], conn=None) -> bool:
+    """
+    A settlement batch pays sellers out of their ledger balances.
+
+    Raises:
+        InsufficientBalanceError: a seller would be paid more than their
+            balance; nothing is posted
+    """
+    lines = [
+        (seller_account(phone), "payout", -net)
+        for phone, net in seller_net_cents.items()
+    ]
+    lines.append((MPESA_DISBURSEMENTS, "payout", sum(seller_net_cents.values())))
+
+    def check_balances(cursor):
+        balances = _balances(cursor, [seller_account(phone) for phone in seller_net_cents])
+        short = [
+            f"{phone} (owed {balances.get(seller_account(phone), 0)}, paying {net})"
+            for phone, net in seller_net_cents.items()
+            if net > balances.get(seller_account(phone), 0)
+        ]
+        if short:
+            raise InsufficientBalanceError(
+                f"Payout {batch_id} exceeds seller balance (cents): {', '.join(short[:10])}"
+            )
+
+    return post_journal(f"payout:{batch_id}", lines, conn=conn, check=check_balances)
+
+
+# ============================================================================
+# Queries
+# ============================================================================
+
+def get_balance(account: str) -> dict:
+    """Get the running balance of a ledger account (single-row read)"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM ledger_balances WHERE account = ?", (account,))
+        row = cursor.fetchone()
+
+    balance_cents = row["balance_cents"] if row else 0
+    return {
+        "account": account,
+        "balance_cents": balance_cents,
+        "balance": float(from_cents(balance_cents)),
+        "entry_count": row["entry_count"] if row else 0,
+        "updated_at": row["updated_at"] if row else None
+    }
+
+
+def get_order_entries(order_id: str) -> list:
+    """Get all ledger entries for an order"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT * FROM ledger_entries
+            WHERE order_id = ?
+            ORDER BY id
+        """, (order_id,))
+        return [dict(row) for row in cursor.fetchall()]
+
+
+# ============================================================================
+# Verify / rebuild
+# ============================================================================
+
+def _replay(cursor) -> dict:
+    """
+    Stream the ledger in id order and recompute balances.
+
+    Journals are written in a single transaction, so their entries are
+    contiguous by id and can be checked for zero-sum one at a time.
+    """
+    balances: Dict[str, int] = {}
+    counts: Dict[str, int] = {}
+    unbalanced = []
+    entries = 0
+    journals = 0
+
+    current_journal, journal_sum = None, 0
+
+    cursor.execute("SELECT journal_id, account, amount_cents FROM ledger_entries ORDER BY id")
+    while True:
+        rows = cursor.fetchmany(REPLAY_CHUNK_SIZE)
+        if not rows:
+            break
+        for journal_id, account, amount in rows:
+            if journal_id != current_journal:
+                if current_journal is not None and journal_sum != 0:
+                    unbalanced.append({"journal_id": current_journal, "sum_cents": journal_sum})
+                current_journal, journal_sum = journal_id, 0
+                journals += 1
+
+            journal_sum += amount
+            balances[account] = balances.get(account, 0) + amount
+            counts[account] = counts.get(account, 0) + 1
+            entries += 1
+
+    if current_journal is not None and journal_sum != 0:
+        unbalanced.append({"journal_id": current_journal, "sum_cents": journal_sum})
+
+    return {
+        "balances": balances,
+        "counts": counts,
+        "unbalanced": unbalanced,
+        "entries": entries,
+        "journals": journals
+    }
+
+
+def verify_ledger(max_issues: int = 100) -> dict:
+    """
+    Replay the ledger and compare against the materialized balances.
+
+    Returns:
+        {
+            "ok": bool,
+            "entries": int,
+            "journals": int,
+            "accounts": int,
+            "total_cents": int (must be 0),
+            "unbalanced_journals": list,
+            "mismatched_accounts": list,
+            "negative_seller_accounts": list (sellers paid more than they were owed)
+        }
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        replay = _replay(cursor)
+
+        mismatched = []
+        seen = set()
+        cursor.execute("SELECT account, balance_cents, entry_count FROM ledger_balances")
+        while True:
+            rows = cursor.fetchmany(REPLAY_CHUNK_SIZE)
+            if not rows:
+                break
+            for account, balance_cents, entry_count in rows:
+                seen.add(account)
+                expected = replay["balances"].get(account, 0)
+                expected_count = replay["counts"].get(account, 0)
+                if balance_cents != expected or entry_count != expected_count:
+                    mismatched.append({
+                        "account": account,
+                        "stored_cents": balance_cents,
+                        "replayed_cents": expected,
+                        "stored_entries": entry_count,
+                        "replayed_entries": expected_count
+                    })
+
+        for account, expected in replay["balances"].items():
+            if account not in seen:
+                mismatched.append({
+                    "account": account,
+                    "stored_cents": None,
+                    "replayed_cents": expected,
+                    "stored_entries": 0,
+                    "replayed_entries": replay["counts"][account]
+                })
+
+    negative = [
+        {"account": account, "balance_cents": balance}
+        for account, balance in replay["balances"].items()
+        if account.startswith(SELLER_PREFIX) and balance < 0
+    ]
+
+    total = sum(replay["balances"].values())
+    return {
+        "ok": not replay["unbalanced"] and not mismatched and not negative and total == 0,
+        "entries": replay["entries"],
+        "journals": replay["journals"],
+        "accounts": len(replay["balances"]),
+        "total_cents": total,
+        "unbalanced_journals": replay["unbalanced"][:max_issues],
+        "mismatched_accounts": mismatched[:max_issues],
+        "negative_seller_accounts": negative[:max_issues]
+    }
+
+
+def rebuild_balances() -> dict:
+    """Recompute ledger_balances from scratch by replaying all entries"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        replay = _replay(cursor)
+
+        try:
+            cursor.execute("DELETE FROM ledger_balances")
+            cursor.executemany("""
+                INSERT INTO ledger_balances (account, balance_cents, entry_count, updated_at)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            """, [
+                (account, balance, replay["counts"][account])
+                for account, balance in replay["balances"].items()
+            ])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    return {
+        "entries": replay["entries"],
+        "journals": replay["journals"],
+        "accounts": len(replay["balances"]),
+        "unbalanced_journals": replay["unbalanced"]
+    }
+
+
+# ============================================================================
+# Backfill
+# ============================================================================
+
+def _orders_missing_journal(cursor, prefix: str, statuses) -> list:
+    """Orders in `statuses` with no "<prefix>:<order_id>" journal yet"""
+    cursor.execute(f"""
+        SELECT o.id, o.product_price, o.seller_phone, o.buyer_phone,
+               EXISTS (SELECT 1 FROM settled_orders s WHERE s.order_id = o.id) AS settled
+        FROM orders o
+        WHERE o.status IN ({','.join('?' * len(statuses))})
+          AND NOT EXISTS (
+              SELECT 1 FROM ledger_entries e WHERE e.journal_id = ? || o.id
+          )
+        ORDER BY o.id
+    """, (*statuses, f"{prefix}:"))
+    return [dict(row) for row in cursor.fetchall()]
+
+
+def backfill_ledger() -> dict:
+    """
+    Post the journals orders from before the ledger existed are missing.
+
+    Every paid order gets its escrow hold, and refunded orders their
+    refund, so a later release or refund doesn't take escrow negative.
+    Completed orders get their release, so settlement (which reads
+    release journals) pays their sellers; ones the old settlement engine
+    already paid (in settled_orders) also get a matching payout.
+    Journal IDs are deterministic, so running this again posts nothing
+    (it runs at startup).
+
+    Returns:
+        Number of journals posted, by kind
+    """
+    posted = {"holds": 0, "releases": 0, "settled_payouts": 0, "refunds": 0}
+    with get_db() as conn:
+        cursor = conn.cursor()
+        try:
+            for order in _orders_missing_journal(cursor, "hold", PAID_STATUSES):
+                posted["holds"] += record_escrow_hold(order, conn=conn)
+            for order in _orders_missing_journal(cursor, "release", ("completed",)):
+                posted["releases"] += record_release(order, conn=conn)
+                if order["settled"]:
+                    _, net = split_platform_fee(order["product_price"])
+                    posted["settled_payouts"] += record_payout(
+                        f"backfill:{order['id']}", {order["seller_phone"]: to_cents(net)}, conn=conn
+                    )
+            for order in _orders_missing_journal(cursor, "refund", ("refunded",)):
+                posted["refunds"] += record_refund(order, conn=conn)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return posted
+
+
+# Verify, rebuild or backfill from the command line:
+#   python -m app.services.ledger verify
+#   python -m app.services.ledger rebuild
+#   python -m app.services.ledger backfill
+if __name__ == "__main__":
+    import json
+    import sys
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "verify"
+    if command == "rebuild":
+        result = rebuild_balances()
+    elif command == "backfill":
+        result = backfill_ledger()
+    else:
+        result = verify_ledger()
+    print(json.dumps(result, indent=2))
+    if command == "verify" and not result["ok"]:
+        sys.exit(1)
@@ -0,0 +1,390 @@
+"""
+Market analytics for Soko Pay
+Per-category rollups maintained on every order event; insights are
+computed from the rollups and served from a one-row-per-category cache
+"""
+
+import json
+import math
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from app.services.ai_enhanced import generate_market_insights
+from app.utils.money import from_cents, to_cents
+from database import get_db
+
+# How long computed stats are served from market_insights_cache
+MARKET_INSIGHTS_TTL_SECONDS = int(os.getenv("MARKET_INSIGHTS_TTL_SECONDS", "300"))
+
+# How long Gemini's narrative tips are reused (rule-based tips retry sooner)
+MARKET_TIPS_TTL_SECONDS = int(os.getenv("MARKET_TIPS_TTL_SECONDS", "86400"))
+MARKET_TIPS_RETRY_SECONDS = 600
+
+# Histogram buckets are 10% wide, so percentiles are within ~5%
+PRICE_BUCKET_RATIO = 1.1
+
+TREND_WEEKS = 4
+TREND_THRESHOLD = 0.10
+
+_EVENT_COLUMNS = {
+    "created": "created_count",
+    "paid": "paid_count",
+    "completed": "completed_count",
+    "disputed": "disputed_count",
+    "refunded": "refunded_count",
+}
+
+
+def normalize_category(category: Optional[str]) -> str:
+    return (category or "Other").strip() or "Other"
+
+
+def price_to_bucket(price: float) -> int:
+    if not price or price <= 0:
+        return 0
+    return int(math.floor(math.log(price) / math.log(PRICE_BUCKET_RATIO)))
+
+
+def bucket_midpoint(bucket: int) -> float:
+    return PRICE_BUCKET_RATIO ** (bucket + 0.5)
+
+
+def _day(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).strftime("%Y-%m-%d")
+
+
+# ============================================================================
+# Incremental updates
+# ============================================================================
+
+def record_market_event(order: dict, event: str, conn=None, now: Optional[float] = None):
+    """
+    Add an order event to its category's daily rollup.
+
+    Args:
+        order: Order dict (needs product_category; "created" also uses product_price)
+        event: One of created, paid, completed, disputed, refunded
+        conn: Existing connection to update inside the caller's transaction.
+              The caller is then responsible for committing.
+        now: Event time as a Unix timestamp (default: current time)
+    """
+    if event not in _EVENT_COLUMNS:
+        raise ValueError(f"Unknown order event: {event}")
+
+    category = normalize_category(order.get("product_category"))
+    day = _day(now if now is not None else time.time())
+
+    def _update(connection):
+        cursor = connection.cursor()
+        column = _EVENT_COLUMNS[event]
+        if event == "created":
+            price = order.get("product_price") or 0
+            price_cents = to_cents(price)
+            cursor.execute(f"""
+                INSERT INTO market_daily (category, day, {column}, price_sum_cents, price_min_cents, price_max_cents)
+                VALUES (?, ?, 1, ?, ?, ?)
+                ON CONFLICT(category, day) DO UPDATE SET
+                    {column} = {column} + 1,
+                    price_sum_cents = price_sum_cents + excluded.price_sum_cents,
+                    price_min_cents = MIN(COALESCE(price_min_cents, excluded.price_min_cents), excluded.price_min_cents),
+                    price_max_cents = MAX(COALESCE(price_max_cents, excluded.price_max_cents), excluded.price_max_cents)
+            """, (category, day, price_cents, price_cents, price_cents))
+            cursor.execute("""
+                INSERT INTO market_price_buckets (category, bucket, count)
+                VALUES (?, ?, 1)
+                ON CONFLICT(category, bucket) DO UPDATE SET count = count + 1
+            """, (category, price_to_bucket(price)))
+        else:
+            cursor.execute(f"""
+                INSERT INTO market_daily (category, day, {column}) VALUES (?, ?, 1)
+                ON CONFLICT(category, day) DO UPDATE SET {column} = {column} + 1
+            """, (category, day))
+
+    if conn is not None:
+        _update(conn)
+        return
+
+    with get_db() as own_conn:
+        _update(own_conn)
+        own_conn.commit()
+
+
+def rebuild_market_rollups() -> int:
+    """
+    Recompute market_daily and market_price_buckets from orders.
+
+    Daily counts are plain GROUP BY aggregates; the price histogram is
+    streamed because SQLite has no built-in log().
+
+    Returns:
+        Number of categories
+    """
+    with get_db() as conn:
+        read_cursor = conn.cursor()
+        write_cursor = conn.cursor()
+        try:
+            write_cursor.execute("DELETE FROM market_daily")
+            write_cursor.execute("DELETE FROM market_price_buckets")
+            write_cursor.execute("DELETE FROM market_insights_cache")
+
+            write_cursor.execute("""
+                INSERT INTO market_daily (category, day, created_count, price_sum_cents, price_min_cents, price_max_cents)
+                SELECT COALESCE(NULLIF(TRIM(product_category), ''), 'Other'), DATE(created_at), COUNT(*),
+                       SUM(CAST(ROUND(product_price * 100) AS INTEGER)),
+                       MIN(CAST(ROUND(product_price * 100) AS INTEGER)),
+                       MAX(CAST(ROUND(product_price * 100) AS INTEGER))
+                FROM orders
+                GROUP BY 1, 2
+            """)
+
+            event_days = {
+                "paid_count": """
+                    SELECT product_category AS category, DATE(COALESCE(paid_at, created_at)) AS day FROM orders
+                    WHERE paid_at IS NOT NULL
+                       OR status IN ('paid', 'shipped', 'delivered', 'completed', 'disputed', 'refunded')
+                """,
+                "completed_count": """
+                    SELECT product_category AS category, DATE(COALESCE(delivered_at, created_at)) AS day FROM orders
+                    WHERE status = 'completed'
+                """,
+                "disputed_count": """
+                    SELECT o.product_category AS category, DATE(MIN(t.created_at)) AS day FROM orders o
+                    JOIN transactions t ON t.order_id = o.id AND t.type = 'dispute_raised'
+                    GROUP BY o.id
+                """,
+                "refunded_count": """
+                    SELECT product_category AS category, DATE(created_at) AS day FROM orders
+                    WHERE status = 'refunded'
+                """,
+            }
+            for column, events_sql in event_days.items():
+                write_cursor.execute(f"""
+                    INSERT INTO market_daily (category, day, {column})
+                    SELECT COALESCE(NULLIF(TRIM(e.category), ''), 'Other'), e.day, COUNT(*)
+                    FROM ({events_sql}) AS e
+                    WHERE true
+                    GROUP BY 1, 2
+                    ON CONFLICT(category, day) DO UPDATE SET {column} = excluded.{column}
+                """)
+
+            histogram = {}
+            read_cursor.execute("SELECT product_category, product_price FROM orders")
+            while True:
+                rows = read_cursor.fetchmany(5000)
+                if not rows:
+                    break
+                for category, price in rows:
+                    key = (normalize_category(category), price_to_bucket(price))
+                    histogram[key] = histogram.get(key, 0) + 1
+            write_cursor.executemany("""
+                INSERT INTO market_price_buckets (category, bucket, count) VALUES (?, ?, ?)
+            """, [(category, bucket, count) for (category, bucket), count in histogram.items()])
+
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        read_cursor.execute("SELECT COUNT(DISTINCT category) FROM market_daily")
+        return read_cursor.fetchone()[0]
+
+
+# ============================================================================
+# Insights
+# ============================================================================
+
+def _percentile(buckets: List[tuple], total: int, fraction: float) -> float:
+    target = fraction * total
+    running = 0
+    for bucket, count in buckets:
+        running += count
+        if running >= target:
+            return round(bucket_midpoint(bucket))
+    return round(bucket_midpoint(buckets[-1][0])) if buckets else 0
+
+
+def compute_market_stats(category: str, now: Optional[float] = None) -> dict:
+    """
+    Market statistics for a category, read from the rollup tables.
+
+    Returns:
+        {
+            "category": str,
+            "listing_count": int,
+            "avg_price": float,
+            "price_range": {"min": float, "max": float},
+            "price_percentiles": {"p25", "p50", "p75", "p90"},
+            "weekly_volume": [{"week_start", "listings", "orders", "completed"}] (oldest first),
+            "trend": "declining|stable|growing",
+            "demand_level": "low|moderate|high|very_high",
+            "completion_rate": float (completed / paid),
+            "dispute_rate": float (disputed / paid)
+        }
+    """
+    category = normalize_category(category)
+    today = datetime.fromtimestamp(now if now is not None else time.time(), tz=timezone.utc).date()
+    first_day = today - timedelta(days=TREND_WEEKS * 2 * 7 - 1)
+
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT SUM(created_count) AS listings, SUM(paid_count) AS paid,
+                   SUM(completed_count) AS completed, SUM(disputed_count) AS disputed,
+                   SUM(price_sum_cents) AS price_sum_cents,
+                   MIN(price_min_cents) AS price_min_cents, MAX(price_max_cents) AS price_max_cents
+            FROM market_daily WHERE category = ?
+        """, (category,))
+        totals = dict(cursor.fetchone())
+
+        cursor.execute("""
+            SELECT day, created_count, paid_count, completed_count
+            FROM market_daily WHERE category = ? AND day >= ?
+        """, (category, first_day.isoformat()))
+        days = cursor.fetchall()
+
+        cursor.execute("""
+            SELECT bucket, count FROM market_price_buckets
+            WHERE category = ? ORDER BY bucket
+        """, (category,))
+        buckets = [(row["bucket"], row["count"]) for row in cursor.fetchall()]
+
+    weeks = [
+        {"week_start": (first_day + timedelta(days=7 * i)).isoformat(), "listings": 0, "orders": 0, "completed": 0}
+        for i in range(TREND_WEEKS * 2)
+    ]
+    for row in days:
+        index = (datetime.strptime(row["day"], "%Y-%m-%d").date() - first_day).days // 7
+        if 0 <= index < len(weeks):
+            weeks[index]["listings"] += row["created_count"]
+            weeks[index]["orders"] += row["paid_count"]
+            weeks[index]["completed"] += row["completed_count"]
+
+    previous = sum(week["listings"] + week["orders"] for week in weeks[:TREND_WEEKS])
+    recent = sum(week["listings"] + week["orders"] for week in weeks[TREND_WEEKS:])
+    if previous == 0:
+        trend = "growing" if recent else "stable"
+    elif (recent - previous) / previous > TREND_THRESHOLD:
+        trend = "growing"
+    elif (recent - previous) / previous < -TREND_THRESHOLD:
+        trend = "declining"
+    else:
+        trend = "stable"
+
+    weekly_orders = sum(week["orders"] for week in weeks[TREND_WEEKS:]) / TREND_WEEKS
+    if weekly_orders < 5:
+        demand_level = "low"
+    elif weekly_orders < 20:
+        demand_level = "moderate"
+    elif weekly_orders < 100:
+        demand_level = "high"
+    else:
+        demand_level = "very_high"
+
+    listings = totals["listings"] or 0
+    paid = totals["paid"] or 0
+    histogram_total = sum(count for _, count in buckets)
+
+    return {
+        "category": category,
+        "listing_count": listings,
+        "avg_price": float(from_cents(totals["price_sum_cents"] // listings)) if listings else 0,
+        "price_range": {
+            "min": float(from_cents(totals["price_min_cents"] or 0)),
+            "max": float(from_cents(totals["price_max_cents"] or 0))
+        },
+        "price_percentiles": {
+            name: _percentile(buckets, histogram_total, fraction)
+            for name, fraction in (("p25", 0.25), ("p50", 0.5), ("p75", 0.75), ("p90", 0.9))
+        },
+        "weekly_volume": weeks,
+        "trend": trend,
+        "demand_level": demand_level,
+        "completion_rate": round((totals["completed"] or 0) / paid, 3) if paid else None,
+        "dispute_rate": round((totals["disputed"] or 0) / paid, 3) if paid else None
+    }
+
+
+def rule_based_tips(stats: dict) -> dict:
+    """Tips built from the numbers alone (used when Gemini is unavailable)"""
+    tips = []
+    percentiles = stats["price_percentiles"]
+    if stats["listing_count"]:
+        tips.append(f"Most {stats['category']} listings are priced between KES {percentiles['p25']:,} and KES {percentiles['p75']:,}.")
+    if stats["dispute_rate"] and stats["dispute_rate"] > 0.05:
+        tips.append("Disputes are above 5% in this category - add clear photos and honest condition notes.")
+    if stats["trend"] == "growing":
+        tips.append("Activity is growing - list early and respond quickly to buyers.")
+    elif stats["trend"] == "declining":
+        tips.append("Activity is slowing - competitive pricing and fast delivery will stand out.")
+    return {"popular_features": [], "seller_tips": tips, "forecast": f"{stats['trend'].capitalize()} activity over the last {TREND_WEEKS} weeks."}
+
+
+async def _tips_for(stats: dict) -> dict:
+    tips = await generate_market_insights(stats["category"], stats)
+    if tips.get("seller_tips"):
+        tips["source"] = "ai"
+        return tips
+    tips = rule_based_tips(stats)
+    tips["source"] = "rules"
+    return tips
+
+
+async def get_market_insights(category: str) -> dict:
+    """
+    Market insights for a category.
+
+    Served from market_insights_cache; stats are recomputed from the
+    rollups after MARKET_INSIGHTS_TTL_SECONDS and Gemini is asked for
+    new tips at most once per MARKET_TIPS_TTL_SECONDS.
+    """
+    category = normalize_category(category)
+    now = time.time()
+
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM market_insights_cache WHERE category = ?", (category,))
+        cached = cursor.fetchone()
+
+    if cached and now - cached["computed_at"] < MARKET_INSIGHTS_TTL_SECONDS:
+        return json.loads(cached["insights"])
+
+    stats = compute_market_stats(category, now)
+
+    tips = json.loads(cached["tips"]) if cached and cached["tips"] else None
+    tips_at = cached["tips_at"] if cached else None
+    tips_ttl = MARKET_TIPS_TTL_SECONDS if tips and tips.get("source") == "ai" else MARKET_TIPS_RETRY_SECONDS
+    if tips is None or tips_at is None or now - tips_at >= tips_ttl:
+        tips = await _tips_for(stats)
+        tips_at = now
+
+    insights = {
+        **stats,
+        "popular_features": tips.get("popular_features", []),
+        "seller_tips": tips.get("seller_tips", []),
+        "forecast": tips.get("forecast", ""),
+        "computed_at": datetime.fromtimestamp(now, tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    }
+
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO market_insights_cache (category, insights, computed_at, tips, tips_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(category) DO UPDATE SET
+                insights = excluded.insights,
+                computed_at = excluded.computed_at,
+                tips = excluded.tips,
+                tips_at = excluded.tips_at
+        """, (category, json.dumps(insights), now, json.dumps(tips), tips_at))
+        conn.commit()
+
+    return insights
+
+
+# Rebuild from the command line: python -m app.services.market_insights
+if __name__ == "__main__":
+    started = time.perf_counter()
+    categories = rebuild_market_rollups()
+    print(f"Rebuilt market rollups for {categories} categories in {time.perf_counter() - started:.1f}s")
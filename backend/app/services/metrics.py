@@ -0,0 +1,446 @@
+"""
+Prometheus metrics for Soko Pay
+Counters, gauges and histograms kept per worker process with no locks,
+exposed at /metrics in the text exposition format. Database helpers are
+timed from worker threads (asyncio.to_thread), so every value is sharded
+per thread and the shards are summed when read. With several gunicorn
+workers each one writes a snapshot file to METRICS_DIR and a scrape of any
+worker adds them all up.
+"""
+
+import asyncio
+import bisect
+import functools
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Shared directory for per-worker snapshots; unset = single process, no files.
+# Empty it before starting the server, as old workers' counters are kept.
+METRICS_DIR = os.getenv("METRICS_DIR", "")
+METRICS_SNAPSHOT_SECONDS = float(os.getenv("METRICS_SNAPSHOT_SECONDS", "5"))
+
+# Seconds; covers a cached photo (~1ms) up to a slow Gemini call
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelValues = Tuple[str, ...]
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[LabelValues, object] = {}
+        REGISTRY.append(self)
+
+    def labels(self, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            # setdefault is atomic, so two threads racing here share one child
+            child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def snapshot(self) -> dict:
+        return {
+            "kind": self.kind,
+            "help": self.documentation,
+            "labelnames": list(self.labelnames),
+            # list() copies in one step; other threads may add children meanwhile
+            "samples": [[list(key), child.dump()] for key, child in list(self._children.items())],
+        }
+
+
+class _Sharded:
+    """
+    One list of numbers per thread that writes to the value.
+
+    `x += 1` on a shared attribute loses updates when two threads
+    interleave; each shard is only written by its own thread.
+    """
+    __slots__ = ("_shards",)
+
+    def __init__(self):
+        self._shards: Dict[int, list] = {}
+
+    def _new_shard(self) -> list:
+        raise NotImplementedError
+
+    def _shard(self) -> list:
+        ident = threading.get_ident()
+        shard = self._shards.get(ident)
+        if shard is None:
+            shard = self._shards[ident] = self._new_shard()
+        return shard
+
+    def _all_shards(self) -> List[list]:
+        return list(self._shards.values())
+
+
+class _Value(_Sharded):
+    __slots__ = ()
+
+    def _new_shard(self) -> list:
+        return [0.0]
+
+    def inc(self, amount: float = 1.0):
+        self._shard()[0] += amount
+
+    def dec(self, amount: float = 1.0):
+        self._shard()[0] -= amount
+
+    def set(self, value: float):
+        # Set through this thread's shard so the total equals value
+        shard = self._shard()
+        shard[0] = value - sum(other[0] for other in self._all_shards() if other is not shard)
+
+    def dump(self):
+        return sum(shard[0] for shard in self._all_shards())
+
+
+class _HistogramValue(_Sharded):
+    __slots__ = ("upper_bounds",)
+
+    def __init__(self, upper_bounds: Tuple[float, ...]):
+        super().__init__()
+        self.upper_bounds = upper_bounds
+
+    def _new_shard(self) -> list:
+        # A count per bucket, +Inf, then the sum
+        return [0] * (len(self.upper_bounds) + 1) + [0.0]
+
+    def observe(self, value: float):
+        shard = self._shard()
+        shard[bisect.bisect_left(self.upper_bounds, value)] += 1
+        shard[-1] += value
+
+    def dump(self):
+        counts = [0] * (len(self.upper_bounds) + 1)
+        total = 0.0
+        for shard in self._all_shards():
+            for i, count in enumerate(shard[:-1]):
+                counts[i] += count
+            total += shard[-1]
+        return {"counts": counts, "sum": total}
+
+
+class Counter(_Metric):
+    """Monotonic count; .labels(...).inc()"""
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+
+class Gauge(_Metric):
+    """Value that goes up and down; .labels(...).inc() / .dec() / .set()"""
+    kind = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+
+class Histogram(_Metric):
+    """Latency distribution; .labels(...).observe(seconds)"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def snapshot(self) -> dict:
+        data = super().snapshot()
+        data["buckets"] = list(self.buckets)
+        return data
+
+
+REGISTRY: List[_Metric] = []
+
+# Called before every snapshot to copy in counts other modules keep themselves
+_refresh_hooks: List[Callable[[], None]] = []
+
+
+def register_refresh(hook: Callable[[], None]):
+    """Run hook() before each snapshot (e.g. to export a service's own stats)"""
+    _refresh_hooks.append(hook)
+
+
+# ============================================================================
+# Metrics
+# ============================================================================
+
+HTTP_REQUESTS = Counter(
+    "soko_http_requests_total", "HTTP requests by route template and status",
+    ("method", "route", "status")
+)
+HTTP_LATENCY = Histogram(
+    "soko_http_request_duration_seconds", "Time to the last byte of the response",
+    ("method", "route")
+)
+HTTP_IN_FLIGHT = Gauge("soko_http_requests_in_flight", "Requests being handled right now")
+
+DB_LATENCY = Histogram(
+    "soko_db_query_duration_seconds", "Time spent in each database.py helper",
+    ("helper",)
+)
+
+OUTBOUND_LATENCY = Histogram(
+    "soko_outbound_request_duration_seconds", "Calls to PayHero and Gemini",
+    ("service", "operation", "outcome")
+)
+
+GEMINI_PARSE_FAILURES = Counter(
+    "soko_gemini_parse_failures_total", "Gemini replies that didn't match the feature's schema",
+    ("feature",)
+)
+GEMINI_SCHEDULED = Counter(
+    "soko_gemini_scheduled_total", "Gemini calls admitted or shed by the priority scheduler",
+    ("priority", "decision")
+)
+
+FALLBACKS = Counter(
+    "soko_fallback_total", "Answers served by a fallback path instead of the primary one",
+    ("path",)
+)
+
+
+def timed_db(func):
+    """Decorator recording a database.py helper's duration in DB_LATENCY"""
+    histogram = DB_LATENCY.labels(helper=func.__name__)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - started)
+
+    return wrapper
+
+
+@contextmanager
+def outbound_timer(service: str, operation: str):
+    """Time an external call; outcome is "error" if the block raises"""
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        OUTBOUND_LATENCY.labels(service=service, operation=operation, outcome=outcome).observe(
+            time.perf_counter() - started
+        )
+
+
+# ============================================================================
+# Request middleware
+# ============================================================================
+
+def route_template(scope) -> str:
+    """Route template a request matched (after routing), for labels and span names"""
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    if "endpoint" in scope:
+        return scope.get("root_path") or "mounted"  # Static mounts
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording latency, status and in-flight count per route.
+
+    Routes are labelled by their template (/api/orders/{order_id}), not the
+    raw path, so label cardinality stays bounded; unknown paths share one
+    "unmatched" label.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        in_flight = HTTP_IN_FLIGHT.labels()
+        in_flight.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_flight.dec()
+            template = route_template(scope)
+            method = scope["method"]
+            HTTP_LATENCY.labels(method=method, route=template).observe(time.perf_counter() - started)
+            HTTP_REQUESTS.labels(method=method, route=template, status=status["code"]).inc()
+
+
+# ============================================================================
+# Snapshots and exposition
+# ============================================================================
+
+def snapshot() -> dict:
+    """This worker's metrics as JSON-serializable data (call on the event loop)"""
+    for hook in _refresh_hooks:
+        try:
+            hook()
+        except Exception as e:
+            print(f"Metrics refresh warning (non-blocking): {e}")
+    return {metric.name: metric.snapshot() for metric in REGISTRY}
+
+
+def _write_snapshot_file(directory: str, metrics: dict):
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump({"pid": os.getpid(), "metrics": metrics}, f)
+    os.replace(tmp_path, os.path.join(directory, f"{os.getpid()}.json"))
+
+
+def write_snapshot(directory: str = METRICS_DIR):
+    """Atomically replace this worker's snapshot file (<pid>.json)"""
+    if directory:
+        _write_snapshot_file(directory, snapshot())
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _merge(total: dict, name: str, data: dict, include_gauges: bool):
+    if data["kind"] == "gauge" and not include_gauges:
+        return
+    merged = total.setdefault(name, {**data, "samples": {}})
+    for labels, value in data["samples"]:
+        key = tuple(labels)
+        if data["kind"] == "histogram":
+            current = merged["samples"].get(key)
+            if current is None:
+                merged["samples"][key] = {"counts": list(value["counts"]), "sum": value["sum"]}
+            else:
+                current["counts"] = [a + b for a, b in zip(current["counts"], value["counts"])]
+                current["sum"] += value["sum"]
+        else:
+            merged["samples"][key] = merged["samples"].get(key, 0.0) + value
+
+
+def collect(directory: str = METRICS_DIR, local: Optional[dict] = None) -> dict:
+    """
+    Metrics summed over every worker.
+
+    Counters and histograms of workers that have exited are kept (their
+    files stay), so totals don't go backwards when gunicorn recycles a
+    worker; gauges only count live workers.
+
+    Args:
+        directory: Shared snapshot directory ("" = this worker only)
+        local: This worker's snapshot(), taken on the event loop when
+               collect() runs in a thread; taken here if not given
+    """
+    local = local if local is not None else snapshot()
+    total: dict = {}
+    if not directory:
+        for name, data in local.items():
+            _merge(total, name, data, include_gauges=True)
+        return total
+
+    _write_snapshot_file(directory, local)
+    for filename in os.listdir(directory):
+        if not filename.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(directory, filename)) as f:
+                worker = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            continue  # Being replaced right now; next scrape gets it
+        alive = _pid_alive(worker["pid"])
+        for name, data in worker["metrics"].items():
+            _merge(total, name, data, include_gauges=alive)
+    return total
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: List[str], values, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render(directory: str = METRICS_DIR, local: Optional[dict] = None) -> str:
+    """All metrics in the Prometheus text exposition format (version 0.0.4, see collect())"""
+    lines = []
+    for name, data in sorted(collect(directory, local).items()):
+        lines.append(f"# HELP {name} {data['help']}")
+        lines.append(f"# TYPE {name} {data['kind']}")
+        labelnames = data["labelnames"]
+        for labels, value in sorted(data["samples"].items()):
+            if data["kind"] != "histogram":
+                lines.append(f"{name}{_format_labels(labelnames, labels)} {_format_value(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(list(data["buckets"]) + ["+Inf"], value["counts"]):
+                cumulative += count
+                le = bound if bound == "+Inf" else _format_value(bound)
+                lines.append(f"{name}_bucket{_format_labels(labelnames, labels, ('le', le))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labelnames, labels)} {_format_value(value['sum'])}")
+            lines.append(f"{name}_count{_format_labels(labelnames, labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+async def run_metrics_snapshots():
+    """Background task: write this worker's snapshot every METRICS_SNAPSHOT_SECONDS"""
+    if not METRICS_DIR:
+        return
+    while True:
+        await asyncio.sleep(METRICS_SNAPSHOT_SECONDS)
+        try:
+            # Refresh hooks read event-loop state, so only the file write
+            # leaves the loop
+            await asyncio.to_thread(_write_snapshot_file, METRICS_DIR, snapshot())
+        except Exception as e:
+            print(f"Metrics snapshot warning: {e}")
+
+
+def final_snapshot(directory: str = METRICS_DIR):
+    """Write the last snapshot at shutdown (counters outlive the worker)"""
+    if directory:
+        write_snapshot(directory)
@@ -0,0 +1,40 @@
+"""
+Order lifecycle hooks for Soko Pay
+Routes call on_order_event() so derived tables stay in step with orders
+"""
+
+from app.services.market_insights import record_market_event
+from app.services.photo_storage import add_photo_references
+from app.services.seller_stats import record_order_event
+from app.services.similarity_index import similarity_index
+
+
+def on_order_event(order: dict, event: str, conn=None):
+    """
+    Update everything derived from an order event.
+
+    Args:
+        order: Order dict (as stored in the orders table)
+        event: created, paid, completed, disputed or refunded
+        conn: Existing connection when called inside a route's transaction
+    """
+    try:
+        record_order_event(order, event, conn=conn)
+    except Exception as e:
+        print(f"Seller stats warning (non-blocking): {e}")
+
+    try:
+        record_market_event(order, event, conn=conn)
+    except Exception as e:
+        print(f"Market rollup warning (non-blocking): {e}")
+
+    if event == "created":
+        try:
+            similarity_index.add(order)
+        except Exception as e:
+            print(f"Similarity index warning (non-blocking): {e}")
+
+        try:
+            add_photo_references(order.get("product_photos"), conn=conn)
+        except Exception as e:
+            print(f"Photo reference warning (non-blocking): {e}")
@@ -1,13 +1,10 @@
-import os
 import requests
 import json
 from typing import Optional
 
-# PayHero Basic Auth token (base64 encoded API_Username:API_Password)
-PAYHERO_AUTH_TOKEN = os.getenv("PAYHERO_AUTH_TOKEN", "")
-PAYHERO_CHANNEL_ID = int(os.getenv("PAYHERO_CHANNEL_ID", "5520"))
-PAYHERO_BASE_URL = "https://backend.payhero.co.ke/api/v2"
-CALLBACK_URL = os.getenv("CALLBACK_URL", "https://soko-pay.vercel.app/api/payhero/callback")
+from app.config import CALLBACK_URL, PAYHERO_AUTH_TOKEN, PAYHERO_BASE_URL, PAYHERO_CHANNEL_ID
+from app.services.metrics import outbound_timer
+from app.services.tracing import span
 
 
 def initiate_payment(
@@ -50,14 +47,16 @@ def initiate_payment(
     }
 
     try:
-        response = requests.post(
-            f"{PAYHERO_BASE_URL}/payments",
-            headers=headers,
-            data=json.dumps(payload),
-            timeout=30
-        )
-
-        response.raise_for_status()
+        with outbound_timer("payhero", "initiate_payment"), \
+                span("payhero.initiate_payment", "client", order_id=order_id) as payhero_span:
+            response = requests.post(
+                f"{PAYHERO_BASE_URL}/payments",
+                headers=headers,
+                data=json.dumps(payload),
+                timeout=30
+            )
+            payhero_span.set("http.status_code", response.status_code)
+            response.raise_for_status()
 
         data = response.json()
 
@@ -108,13 +107,15 @@ def verify_payment(reference: str) -> Optional[dict]:
     }
 
     try:
-        response = requests.get(
-            f"{PAYHERO_BASE_URL}/payments/{reference}",
-            headers=headers,
-            timeout=15
-        )
-
-        response.raise_for_status()
+        with outbound_timer("payhero", "verify_payment"), \
+                span("payhero.verify_payment", "client", reference=reference) as payhero_span:
+            response = requests.get(
+                f"{PAYHERO_BASE_URL}/payments/{reference}",
+                headers=headers,
+                timeout=15
+            )
+            payhero_span.set("http.status_code", response.status_code)
+            response.raise_for_status()
         return response.json()
 
     except requests.exceptions.RequestException:
@@ -0,0 +1,74 @@
+"""
+In-memory cache of small product photos for Soko Pay
+Thumbnails and card images are requested on every list/track page view;
+the hottest ones are served from memory without touching the disk
+"""
+
+import os
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+# Total memory for cached photos, and the largest file worth caching
+PHOTO_CACHE_BYTES = int(os.getenv("PHOTO_CACHE_BYTES", str(16 * 1024 * 1024)))
+PHOTO_CACHE_ITEM_BYTES = int(os.getenv("PHOTO_CACHE_ITEM_BYTES", str(64 * 1024)))
+
+
+class SmallFileCache:
+    """
+    LRU of small immutable files, bounded by total bytes.
+
+    Only content-addressed files go in, so entries never go stale while
+    the file exists; a file deleted by photo GC simply ages out.
+    """
+
+    def __init__(self, max_bytes: int = PHOTO_CACHE_BYTES, max_item_bytes: int = PHOTO_CACHE_ITEM_BYTES):
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_item_bytes
+        self._entries: "OrderedDict[str, Tuple[bytes, str]]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Tuple[bytes, str]]:
+        """(content, media_type) for a cached file, marking it most recently used"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def cacheable(self, size: int) -> bool:
+        return 0 < size <= self.max_item_bytes and self.max_bytes > 0
+
+    def put(self, key: str, content: bytes, media_type: str):
+        if not self.cacheable(len(content)):
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= len(previous[0])
+        self._entries[key] = (content, media_type)
+        self._bytes += len(content)
+        while self._bytes > self.max_bytes:
+            _, (evicted, _) = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    @property
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+photo_cache = SmallFileCache()
@@ -0,0 +1,164 @@
+"""
+Product photo derivatives for Soko Pay
+WebP thumbnail and display sizes rendered in a process pool with EXIF
+stripped, stored next to the original at predictable URLs
+"""
+
+import asyncio
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+
+from app.services.photo_storage import PHOTO_URL_PREFIX, UPLOAD_DIR, blob_filename
+from app.utils.single_flight import single_flight
+from database import get_db
+
+# Longest edge (pixels) per derivative; images are never upscaled
+DERIVATIVE_SIZES = {
+    "thumb": 160,     # Order lists, chat previews
+    "card": 480,      # Product cards on the buy and track pages
+    "display": 1080,  # Carousel / full-screen view on phones
+}
+
+PHOTO_WEBP_QUALITY = int(os.getenv("PHOTO_WEBP_QUALITY", "80"))
+
+# Worker processes for resizing (CPU-bound, so kept off the event loop and the GIL)
+PHOTO_WORKERS = int(os.getenv("PHOTO_WORKERS", "2"))
+
+DERIVATIVE_NAME = re.compile(r"^([0-9a-f]{64})_(" + "|".join(DERIVATIVE_SIZES) + r")\.webp$")
+
+
+def derivative_filename(sha256: str, size: str) -> str:
+    """Path of a derivative relative to UPLOAD_DIR"""
+    return f"{sha256[:2]}/{sha256[2:4]}/{sha256}_{size}.webp"
+
+
+def derivative_urls(sha256: str) -> Dict[str, str]:
+    """URL of every derivative size for a photo (they exist once generated, or on first request)"""
+    return {size: f"{PHOTO_URL_PREFIX}/{derivative_filename(sha256, size)}" for size in DERIVATIVE_SIZES}
+
+
+def render_derivatives(source_path: str, sha256: str, upload_dir: str = UPLOAD_DIR,
+                       quality: int = PHOTO_WEBP_QUALITY) -> dict:
+    """
+    Resize one photo into every derivative size (runs in a worker process).
+
+    EXIF orientation is applied to the pixels, then all metadata is
+    dropped - the WebP files carry no EXIF (so no GPS location either).
+
+    Returns:
+        {"width": int, "height": int, "derivatives": {size: {"width", "height", "bytes"}}}
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(source_path) as image:
+        # Dimensions as displayed (EXIF orientations 5-8 rotate by 90 degrees)
+        width, height = image.size
+        if image.getexif().get(0x0112) in (5, 6, 7, 8):
+            width, height = height, width
+
+        # Let JPEG decode at a reduced scale when the photo is far bigger
+        # than the largest derivative
+        largest = max(DERIVATIVE_SIZES.values())
+        image.draft("RGB", (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info or "A" in image.getbands() else "RGB")
+
+        outputs = {}
+        for size, edge in DERIVATIVE_SIZES.items():
+            resized = image.copy()
+            resized.thumbnail((edge, edge), Image.LANCZOS)
+            path = os.path.join(upload_dir, derivative_filename(sha256, size))
+            tmp_path = f"{path}.part"
+            resized.save(tmp_path, "WEBP", quality=quality, method=4)
+            os.replace(tmp_path, path)
+            outputs[size] = {"width": resized.width, "height": resized.height, "bytes": os.path.getsize(path)}
+
+    return {"width": width, "height": height, "derivatives": outputs}
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=PHOTO_WORKERS)
+    return _pool
+
+
+def shutdown_pool():
+    """Stop the worker processes (called at shutdown)"""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _record_dimensions(sha256: str, width: int, height: int):
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE photo_blobs SET width = ?, height = ?, derivatives_at = CURRENT_TIMESTAMP
+            WHERE sha256 = ?
+        """, (width, height, sha256))
+        conn.commit()
+
+
+def _blob_extension(sha256: str) -> Optional[str]:
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT extension FROM photo_blobs WHERE sha256 = ?", (sha256,))
+        row = cursor.fetchone()
+        return row["extension"] if row else None
+
+
+async def generate_derivatives(sha256: str, extension: str, upload_dir: str = UPLOAD_DIR) -> Optional[dict]:
+    """
+    Render every derivative of a stored photo in the process pool.
+
+    Concurrent requests for the same photo (upload background task and a
+    lazy request racing it) share one render.
+
+    Returns:
+        render_derivatives() summary, or None if the photo is missing or
+        can't be decoded
+    """
+    source_path = os.path.join(upload_dir, blob_filename(sha256, extension))
+
+    async def render():
+        if not await asyncio.to_thread(os.path.exists, source_path):
+            return None
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(_get_pool(), render_derivatives, source_path, sha256, upload_dir)
+        except Exception as e:
+            print(f"Photo derivative warning (non-blocking): {sha256[:12]}: {e}")
+            return None
+        await asyncio.to_thread(_record_dimensions, sha256, result["width"], result["height"])
+        result["seconds"] = round(time.perf_counter() - started, 3)
+        return result
+
+    return await single_flight.do(f"photo_derivatives:{sha256}", render, "photo_derivatives")
+
+
+async def ensure_derivative(sha256: str, size: str, upload_dir: str = UPLOAD_DIR) -> Optional[str]:
+    """
+    Path to a derivative, generating it first if it doesn't exist yet.
+
+    Returns:
+        File path, or None if there is no such photo (or it can't be resized)
+    """
+    path = os.path.join(upload_dir, derivative_filename(sha256, size))
+    if await asyncio.to_thread(os.path.exists, path):
+        return path
+
+    extension = await asyncio.to_thread(_blob_extension, sha256)
+    if extension is None:
+        return None
+    await generate_derivatives(sha256, extension, upload_dir)
+    return path if await asyncio.to_thread(os.path.exists, path) else None
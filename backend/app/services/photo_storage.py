@@ -0,0 +1,341 @@
+"""
+Product photo storage for Soko Pay
+Uploads are streamed to disk in fixed-size chunks and stored by content
+hash (uploads/products/ab/cd/<sha256>.jpg), so a photo reused across
+relistings is kept once; blobs no orders reference are garbage collected
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+from typing import Dict, Iterable, List, Optional
+
+from fastapi import UploadFile
+
+from app.config import UPLOAD_DIR
+from database import get_db
+
+# URL prefix photos are served under (the UPLOAD_DIR static mount)
+PHOTO_URL_PREFIX = "/uploads/products"
+
+# Max photo size and how much of it is held in memory at a time
+MAX_PHOTO_BYTES = 5 * 1024 * 1024
+UPLOAD_CHUNK_BYTES = 64 * 1024
+
+# Unreferenced blobs younger than this are kept - sellers upload photos
+# before creating the order that references them
+PHOTO_GC_GRACE_SECONDS = int(os.getenv("PHOTO_GC_GRACE_SECONDS", "86400"))
+
+PHOTO_EXTENSIONS = {
+    "image/jpeg": "jpg",
+    "image/png": "png",
+    "image/webp": "webp",
+}
+
+_BLOB_URL = re.compile(r"/([0-9a-f]{64})\.[a-z]+$")
+_SHA256 = re.compile(r"^[0-9a-f]{64}$")
+
+
+class PhotoTooLarge(Exception):
+    """Upload crossed MAX_PHOTO_BYTES"""
+
+    def __init__(self, size: int):
+        super().__init__(f"File too large: {size / 1024 / 1024:.1f}MB (max {MAX_PHOTO_BYTES // 1024 // 1024}MB)")
+        self.size = size
+
+
+def blob_filename(sha256: str, extension: str) -> str:
+    """Path of a blob relative to UPLOAD_DIR, sharded by the first two hash bytes"""
+    return f"{sha256[:2]}/{sha256[2:4]}/{sha256}.{extension}"
+
+
+def blob_sha256(photo_url: str) -> Optional[str]:
+    """Content hash from a stored photo URL (None for legacy uuid-named photos)"""
+    match = _BLOB_URL.search(photo_url or "")
+    return match.group(1) if match else None
+
+
+def _discard(tmp_file, tmp_path: str):
+    tmp_file.close()
+    try:
+        os.remove(tmp_path)
+    except FileNotFoundError:
+        pass
+
+
+def _find_blob(sha256: str) -> Optional[dict]:
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM photo_blobs WHERE sha256 = ?", (sha256,))
+        row = cursor.fetchone()
+        return dict(row) if row else None
+
+
+def _touch_blob(sha256: str) -> Optional[dict]:
+    """Mark an existing blob as just uploaded (restarts its GC grace period)"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE photo_blobs SET last_uploaded_at = CURRENT_TIMESTAMP WHERE sha256 = ?",
+            (sha256,)
+        )
+        conn.commit()
+        cursor.execute("SELECT * FROM photo_blobs WHERE sha256 = ?", (sha256,))
+        row = cursor.fetchone()
+        return dict(row) if row else None
+
+
+def _commit_blob(tmp_path: str, path: str, sha256: str, extension: str, content_type: str, size: int) -> bool:
+    """Move a finished upload into place unless the blob already exists. Returns True if deduplicated."""
+    # Row first: a re-upload restarts the grace period before we rely on
+    # the file being there, and collect_garbage deletes the row before the
+    # files, so it can't remove a file we just decided to keep
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO photo_blobs (sha256, extension, content_type, size_bytes, last_uploaded_at)
+            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(sha256) DO UPDATE SET last_uploaded_at = CURRENT_TIMESTAMP
+        """, (sha256, extension, content_type, size))
+        conn.commit()
+
+    deduplicated = os.path.exists(path)
+    if deduplicated:
+        os.remove(tmp_path)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+    return deduplicated
+
+
+def _stored(blob: dict, deduplicated: bool) -> dict:
+    filename = blob_filename(blob["sha256"], blob["extension"])
+    return {
+        "filename": filename,
+        "url": f"{PHOTO_URL_PREFIX}/{filename}",
+        "size": blob["size_bytes"],
+        "sha256": blob["sha256"],
+        "deduplicated": deduplicated,
+    }
+
+
+async def save_upload(file: UploadFile, content_type: str, expected_sha256: Optional[str] = None,
+                      upload_dir: str = UPLOAD_DIR, max_bytes: int = MAX_PHOTO_BYTES) -> dict:
+    """
+    Store an uploaded photo by content hash.
+
+    If the client sends the hash of a photo we already have, nothing is
+    read or written. Otherwise the upload is streamed UPLOAD_CHUNK_BYTES
+    at a time to a temp file (disk writes in a thread), hashed on the way,
+    and renamed into its sharded place - or dropped if those bytes are
+    already stored.
+
+    Args:
+        file: The multipart upload
+        content_type: Validated image type (picks the extension)
+        expected_sha256: Hash the client says the file has (X-Content-SHA256)
+        upload_dir: Directory to store photos in
+        max_bytes: Size cap; crossing it stops the read and deletes the partial file
+
+    Returns:
+        {"filename": str, "url": str, "size": int, "sha256": str, "deduplicated": bool}
+
+    Raises:
+        PhotoTooLarge: the upload is over max_bytes
+    """
+    if expected_sha256 and _SHA256.match(expected_sha256.lower()):
+        blob = await asyncio.to_thread(_touch_blob, expected_sha256.lower())
+        if blob:
+            return _stored(blob, deduplicated=True)
+
+    # The multipart parser already knows the size; reject without reading
+    declared_size: Optional[int] = getattr(file, "size", None)
+    if declared_size is not None and declared_size > max_bytes:
+        raise PhotoTooLarge(declared_size)
+
+    await asyncio.to_thread(os.makedirs, upload_dir, exist_ok=True)
+    fd, tmp_path = await asyncio.to_thread(tempfile.mkstemp, dir=upload_dir, suffix=".part")
+    tmp_file = os.fdopen(fd, "wb")
+
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise PhotoTooLarge(size)
+            digest.update(chunk)
+            await asyncio.to_thread(tmp_file.write, chunk)
+        await asyncio.to_thread(tmp_file.close)
+    except BaseException:
+        await asyncio.to_thread(_discard, tmp_file, tmp_path)
+        raise
+
+    sha256 = digest.hexdigest()
+    extension = PHOTO_EXTENSIONS[content_type]
+    path = os.path.join(upload_dir, blob_filename(sha256, extension))
+    deduplicated = await asyncio.to_thread(_commit_blob, tmp_path, path, sha256, extension, content_type, size)
+
+    blob = await asyncio.to_thread(_find_blob, sha256)
+    return _stored(blob, deduplicated)
+
+
+# ============================================================================
+# References and garbage collection
+# ============================================================================
+
+def _photo_urls(product_photos) -> List[str]:
+    if not product_photos:
+        return []
+    if isinstance(product_photos, str):
+        try:
+            product_photos = json.loads(product_photos)
+        except json.JSONDecodeError:
+            return []
+    return [url for url in product_photos if isinstance(url, str)]
+
+
+def add_photo_references(product_photos, conn=None):
+    """
+    Count an order's photos as references to their blobs (called on order creation).
+
+    Args:
+        product_photos: orders.product_photos (JSON string or list of URLs)
+        conn: Existing connection when called inside a route's transaction
+    """
+    hashes = [sha for sha in (blob_sha256(url) for url in _photo_urls(product_photos)) if sha]
+    if not hashes:
+        return
+
+    def apply(connection):
+        connection.cursor().executemany(
+            "UPDATE photo_blobs SET ref_count = ref_count + 1 WHERE sha256 = ?",
+            [(sha,) for sha in hashes]
+        )
+
+    if conn is not None:
+        apply(conn)
+    else:
+        with get_db() as connection:
+            apply(connection)
+            connection.commit()
+
+
+def recount_photo_references() -> int:
+    """
+    Recompute every blob's ref_count from orders.product_photos.
+
+    Returns:
+        Number of blobs whose count changed
+    """
+    counts: Dict[str, int] = {}
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT product_photos FROM orders WHERE product_photos IS NOT NULL")
+        while True:
+            rows = cursor.fetchmany(5000)
+            if not rows:
+                break
+            for row in rows:
+                for url in _photo_urls(row["product_photos"]):
+                    sha = blob_sha256(url)
+                    if sha:
+                        counts[sha] = counts.get(sha, 0) + 1
+
+        cursor.execute("SELECT sha256, ref_count FROM photo_blobs")
+        changes = [
+            (counts.get(row["sha256"], 0), row["sha256"])
+            for row in cursor.fetchall()
+            if counts.get(row["sha256"], 0) != row["ref_count"]
+        ]
+        cursor.executemany("UPDATE photo_blobs SET ref_count = ? WHERE sha256 = ?", changes)
+        conn.commit()
+    return len(changes)
+
+
+def blob_paths(sha256: str, extension: str, upload_dir: str = UPLOAD_DIR) -> Iterable[str]:
+    """Every file stored for a blob: the original plus its resized derivatives"""
+    original = os.path.join(upload_dir, blob_filename(sha256, extension))
+    yield original
+    try:
+        names = os.listdir(os.path.dirname(original))
+    except FileNotFoundError:
+        return
+    for name in names:
+        if name.startswith(f"{sha256}_"):
+            yield os.path.join(os.path.dirname(original), name)
+
+
+def collect_garbage(grace_seconds: int = PHOTO_GC_GRACE_SECONDS, recount: bool = True,
+                    dry_run: bool = False, upload_dir: str = UPLOAD_DIR) -> dict:
+    """
+    Delete blobs no order references, once they are older than the grace period.
+
+    Age counts from the last upload of the blob, so a seller re-uploading
+    an old unreferenced photo has the full grace period to use it.
+
+    Args:
+        grace_seconds: Minimum time since an unreferenced blob was last uploaded
+        recount: Recompute ref counts from orders first
+        dry_run: Report what would be deleted without deleting
+
+    Returns:
+        {"recounted": int, "deleted": int, "freed_kb": float}
+    """
+    recounted = recount_photo_references() if recount else 0
+    cutoff = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time.time() - grace_seconds))
+
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT sha256, extension, size_bytes FROM photo_blobs
+            WHERE ref_count <= 0 AND COALESCE(last_uploaded_at, created_at) < ?
+        """, (cutoff,))
+        garbage = cursor.fetchall()
+
+        freed = 0
+        deleted = 0
+        for blob in garbage:
+            if dry_run:
+                freed += blob["size_bytes"]
+                deleted += 1
+                continue
+            # Re-check under the write lock: skip a blob re-uploaded or
+            # referenced since the SELECT. Files go before the commit, so
+            # an upload waiting on the lock finds them gone and re-stores them.
+            cursor.execute("""
+                DELETE FROM photo_blobs
+                WHERE sha256 = ? AND ref_count <= 0 AND COALESCE(last_uploaded_at, created_at) < ?
+            """, (blob["sha256"], cutoff))
+            if cursor.rowcount == 1:
+                for path in blob_paths(blob["sha256"], blob["extension"], upload_dir):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                freed += blob["size_bytes"]
+                deleted += 1
+            conn.commit()
+
+    return {"recounted": recounted, "deleted": deleted, "freed_kb": round(freed / 1024, 1), "dry_run": dry_run}
+
+
+# Garbage-collect unreferenced photos from the command line:
+#   python -m app.services.photo_storage [--grace-seconds 86400] [--no-recount] [--dry-run]
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Delete product photos no order references")
+    parser.add_argument("--grace-seconds", type=int, default=PHOTO_GC_GRACE_SECONDS)
+    parser.add_argument("--no-recount", action="store_true", help="Trust stored ref counts")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    print(json.dumps(collect_garbage(args.grace_seconds, recount=not args.no_recount, dry_run=args.dry_run), indent=2))
@@ -0,0 +1,282 @@
+"""
+SQL profiling for Soko Pay
+Opt-in connection hook that times every statement (execute plus its
+fetches), groups statements by fingerprint, and captures EXPLAIN QUERY
+PLAN for the ones that scan whole tables
+"""
+
+import asyncio
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+# Off by default: every statement pays a timer and a lock when on
+QUERY_PROFILING = os.getenv("QUERY_PROFILING", "0").lower() in ("1", "true", "on")
+
+# Statements at or above this (ms) are counted as slow
+QUERY_SLOW_MS = float(os.getenv("QUERY_SLOW_MS", "50"))
+
+# Print the top fingerprints every N seconds (0 = only via /api/admin/query-profile)
+QUERY_PROFILE_LOG_SECONDS = int(os.getenv("QUERY_PROFILE_LOG_SECONDS", "0"))
+
+# Duration samples kept per fingerprint for percentiles
+SAMPLES_PER_FINGERPRINT = 500
+
+# Distinct SQL texts remembered with their fingerprint
+FINGERPRINT_CACHE_SIZE = 5000
+
+_COMMENT = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+_EXPLAINABLE = ("SELECT", "WITH", "UPDATE", "DELETE", "INSERT")
+
+
+def fingerprint(sql: str) -> str:
+    """
+    Normalize SQL so the same statement with different values groups together.
+
+    Literals become ?, IN (?, ?, ?) lists collapse to (?...), comments and
+    whitespace runs are dropped.
+    """
+    text = _COMMENT.sub(" ", sql)
+    text = _STRING.sub("?", text)
+    text = _NUMBER.sub("?", text)
+    text = _PLACEHOLDER_LIST.sub("(?...)", text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def is_full_scan(plan: List[str]) -> bool:
+    """True if an EXPLAIN QUERY PLAN visits every row of some table"""
+    return any(
+        detail.startswith("SCAN ") and not detail.startswith("SCAN CONSTANT ROW")
+        for detail in plan
+    )
+
+
+class _Fingerprint:
+    __slots__ = ("calls", "slow", "total", "max", "samples", "example", "plan", "full_scan", "explained")
+
+    def __init__(self, example: str):
+        self.calls = 0
+        self.slow = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=SAMPLES_PER_FINGERPRINT)
+        self.example = example
+        self.plan: Optional[List[str]] = None
+        self.full_scan = False
+        self.explained = False
+
+
+class QueryProfiler:
+    """
+    Per-fingerprint timing for every statement run through get_db().
+
+    Time for a statement runs from execute() through its fetches and ends
+    at the next execute on that cursor, or when the cursor or connection
+    closes.
+    """
+
+    def __init__(self, enabled: bool = QUERY_PROFILING, slow_ms: float = QUERY_SLOW_MS):
+        self.enabled = enabled
+        self.slow_ms = slow_ms
+        self.started_at = time.time()
+        self._fingerprints: Dict[str, _Fingerprint] = {}
+        self._keys: Dict[str, str] = {}  # SQL text -> fingerprint
+        self._lock = threading.Lock()
+
+    @property
+    def connection_factory(self):
+        """sqlite3.connect(factory=...) for get_db()"""
+        return ProfilingConnection if self.enabled else sqlite3.Connection
+
+    def _entry(self, sql: str) -> _Fingerprint:
+        # Most statements are constant strings with ? parameters, so the
+        # regex normalization runs once per distinct SQL text
+        key = self._keys.get(sql)
+        if key is None:
+            if len(self._keys) >= FINGERPRINT_CACHE_SIZE:
+                self._keys.clear()
+            key = self._keys[sql] = fingerprint(sql)
+        entry = self._fingerprints.get(key)
+        if entry is None:
+            with self._lock:
+                entry = self._fingerprints.setdefault(key, _Fingerprint(_WHITESPACE.sub(" ", sql).strip()))
+        return entry
+
+    def record(self, sql: str, seconds: float):
+        entry = self._entry(sql)
+        elapsed_ms = seconds * 1000
+        with self._lock:
+            entry.calls += 1
+            entry.total += elapsed_ms
+            entry.max = max(entry.max, elapsed_ms)
+            entry.samples.append(elapsed_ms)
+            if elapsed_ms >= self.slow_ms:
+                entry.slow += 1
+
+    def needs_plan(self, sql: str) -> bool:
+        entry = self._entry(sql)
+        return not entry.explained and sql.lstrip()[:6].upper().startswith(_EXPLAINABLE)
+
+    def explain(self, connection: sqlite3.Connection, sql: str, parameters):
+        """Capture EXPLAIN QUERY PLAN once per fingerprint (kept only for full scans)"""
+        entry = self._entry(sql)
+        entry.explained = True
+        try:
+            # A plain cursor, so the EXPLAIN itself isn't profiled
+            rows = sqlite3.Cursor(connection).execute(f"EXPLAIN QUERY PLAN {sql}", parameters).fetchall()
+        except sqlite3.Error:
+            return
+        plan = [row[3] for row in rows]
+        if is_full_scan(plan):
+            entry.plan = plan
+            entry.full_scan = True
+
+    def reset(self):
+        with self._lock:
+            self._fingerprints.clear()
+            self.started_at = time.time()
+
+    def report(self, limit: int = 20, order_by: str = "total") -> dict:
+        """
+        Top fingerprints with call counts and latency percentiles.
+
+        Args:
+            limit: How many fingerprints to return
+            order_by: "total" (time spent), "p95", "max" or "calls"
+
+        Returns:
+            {"enabled", "slow_ms", "since", "fingerprints": int, "statements": [...]}
+        """
+        with self._lock:
+            items = [(key, entry, sorted(entry.samples)) for key, entry in self._fingerprints.items() if entry.calls]
+
+        def percentile(samples: List[float], p: float) -> float:
+            return round(samples[min(len(samples) - 1, int(len(samples) * p))], 3) if samples else 0.0
+
+        statements = [
+            {
+                "fingerprint": key,
+                "example": entry.example[:500],
+                "calls": entry.calls,
+                "slow_calls": entry.slow,
+                "total_ms": round(entry.total, 3),
+                "mean_ms": round(entry.total / entry.calls, 3),
+                "p50_ms": percentile(samples, 0.50),
+                "p95_ms": percentile(samples, 0.95),
+                "p99_ms": percentile(samples, 0.99),
+                "max_ms": round(entry.max, 3),
+                "full_scan": entry.full_scan,
+                "plan": entry.plan,
+            }
+            for key, entry, samples in items
+        ]
+        sort_key = {"total": "total_ms", "p95": "p95_ms", "max": "max_ms", "calls": "calls"}.get(order_by, "total_ms")
+        statements.sort(key=lambda s: s[sort_key], reverse=True)
+        return {
+            "enabled": self.enabled,
+            "slow_ms": self.slow_ms,
+            "since": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(self.started_at)),
+            "fingerprints": len(statements),
+            "statements": statements[:limit],
+        }
+
+
+query_profiler = QueryProfiler()
+
+
+class ProfilingCursor(sqlite3.Cursor):
+    """Cursor that reports each statement's execute + fetch time to query_profiler"""
+
+    _pending_sql: Optional[str] = None
+    _pending_seconds = 0.0
+
+    def _finish(self):
+        if self._pending_sql is not None:
+            query_profiler.record(self._pending_sql, self._pending_seconds)
+            self._pending_sql = None
+
+    def _timed_fetch(self, fetch, *args):
+        started = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            if self._pending_sql is not None:
+                self._pending_seconds += time.perf_counter() - started
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._pending_sql, self._pending_seconds = sql, time.perf_counter() - started
+            if query_profiler.needs_plan(sql):
+                query_profiler.explain(self.connection, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._pending_sql, self._pending_seconds = sql, time.perf_counter() - started
+
+    def fetchone(self):
+        return self._timed_fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._timed_fetch(super().fetchmany, self.arraysize if size is None else size)
+
+    def fetchall(self):
+        return self._timed_fetch(super().fetchall)
+
+    def close(self):
+        self._finish()
+        super().close()
+
+
+class ProfilingConnection(sqlite3.Connection):
+    """Connection whose cursors are ProfilingCursors; flushes their timings on close"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cursors: List[ProfilingCursor] = []
+
+    def cursor(self, factory=ProfilingCursor):
+        cursor = super().cursor(factory)
+        if isinstance(cursor, ProfilingCursor):
+            self._cursors.append(cursor)
+        return cursor
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def close(self):
+        for cursor in self._cursors:
+            cursor._finish()
+        self._cursors.clear()
+        super().close()
+
+
+async def run_query_profile_log():
+    """Background task: print the slowest fingerprints every QUERY_PROFILE_LOG_SECONDS"""
+    if not (query_profiler.enabled and QUERY_PROFILE_LOG_SECONDS > 0):
+        return
+    while True:
+        await asyncio.sleep(QUERY_PROFILE_LOG_SECONDS)
+        for statement in query_profiler.report(limit=5)["statements"]:
+            scan = " FULL SCAN" if statement["full_scan"] else ""
+            print(f"SQL {statement['total_ms']:.0f}ms total, {statement['calls']} calls, "
+                  f"p95 {statement['p95_ms']}ms{scan}: {statement['fingerprint'][:120]}")
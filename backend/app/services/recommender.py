@@ -0,0 +1,353 @@
+"""
+Order-history recommender for Soko Pay
+An offline job turns paid orders into item co-occurrence neighbours and
+regional popularity lists; lookups by buyer phone read them from memory
+"""
+
+import gzip
+import json
+import math
+import os
+import time
+from typing import Dict, List, Optional
+
+from app.config import MODEL_DIR
+from app.utils.text_features import tokenize
+from database import get_db
+
+RECOMMENDER_PATH = os.path.join(MODEL_DIR, "recommender.json.gz")
+
+# Neighbours kept per item and popular items kept per region
+NEIGHBOURS_PER_ITEM = 20
+POPULAR_PER_REGION = 50
+
+# Only a buyer's most recent items count towards co-occurrence, which
+# keeps the job linear for very active buyers
+MAX_ITEMS_PER_BUYER = 50
+
+# Grid size (degrees) used to group sellers into regions (~55 km)
+REGION_GRID_DEGREES = 0.5
+
+PAID_STATUSES = ("paid", "shipped", "delivered", "completed")
+
+
+def item_key(product_name: str) -> Optional[str]:
+    """
+    What a listing counts as for recommendations: its first two name words
+    ("samsung galaxy", "nike air"), so one-off listings of the same
+    product type pool their history.
+    """
+    tokens = [token for token in tokenize(product_name) if not token.isdigit()]
+    return " ".join(tokens[:2]) if tokens else None
+
+
+def region_for(lat: Optional[float], lon: Optional[float]) -> Optional[str]:
+    if lat is None or lon is None:
+        return None
+    step = REGION_GRID_DEGREES
+    return f"{math.floor(lat / step) * step:.1f},{math.floor(lon / step) * step:.1f}"
+
+
+# ============================================================================
+# Offline job
+# ============================================================================
+
+def build_recommender(path: str = RECOMMENDER_PATH) -> dict:
+    """
+    Precompute co-occurrence neighbours and popularity from paid orders.
+
+    Orders are streamed sorted by buyer, so only one buyer's items are in
+    memory at a time. Item pairs are scored with cosine similarity
+    (co-buyers / sqrt(buyers_a * buyers_b)).
+
+    Returns:
+        Build summary (items, regions, buyers, file size, seconds)
+    """
+    started = time.perf_counter()
+    index: Dict[str, int] = {}
+    categories: List[Dict[str, int]] = []
+    prices: List[List[float]] = []
+    buyers_per_item: List[int] = []
+    pair_counts: Dict[tuple, int] = {}
+    region_counts: Dict[str, Dict[int, int]] = {}
+    buyers = 0
+
+    def flush(items: List[int]):
+        unique = list(dict.fromkeys(items))[:MAX_ITEMS_PER_BUYER]
+        for item in unique:
+            buyers_per_item[item] += 1
+        for i, a in enumerate(unique):
+            for b in unique[i + 1:]:
+                pair = (a, b) if a < b else (b, a)
+                pair_counts[pair] = pair_counts.get(pair, 0) + 1
+
+    with get_db() as conn:
+        cursor = conn.cursor()
+        placeholders = ",".join("?" * len(PAID_STATUSES))
+        cursor.execute(f"""
+            SELECT buyer_phone, product_name, product_category, product_price,
+                   seller_location_lat, seller_location_lon
+            FROM orders
+            WHERE buyer_phone IS NOT NULL AND status IN ({placeholders})
+            ORDER BY buyer_phone, created_at DESC
+        """, PAID_STATUSES)
+
+        current, items = None, []
+        while True:
+            rows = cursor.fetchmany(5000)
+            if not rows:
+                break
+            for row in rows:
+                key = item_key(row["product_name"])
+                if key is None:
+                    continue
+                item = index.get(key)
+                if item is None:
+                    item = index[key] = len(index)
+                    categories.append({})
+                    prices.append([])
+                    buyers_per_item.append(0)
+                category = row["product_category"] or "Other"
+                categories[item][category] = categories[item].get(category, 0) + 1
+                if len(prices[item]) < 200:
+                    prices[item].append(row["product_price"])
+
+                region = region_for(row["seller_location_lat"], row["seller_location_lon"])
+                for bucket in (region, "all"):
+                    if bucket:
+                        counts = region_counts.setdefault(bucket, {})
+                        counts[item] = counts.get(item, 0) + 1
+
+                if row["buyer_phone"] != current:
+                    if current is not None:
+                        flush(items)
+                        buyers += 1
+                    current, items = row["buyer_phone"], []
+                items.append(item)
+
+        if current is not None:
+            flush(items)
+            buyers += 1
+
+    neighbours: List[List[tuple]] = [[] for _ in index]
+    for (a, b), count in pair_counts.items():
+        score = count / math.sqrt(buyers_per_item[a] * buyers_per_item[b])
+        neighbours[a].append((b, score))
+        neighbours[b].append((a, score))
+
+    def price_range(values: List[float]) -> List[float]:
+        values = sorted(values)
+        return [round(values[len(values) // 4]), round(values[(len(values) * 3) // 4])] if values else [0, 0]
+
+    payload = {
+        "built_at": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()),
+        "items": list(index),
+        "categories": [max(counts, key=counts.get) for counts in categories],
+        "price_ranges": [price_range(values) for values in prices],
+        "buyers": buyers_per_item,
+        "neighbours": [
+            [[other, round(score, 4)] for other, score in sorted(found, key=lambda n: -n[1])[:NEIGHBOURS_PER_ITEM]]
+            for found in neighbours
+        ],
+        "popular": {
+            region: [item for item, _ in sorted(counts.items(), key=lambda c: -c[1])[:POPULAR_PER_REGION]]
+            for region, counts in region_counts.items()
+        },
+    }
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.part"
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        json.dump(payload, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+    return {
+        "items": len(index),
+        "pairs": len(pair_counts),
+        "regions": len(region_counts) - (1 if "all" in region_counts else 0),
+        "buyers": buyers,
+        "file_kb": round(os.path.getsize(path) / 1024, 1),
+        "seconds": round(time.perf_counter() - started, 2),
+    }
+
+
+# ============================================================================
+# Serving
+# ============================================================================
+
+class Recommender:
+    """Precomputed neighbours and popularity lists held in memory"""
+
+    def __init__(self, payload: dict):
+        self.built_at = payload["built_at"]
+        self.items: List[str] = payload["items"]
+        self.index = {key: i for i, key in enumerate(self.items)}
+        self.categories: List[str] = payload["categories"]
+        self.price_ranges: List[List[float]] = payload["price_ranges"]
+        self.buyers: List[int] = payload["buyers"]
+        self.neighbours: List[List[List[float]]] = payload["neighbours"]
+        self.popular: Dict[str, List[int]] = payload["popular"]
+
+    @classmethod
+    def load(cls, path: str = RECOMMENDER_PATH) -> "Recommender":
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def recommend(self, history: List[str], region: Optional[str] = None, limit: int = 5) -> List[dict]:
+        """
+        Top items for a buyer.
+
+        Args:
+            history: Item keys the buyer bought, most recent first
+            region: Region to take popular items from when history runs out
+            limit: Number of recommendations
+
+        Returns:
+            [{"item": int, "score": float, "reason": str, "because": str | None}]
+        """
+        owned = {self.index[key] for key in history if key in self.index}
+        scores: Dict[int, float] = {}
+        because: Dict[int, int] = {}
+        for rank, key in enumerate(history[:MAX_ITEMS_PER_BUYER]):
+            source = self.index.get(key)
+            if source is None:
+                continue
+            weight = 1.0 / (1 + rank)  # Recent purchases count more
+            for other, score in self.neighbours[source]:
+                if other in owned:
+                    continue
+                scores[other] = scores.get(other, 0.0) + weight * score
+                if other not in because:
+                    because[other] = source
+
+        ranked = sorted(scores.items(), key=lambda s: -s[1])[:limit]
+        results = [
+            {"item": item, "score": round(score, 4), "reason": "co_purchase", "because": self.items[because[item]]}
+            for item, score in ranked
+        ]
+
+        if len(results) < limit:
+            chosen = owned | {result["item"] for result in results}
+            for bucket, reason in ((region, "popular_in_region"), ("all", "popular")):
+                for item in self.popular.get(bucket, []) if bucket else []:
+                    if len(results) >= limit:
+                        break
+                    if item not in chosen:
+                        chosen.add(item)
+                        results.append({"item": item, "score": 0.0, "reason": reason, "because": None})
+        return results
+
+
+_recommender: Optional[Recommender] = None
+_load_attempted = False
+
+
+def load_recommender(path: str = RECOMMENDER_PATH) -> Optional[Recommender]:
+    """Load the precomputed file (called at startup)"""
+    global _recommender, _load_attempted
+    _load_attempted = True
+    if not os.path.exists(path):
+        print(f"Recommender not found at {path} - run python -m app.services.recommender")
+        _recommender = None
+        return None
+    try:
+        _recommender = Recommender.load(path)
+        print(f"Recommender loaded: {len(_recommender.items)} items, built {_recommender.built_at}")
+    except Exception as e:
+        print(f"Recommender load warning (non-blocking): {e}")
+        _recommender = None
+    return _recommender
+
+
+def get_recommender() -> Optional[Recommender]:
+    if not _load_attempted:
+        load_recommender()
+    return _recommender
+
+
+def buyer_history(buyer_phone: str, limit: int = MAX_ITEMS_PER_BUYER) -> dict:
+    """A buyer's recent item keys (most recent first) and the region they buy from most"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        placeholders = ",".join("?" * len(PAID_STATUSES))
+        cursor.execute(f"""
+            SELECT product_name, seller_location_lat, seller_location_lon
+            FROM orders
+            WHERE buyer_phone = ? AND status IN ({placeholders})
+            ORDER BY created_at DESC
+            LIMIT ?
+        """, (buyer_phone, *PAID_STATUSES, limit))
+        rows = cursor.fetchall()
+
+    regions: Dict[str, int] = {}
+    for row in rows:
+        region = region_for(row["seller_location_lat"], row["seller_location_lon"])
+        if region:
+            regions[region] = regions.get(region, 0) + 1
+
+    return {
+        "items": [key for key in (item_key(row["product_name"]) for row in rows) if key],
+        "region": max(regions, key=regions.get) if regions else None
+    }
+
+
+def recommend_for_buyer(
+    buyer_phone: Optional[str],
+    recent_purchases: Optional[List[str]] = None,
+    region: Optional[str] = None,
+    limit: int = 5
+) -> dict:
+    """
+    Recommendations in the /ai/recommendations shape.
+
+    Args:
+        buyer_phone: Buyer to look up (their paid orders are the history)
+        recent_purchases: Extra product names, e.g. for buyers new to Soko Pay
+        region: Override the region used for popular items ("lat,lon" grid cell)
+        limit: Number of recommendations
+
+    Returns:
+        {
+            "recommendations": [{"product_type", "category", "estimated_price_range",
+                                 "why_recommended", "search_keywords"}],
+            "message": str
+        }
+    """
+    recommender = get_recommender()
+    if recommender is None:
+        return {"recommendations": [], "message": "Recommendations are not available yet"}
+
+    history = buyer_history(buyer_phone) if buyer_phone else {"items": [], "region": None}
+    items = history["items"] + [key for key in (item_key(name) for name in recent_purchases or []) if key]
+
+    reasons = {
+        "co_purchase": "Buyers who bought {because} also bought this",
+        "popular_in_region": "Popular with buyers in your area",
+        "popular": "Popular on Soko Pay right now",
+    }
+    recommendations = []
+    for result in recommender.recommend(items, region or history["region"], limit):
+        item = result["item"]
+        low, high = recommender.price_ranges[item]
+        recommendations.append({
+            "product_type": recommender.items[item].title(),
+            "category": recommender.categories[item],
+            "estimated_price_range": {"min": low, "max": high},
+            "why_recommended": reasons[result["reason"]].format(because=(result["because"] or "").title()),
+            "search_keywords": [recommender.items[item]],
+            "score": result["score"]
+        })
+
+    if not recommendations:
+        message = "Check back soon for recommendations"
+    elif items:
+        message = f"Picked for you based on your {len(items)} recent purchase{'s' if len(items) != 1 else ''}"
+    else:
+        message = "Trending on Soko Pay"
+
+    return {"recommendations": recommendations, "message": message}
+
+
+# Rebuild from the command line: python -m app.services.recommender
+if __name__ == "__main__":
+    print(json.dumps(build_recommender(), indent=2))
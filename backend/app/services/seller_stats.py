@@ -0,0 +1,398 @@
+"""
+Materialized seller statistics and reputation for Soko Pay
+One row per seller, updated incrementally on every order event
+"""
+
+import json
+import math
+import time
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from app.utils.money import to_cents, from_cents
+from database import get_db
+
+# Half-life of the rolling window counters (recent_*), in days
+RECENT_HALF_LIFE_DAYS = 30
+
+# Pseudo-orders blended into every seller's rates so one early dispute
+# doesn't sink a new seller and one completed order doesn't make them
+# look perfect
+PRIOR_WEIGHT = 5
+PRIOR_COMPLETION_RATE = 0.6
+PRIOR_DISPUTE_RATE = 0.1
+PRIOR_REFUND_RATE = 0.1
+
+NEUTRAL_REPUTATION = 50
+
+ORDER_EVENTS = ["created", "paid", "completed", "disputed", "refunded"]
+
+_COUNT_FIELDS = {
+    "created": "order_count",
+    "paid": "paid_count",
+    "completed": "completed_count",
+    "disputed": "disputed_count",
+    "refunded": "refunded_count",
+}
+
+_RECENT_FIELDS = {
+    "created": "recent_orders",
+    "completed": "recent_completed",
+    "disputed": "recent_disputed",
+    "refunded": "recent_refunded",
+}
+
+
+# ============================================================================
+# Incremental updates
+# ============================================================================
+
+def _empty_stats(seller_phone: str) -> dict:
+    return {
+        "seller_phone": seller_phone,
+        "seller_name": None,
+        "order_count": 0,
+        "paid_count": 0,
+        "completed_count": 0,
+        "disputed_count": 0,
+        "refunded_count": 0,
+        "price_sum_cents": 0,
+        "photo_order_count": 0,
+        "photo_count": 0,
+        "category_counts": "{}",
+        "recent_orders": 0.0,
+        "recent_completed": 0.0,
+        "recent_disputed": 0.0,
+        "recent_refunded": 0.0,
+        "recent_updated_at": None,
+        "reputation_score": NEUTRAL_REPUTATION,
+        "first_order_at": None,
+    }
+
+
+def _decay(stats: dict, now: float):
+    """Exponentially decay the rolling window counters up to `now`"""
+    last = stats["recent_updated_at"]
+    if last is not None and now > last:
+        factor = 0.5 ** ((now - last) / (RECENT_HALF_LIFE_DAYS * 86400))
+        for field in _RECENT_FIELDS.values():
+            stats[field] *= factor
+    stats["recent_updated_at"] = max(now, last or now)
+
+
+def _photo_count(order: dict) -> int:
+    photos = order.get("product_photos")
+    if not photos:
+        return 0
+    if isinstance(photos, str):
+        try:
+            photos = json.loads(photos)
+        except ValueError:
+            return 0
+    return len(photos)
+
+
+def _apply_event(stats: dict, event: str, order: dict, now: float):
+    """Apply one order event to a stats dict in place"""
+    _decay(stats, now)
+
+    stats[_COUNT_FIELDS[event]] += 1
+    if event in _RECENT_FIELDS:
+        stats[_RECENT_FIELDS[event]] += 1
+
+    if event == "created":
+        stats["seller_name"] = order.get("seller_name") or stats["seller_name"]
+        stats["price_sum_cents"] += to_cents(order.get("product_price") or 0)
+
+        photos = _photo_count(order)
+        if photos:
+            stats["photo_order_count"] += 1
+            stats["photo_count"] += photos
+
+        categories = json.loads(stats["category_counts"] or "{}")
+        category = order.get("product_category") or "Other"
+        categories[category] = categories.get(category, 0) + 1
+        stats["category_counts"] = json.dumps(categories)
+
+        if stats["first_order_at"] is None:
+            stats["first_order_at"] = datetime.utcfromtimestamp(now).strftime("%Y-%m-%d %H:%M:%S")
+
+    stats["reputation_score"] = compute_reputation(stats)
+
+
+_STATS_COLUMNS = list(_empty_stats("").keys())
+
+
+def _save(cursor, stats: dict):
+    placeholders = ", ".join("?" for _ in _STATS_COLUMNS)
+    updates = ", ".join(f"{col} = excluded.{col}" for col in _STATS_COLUMNS if col != "seller_phone")
+    cursor.execute(f"""
+        INSERT INTO seller_stats ({', '.join(_STATS_COLUMNS)}, updated_at)
+        VALUES ({placeholders}, CURRENT_TIMESTAMP)
+        ON CONFLICT(seller_phone) DO UPDATE SET {updates}, updated_at = CURRENT_TIMESTAMP
+    """, [stats[col] for col in _STATS_COLUMNS])
+
+
+def record_order_event(order: dict, event: str, conn=None, now: Optional[float] = None):
+    """
+    Update the seller's stats row for an order event.
+
+    Args:
+        order: Order dict (needs seller_phone; "created" also uses price,
+               category, photos and seller_name)
+        event: One of created, paid, completed, disputed, refunded
+        conn: Existing connection to update inside the caller's transaction.
+              The caller is then responsible for committing.
+        now: Event time as a Unix timestamp (default: current time)
+    """
+    if event not in _COUNT_FIELDS:
+        raise ValueError(f"Unknown order event: {event}")
+
+    now = now if now is not None else time.time()
+
+    def _update(connection):
+        cursor = connection.cursor()
+        cursor.execute("SELECT * FROM seller_stats WHERE seller_phone = ?", (order["seller_phone"],))
+        row = cursor.fetchone()
+        stats = _empty_stats(order["seller_phone"])
+        if row:
+            stats.update({col: row[col] for col in _STATS_COLUMNS})
+        _apply_event(stats, event, order, now)
+        _save(cursor, stats)
+
+    if conn is not None:
+        _update(conn)
+        return
+
+    with get_db() as own_conn:
+        _update(own_conn)
+        own_conn.commit()
+
+
+# ============================================================================
+# Reputation
+# ============================================================================
+
+def compute_reputation(stats: dict) -> int:
+    """
+    Deterministic 0-100 reputation score (higher is better).
+
+    Weights:
+        45% completion rate (completed vs refunded outcomes)
+        20% dispute rate (worse of lifetime and rolling window)
+        15% refund rate
+        10% photo coverage
+        10% track record (completed orders, log-scaled up to 50)
+
+    A seller with no history scores close to NEUTRAL_REPUTATION.
+    """
+    completed = stats["completed_count"]
+    refunded = stats["refunded_count"]
+    paid = stats["paid_count"]
+
+    completion_rate = (completed + PRIOR_WEIGHT * PRIOR_COMPLETION_RATE) / (completed + refunded + PRIOR_WEIGHT)
+    dispute_rate = (stats["disputed_count"] + PRIOR_WEIGHT * PRIOR_DISPUTE_RATE) / (paid + PRIOR_WEIGHT)
+    refund_rate = (refunded + PRIOR_WEIGHT * PRIOR_REFUND_RATE) / (paid + PRIOR_WEIGHT)
+
+    recent_paid = stats["recent_completed"] + stats["recent_refunded"] + stats["recent_disputed"]
+    recent_dispute_rate = (
+        (stats["recent_disputed"] + PRIOR_WEIGHT * PRIOR_DISPUTE_RATE) / (recent_paid + PRIOR_WEIGHT)
+    )
+    dispute_rate = max(dispute_rate, recent_dispute_rate)
+
+    photo_coverage = stats["photo_order_count"] / stats["order_count"] if stats["order_count"] else 0
+    track_record = min(1.0, math.log1p(completed) / math.log1p(50))
+
+    score = 100 * (
+        0.45 * completion_rate +
+        0.20 * (1 - min(1.0, dispute_rate * 4)) +
+        0.15 * (1 - min(1.0, refund_rate * 4)) +
+        0.10 * photo_coverage +
+        0.10 * track_record
+    )
+    return max(0, min(100, round(score)))
+
+
+def get_seller_stats(seller_phone: str) -> Optional[dict]:
+    """Get the materialized stats row for a seller (single-row read)"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM seller_stats WHERE seller_phone = ?", (seller_phone,))
+        row = cursor.fetchone()
+        return dict(row) if row else None
+
+
+def get_seller_reputation(seller_phone: str) -> int:
+    """Seller reputation for calculate_composite_risk (neutral if unknown)"""
+    stats = get_seller_stats(seller_phone)
+    return stats["reputation_score"] if stats else NEUTRAL_REPUTATION
+
+
+def summarize_seller(stats: dict) -> dict:
+    """
+    Turn a stats row into the /ai/seller-quality response shape.
+
+    Returns:
+        {
+            "seller_score": int,
+            "trust_level": str,
+            "strengths": list,
+            "improvements": list,
+            "recommendation": str,
+            "risk_level": str,
+            "stats": dict
+        }
+    """
+    score = stats["reputation_score"]
+    orders = stats["order_count"]
+    paid = stats["paid_count"]
+    completion_rate = stats["completed_count"] / paid if paid else 0
+    dispute_rate = stats["disputed_count"] / paid if paid else 0
+    refund_rate = stats["refunded_count"] / paid if paid else 0
+    photo_rate = stats["photo_order_count"] / orders if orders else 0
+    categories = json.loads(stats["category_counts"] or "{}")
+
+    strengths = []
+    improvements = []
+
+    if stats["completed_count"] >= 10 and completion_rate >= 0.9:
+        strengths.append(f"{stats['completed_count']} completed orders with {completion_rate:.0%} completion")
+    elif stats["completed_count"] < 3:
+        improvements.append("Complete more orders to build a track record")
+
+    if paid and dispute_rate <= 0.05:
+        strengths.append("Very few disputes")
+    elif dispute_rate > 0.15:
+        improvements.append(f"High dispute rate ({dispute_rate:.0%}) - describe items accurately")
+
+    if refund_rate > 0.1:
+        improvements.append(f"Refund rate is {refund_rate:.0%}")
+
+    if photo_rate >= 0.8:
+        strengths.append("Photos on most listings")
+    else:
+        improvements.append("Add photos to every listing")
+
+    if score >= 80:
+        trust_level, risk_level = "very_high", "low"
+        recommendation = "Trusted seller with a strong delivery record"
+    elif score >= 60:
+        trust_level, risk_level = "high", "low"
+        recommendation = "Reliable seller - escrow protects your payment"
+    elif score >= 40:
+        trust_level, risk_level = "moderate", "medium"
+        recommendation = "Limited or mixed history - confirm details before delivery"
+    else:
+        trust_level, risk_level = "low", "high"
+        recommendation = "Poor track record - inspect the item carefully before confirming delivery"
+
+    return {
+        "seller_score": score,
+        "trust_level": trust_level,
+        "strengths": strengths,
+        "improvements": improvements,
+        "recommendation": recommendation,
+        "risk_level": risk_level,
+        "stats": {
+            "product_count": orders,
+            "avg_price": float(from_cents(stats["price_sum_cents"] // orders)) if orders else 0,
+            "product_photos_rate": round(photo_rate, 2),
+            "product_variety": len(categories),
+            "completion_rate": round(completion_rate, 2),
+            "dispute_rate": round(dispute_rate, 2),
+            "refund_rate": round(refund_rate, 2),
+            "recent_orders": round(stats["recent_orders"], 1)
+        }
+    }
+
+
+# ============================================================================
+# Rebuild
+# ============================================================================
+
+def _parse_timestamp(value) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+    # SQLite CURRENT_TIMESTAMP values are UTC without an offset
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def _order_events(order: dict) -> List[tuple]:
+    """Reconstruct (timestamp, event) pairs for an existing order"""
+    created = _parse_timestamp(order["created_at"]) or time.time()
+    events = [(created, "created")]
+
+    paid_at = _parse_timestamp(order["paid_at"])
+    if paid_at or order["status"] in ("paid", "shipped", "delivered", "completed", "disputed", "refunded"):
+        events.append((paid_at or created, "paid"))
+    if order["disputed_at"]:
+        events.append((_parse_timestamp(order["disputed_at"]) or created, "disputed"))
+    if order["status"] == "completed":
+        events.append((_parse_timestamp(order["delivered_at"]) or created, "completed"))
+    elif order["status"] == "refunded":
+        events.append((created, "refunded"))
+    return events
+
+
+def rebuild_seller_stats() -> int:
+    """
+    Recompute seller_stats from orders in one streaming pass.
+
+    Orders are read sorted by seller, so only one seller's events are
+    held in memory at a time.
+    """
+    sellers = 0
+
+    def flush(cursor, phone, events):
+        stats = _empty_stats(phone)
+        for when, event, order in sorted(events, key=lambda e: e[0]):
+            _apply_event(stats, event, order, when)
+        _save(cursor, stats)
+
+    with get_db() as conn:
+        read_cursor = conn.cursor()
+        write_cursor = conn.cursor()
+        read_cursor.execute("""
+            SELECT o.*, d.disputed_at
+            FROM orders o
+            LEFT JOIN (
+                SELECT order_id, MIN(created_at) AS disputed_at
+                FROM transactions
+                WHERE type = 'dispute_raised'
+                GROUP BY order_id
+            ) d ON d.order_id = o.id
+            ORDER BY o.seller_phone
+        """)
+
+        try:
+            write_cursor.execute("DELETE FROM seller_stats")
+            current, events = None, []
+            for row in read_cursor:
+                order = dict(row)
+                if order["seller_phone"] != current:
+                    if current is not None:
+                        flush(write_cursor, current, events)
+                        sellers += 1
+                    current, events = order["seller_phone"], []
+                events.extend((when, event, order) for when, event in _order_events(order))
+
+            if current is not None:
+                flush(write_cursor, current, events)
+                sellers += 1
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    return sellers
+
+
+# Rebuild from the command line: python -m app.services.seller_stats
+if __name__ == "__main__":
+    print(f"Rebuilt stats for {rebuild_seller_stats()} sellers")
@@ -0,0 +1,354 @@
+"""
+Batched seller payout settlement for Soko Pay
+Aggregates released escrow funds per seller into one payout batch per cycle
+"""
+
+import csv
+import os
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from app.services.ledger import PLATFORM_FEES, record_payout
+from app.utils.money import from_cents
+from database import get_db
+
+# Where payout files are written (one CSV per batch)
+PAYOUT_DIR = os.getenv("PAYOUT_DIR", "payouts")
+
+# Rows pulled from SQLite per fetchmany() / written per executemany()
+SETTLEMENT_CHUNK_SIZE = 5000
+
+PAYOUT_FILE_HEADER = ["seller_phone", "release_count", "gross_kes", "fee_kes", "net_kes"]
+
+
+# ============================================================================
+# Payout providers
+# ============================================================================
+
+class PayoutProvider:
+    """
+    Sends a finished payout batch to the money-out rail.
+
+    Implementations get the batch summary and the path of the streamed
+    payout file, and return a provider reference for the batch.
+    """
+
+    def submit_batch(self, batch: dict, payout_file: str) -> str:
+        raise NotImplementedError
+
+
+class FilePayoutProvider(PayoutProvider):
+    """Leaves the payout file on disk for bulk upload to the M-Pesa B2C portal."""
+
+    def submit_batch(self, batch: dict, payout_file: str) -> str:
+        print(f"💸 Payout batch {batch['id']} ready for upload: {payout_file}")
+        return f"FILE-{batch['id']}"
+
+
+class FakePayoutProvider(PayoutProvider):
+    """
+    In-memory provider for tests and local runs.
+
+    Reads the payout file back so callers can assert on exactly what
+    would have been paid out.
+    """
+
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.submissions = []
+
+    def submit_batch(self, batch: dict, payout_file: str) -> str:
+        if self.fail:
+            raise Exception("Fake payout provider configured to fail")
+
+        with open(payout_file, newline="") as f:
+            rows = list(csv.DictReader(f))
+
+        self.submissions.append({"batch": batch, "rows": rows})
+        return f"FAKE-{len(self.submissions)}"
+
+
+def get_default_provider() -> PayoutProvider:
+    return FilePayoutProvider()
+
+
+# ============================================================================
+# Settlement cycle
+# ============================================================================
+
+def _format_timestamp(value: Optional[datetime]) -> Optional[str]:
+    """Match SQLite CURRENT_TIMESTAMP format so string comparison works."""
+    if value is None:
+        return None
+    return value.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _iter_unsettled_releases(cursor, window_start: Optional[str], window_end: str):
+    """
+    Stream unsettled ledger releases ordered by seller.
+
+    Each order has at most one release journal ("release:<order_id>"),
+    so a re-sent callback or a repeated delivery confirmation can't make
+    an order payable twice; amounts are the ones the release posted.
+
+    Ordering by seller account lets the caller aggregate one seller at a
+    time without holding the whole window in memory.
+    """
+    query = """
+        SELECT r.order_id,
+               substr(r.account, length('seller:') + 1) AS seller_phone,
+               r.amount_cents AS net_cents,
+               COALESCE(f.amount_cents, 0) AS fee_cents
+        FROM ledger_entries r
+        LEFT JOIN ledger_entries f
+               ON f.journal_id = r.journal_id AND f.account = ?
+        LEFT JOIN settled_orders s ON s.order_id = r.order_id
+        WHERE r.entry_type = 'release'
+          AND r.account LIKE 'seller:%'
+          AND s.order_id IS NULL
+          AND r.created_at < ?
+    """
+    params = [PLATFORM_FEES, window_end]
+    if window_start:
+        query += " AND r.created_at >= ?"
+        params.append(window_start)
+    query += " ORDER BY r.account, r.id"
+
+    cursor.execute(query, params)
+    while True:
+        rows = cursor.fetchmany(SETTLEMENT_CHUNK_SIZE)
+        if not rows:
+            break
+        for row in rows:
+            yield row
+
+
+def run_settlement_cycle(
+    window_start: Optional[datetime] = None,
+    window_end: Optional[datetime] = None,
+    provider: Optional[PayoutProvider] = None
+) -> Optional[dict]:
+    """
+    Settle all released-but-unpaid funds in a window into one payout batch.
+
+    Net and fee amounts come from each order's ledger release journal
+    (integer cents) and are summed per seller; settled_orders records
+    each order once. The payout file is streamed seller by seller.
+
+    Args:
+        window_start: Only include releases at or after this time (UTC)
+        window_end: Only include releases before this time (UTC, default now)
+        provider: Payout provider (default: FilePayoutProvider)
+
+    Returns:
+        Batch summary dict, or None if there was nothing to settle
+    """
+    provider = provider or get_default_provider()
+    window_end_str = _format_timestamp(window_end or datetime.utcnow())
+    window_start_str = _format_timestamp(window_start)
+
+    batch_id = f"PB{uuid.uuid4().hex[:12].upper()}"
+    payout_dir = Path(PAYOUT_DIR)
+    payout_dir.mkdir(parents=True, exist_ok=True)
+    payout_file = payout_dir / f"{batch_id}.csv"
+    partial_file = payout_dir / f"{batch_id}.csv.part"
+
+    totals = {"sellers": 0, "releases": 0, "gross": 0, "fee": 0, "net": 0}
+    items = []
+    settled = []
+
+    with get_db() as conn:
+        read_cursor = conn.cursor()
+        write_cursor = conn.cursor()
+
+        # The batch row goes in first so items can reference it; it is
+        # only committed together with the items and settled releases.
+        write_cursor.execute("""
+            INSERT INTO payout_batches (id, window_start, window_end, status, payout_file)
+            VALUES (?, ?, ?, 'pending', ?)
+        """, (batch_id, window_start_str, window_end_str, str(payout_file)))
+
+        def flush():
+            if items:
+                # Debit each seller's ledger balance in the same transaction
+                record_payout(
+                    f"{batch_id}:{totals['sellers']}",
+                    {item[1]: item[5] for item in items},
+                    conn=conn
+                )
+            write_cursor.executemany("""
+                INSERT INTO payout_items (
+                    batch_id, seller_phone, release_count,
+                    gross_cents, fee_cents, net_cents
+                ) VALUES (?, ?, ?, ?, ?, ?)
+            """, items)
+            write_cursor.executemany("""
+                INSERT INTO settled_orders (order_id, batch_id)
+                VALUES (?, ?)
+            """, settled)
+            items.clear()
+            settled.clear()
+
+        def close_seller(phone, count, fee_cents, net_cents):
+            gross_cents = fee_cents + net_cents
+            writer.writerow([phone, count, from_cents(gross_cents), from_cents(fee_cents), from_cents(net_cents)])
+            items.append((batch_id, phone, count, gross_cents, fee_cents, net_cents))
+            totals["sellers"] += 1
+            totals["gross"] += gross_cents
+            totals["fee"] += fee_cents
+            totals["net"] += net_cents
+
+        try:
+            with open(partial_file, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(PAYOUT_FILE_HEADER)
+
+                current = None
+                count, fee, net = 0, 0, 0
+
+                for row in _iter_unsettled_releases(read_cursor, window_start_str, window_end_str):
+                    if row["seller_phone"] != current:
+                        if current is not None:
+                            close_seller(current, count, fee, net)
+                        current = row["seller_phone"]
+                        count, fee, net = 0, 0, 0
+
+                    count += 1
+                    fee += row["fee_cents"]
+                    net += row["net_cents"]
+
+                    settled.append((row["order_id"], batch_id))
+                    totals["releases"] += 1
+
+                    if len(settled) >= SETTLEMENT_CHUNK_SIZE:
+                        flush()
+
+                if current is not None:
+                    close_seller(current, count, fee, net)
+                flush()
+
+            if totals["releases"] == 0:
+                conn.rollback()
+                partial_file.unlink(missing_ok=True)
+                return None
+
+            write_cursor.execute("""
+                UPDATE payout_batches
+                SET seller_count = ?, release_count = ?,
+                    gross_cents = ?, fee_cents = ?, net_cents = ?
+                WHERE id = ?
+            """, (
+                totals["sellers"], totals["releases"],
+                totals["gross"], totals["fee"], totals["net"],
+                batch_id
+            ))
+            os.replace(partial_file, payout_file)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            partial_file.unlink(missing_ok=True)
+            raise
+
+    return submit_batch(batch_id, provider)
+
+
+def submit_batch(batch_id: str, provider: Optional[PayoutProvider] = None) -> dict:
+    """
+    Hand a pending (or previously failed) batch to the payout provider.
+
+    A failed submission leaves the batch in 'failed' state with its
+    releases still reserved, so it can be retried without re-settling.
+    """
+    provider = provider or get_default_provider()
+    batch = get_batch(batch_id)
+    if not batch:
+        raise ValueError(f"Payout batch {batch_id} not found")
+    if batch["status"] == "submitted":
+        return batch
+
+    try:
+        provider_ref = provider.submit_batch(batch, batch["payout_file"])
+        status, error = "submitted", None
+    except Exception as e:
+        print(f"Payout submission error for {batch_id}: {e}")
+        provider_ref, status, error = None, "failed", str(e)
+
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE payout_batches
+            SET status = ?, provider_ref = ?, error = ?,
+                submitted_at = CASE WHEN ? = 'submitted' THEN CURRENT_TIMESTAMP ELSE submitted_at END
+            WHERE id = ?
+        """, (status, provider_ref, error, status, batch_id))
+        conn.commit()
+
+    return get_batch(batch_id)
+
+
+# ============================================================================
+# Queries
+# ============================================================================
+
+def _batch_to_dict(row) -> dict:
+    batch = dict(row)
+    for field in ("gross", "fee", "net"):
+        batch[f"{field}_amount"] = float(from_cents(batch[f"{field}_cents"]))
+    return batch
+
+
+def get_batch(batch_id: str) -> Optional[dict]:
+    """Get a payout batch summary by ID"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM payout_batches WHERE id = ?", (batch_id,))
+        row = cursor.fetchone()
+        return _batch_to_dict(row) if row else None
+
+
+def list_batches(limit: int = 50) -> list:
+    """List the most recent payout batches"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT * FROM payout_batches
+            ORDER BY created_at DESC
+            LIMIT ?
+        """, (limit,))
+        return [_batch_to_dict(row) for row in cursor.fetchall()]
+
+
+def get_batch_items(batch_id: str, limit: int = 100, offset: int = 0) -> list:
+    """Get per-seller payout lines for a batch"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT seller_phone, release_count, gross_cents, fee_cents, net_cents
+            FROM payout_items
+            WHERE batch_id = ?
+            ORDER BY id
+            LIMIT ? OFFSET ?
+        """, (batch_id, limit, offset))
+        return [
+            {
+                "seller_phone": row["seller_phone"],
+                "release_count": row["release_count"],
+                "gross_amount": float(from_cents(row["gross_cents"])),
+                "fee_amount": float(from_cents(row["fee_cents"])),
+                "net_amount": float(from_cents(row["net_cents"]))
+            }
+            for row in cursor.fetchall()
+        ]
+
+
+# Run one settlement cycle from the command line
+if __name__ == "__main__":
+    import json
+
+    result = run_settlement_cycle()
+    if result:
+        print(json.dumps(result, indent=2, default=str))
+    else:
+        print("Nothing to settle")
@@ -0,0 +1,324 @@
+"""
+In-process similarity index over listings for Soko Pay
+MinHash signatures with LSH banding for near-duplicate and similar-product
+lookups across the whole orders table
+"""
+
+import random
+import threading
+import time
+import zlib
+from array import array
+from operator import eq
+from typing import Dict, List, Optional
+
+from app.utils.text_features import price_bucket, tokenize, word_ngrams
+from database import get_db
+
+# Signature layout: NUM_BINS minhash values split into BANDS bands of
+# ROWS_PER_BAND. Two listings become candidates when any band matches,
+# which happens with high probability above ~(1/BANDS)^(1/ROWS_PER_BAND)
+# (~0.6) Jaccard similarity.
+NUM_BINS = 32
+BANDS = 8
+ROWS_PER_BAND = NUM_BINS // BANDS
+
+# Estimated similarity (0-100) at which a match is reported as a duplicate
+DUPLICATE_SCORE = 90
+
+# Most recent listings scored per matching bucket, so a hugely popular
+# listing (hundreds of thousands of identical phones) can't make a
+# single lookup scan them all
+MAX_BUCKET_SCAN = 2000
+
+_MASK64 = (1 << 64) - 1
+_MASK32 = (1 << 32) - 1
+_GOLDEN = 0x9E3779B97F4A7C15
+_BIN_SHIFT = 64 - (NUM_BINS - 1).bit_length()
+
+# Fixed pseudo-random donor order per bin for densification. Borrowing
+# from a shuffled order instead of the right-hand neighbour keeps a bin
+# every listing shares (category, price band) from filling whole bands.
+_DONORS = [
+    random.Random(i).sample([donor for donor in range(NUM_BINS) if donor != i], NUM_BINS - 1)
+    for i in range(NUM_BINS)
+]
+
+
+def listing_shingles(product_name: str, description: str, category: Optional[str], price: float) -> set:
+    """Token set a listing is compared on: name n-grams, description words, category and price band"""
+    shingles = set(word_ngrams(tokenize(product_name), "n:"))
+    shingles.update("d:" + token for token in tokenize(description))
+    shingles.add(f"c:{(category or 'other').lower()}")
+    shingles.add(price_bucket(price))
+    return shingles
+
+
+def minhash_signature(shingles: set) -> Optional[List[int]]:
+    """
+    One-permutation MinHash: hash every shingle once, use the top bits to
+    pick a bin and keep the minimum of the rest per bin.
+
+    Empty bins borrow from the first filled bin in their donor order
+    (densification) so short listings still get a full signature.
+
+    Returns:
+        NUM_BINS 32-bit values, or None for an empty shingle set
+    """
+    if not shingles:
+        return None
+
+    bins = [None] * NUM_BINS
+    for shingle in shingles:
+        h = (zlib.crc32(shingle.encode("utf-8")) * _GOLDEN) & _MASK64
+        slot = h >> _BIN_SHIFT
+        value = (h >> 16) & _MASK32
+        current = bins[slot]
+        if current is None or value < current:
+            bins[slot] = value
+
+    filled = list(bins)
+    for i in range(NUM_BINS):
+        if filled[i] is None:
+            for attempt, donor in enumerate(_DONORS[i], 1):
+                if bins[donor] is not None:
+                    filled[i] = (bins[donor] + attempt * 0x9E3779B1) & _MASK32
+                    break
+    return filled
+
+
+class SimilarityIndex:
+    """
+    MinHash/LSH index over order listings.
+
+    Memory per listing is one id, NUM_BINS 32-bit ints in a flat array and
+    one bucket entry per band. Lookups touch only the listings sharing a
+    band with the query, so cost doesn't grow with catalogue size.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+        self.ready = False
+        self.built_at: Optional[float] = None
+        self._building = False
+        self._added_while_building: List[dict] = []
+
+    def _reset(self):
+        self._ids: List[str] = []
+        self._positions: Dict[str, int] = {}
+        self._signatures = array("I")
+        self._buckets: List[dict] = [{} for _ in range(BANDS)]
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _insert(self, order_id: str, signature: List[int]):
+        if order_id in self._positions:
+            return
+        position = len(self._ids)
+        self._ids.append(order_id)
+        self._positions[order_id] = position
+        self._signatures.extend(signature)
+
+        for band in range(BANDS):
+            key = hash(tuple(signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]))
+            bucket = self._buckets[band]
+            existing = bucket.get(key)
+            if existing is None:
+                bucket[key] = position
+            elif isinstance(existing, int):
+                bucket[key] = [existing, position]
+            else:
+                existing.append(position)
+
+    @staticmethod
+    def _order_signature(order: dict) -> Optional[List[int]]:
+        return minhash_signature(listing_shingles(
+            order.get("product_name"),
+            order.get("product_description"),
+            order.get("product_category"),
+            order.get("product_price") or 0
+        ))
+
+    def add(self, order: dict):
+        """Index one order (called on order creation)"""
+        signature = self._order_signature(order)
+        if signature is None:
+            return
+        with self._lock:
+            self._insert(order["id"], signature)
+            if self._building:
+                self._added_while_building.append(order)
+
+    def build(self, batch_size: int = 5000) -> int:
+        """
+        (Re)build the index from the orders table.
+
+        Runs without holding the lock for the bulk of the work; orders
+        added meanwhile are replayed into the new index before it's
+        swapped in.
+        """
+        with self._lock:
+            self._building = True
+            self._added_while_building = []
+
+        started = time.perf_counter()
+        fresh = SimilarityIndex()
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT id, product_name, product_description, product_category, product_price
+                FROM orders
+                ORDER BY created_at
+            """)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    signature = self._order_signature(dict(row))
+                    if signature is not None:
+                        fresh._insert(row["id"], signature)
+
+        with self._lock:
+            for order in self._added_while_building:
+                signature = self._order_signature(order)
+                if signature is not None:
+                    fresh._insert(order["id"], signature)
+            self._ids, self._positions = fresh._ids, fresh._positions
+            self._signatures, self._buckets = fresh._signatures, fresh._buckets
+            self._building = False
+            self._added_while_building = []
+            self.ready = True
+            self.built_at = time.time()
+
+        print(f"Similarity index built: {len(self)} listings in {time.perf_counter() - started:.1f}s")
+        return len(self)
+
+    def query(self, product_name: str, description: str, category: Optional[str], price: float,
+              limit: int = 10, min_score: int = 60, exclude_id: Optional[str] = None) -> List[dict]:
+        """
+        Most similar indexed listings.
+
+        Returns:
+            [{"id": str, "match_score": int (0-100)}], best first
+        """
+        signature = minhash_signature(listing_shingles(product_name, description, category, price))
+        if signature is None:
+            return []
+
+        with self._lock:
+            candidates = set()
+            for band in range(BANDS):
+                key = hash(tuple(signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]))
+                found = self._buckets[band].get(key)
+                if found is None:
+                    continue
+                if isinstance(found, int):
+                    candidates.add(found)
+                else:
+                    candidates.update(found[-MAX_BUCKET_SCAN:])
+
+            signatures = self._signatures
+            matches = []
+            for position in candidates:
+                order_id = self._ids[position]
+                if order_id == exclude_id:
+                    continue
+                offset = position * NUM_BINS
+                same = sum(map(eq, signatures[offset:offset + NUM_BINS], signature))
+                score = round(same * 100 / NUM_BINS)
+                if score >= min_score:
+                    matches.append({"id": order_id, "match_score": score})
+
+        matches.sort(key=lambda match: match["match_score"], reverse=True)
+        return matches[:limit]
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "listings": len(self),
+            "buckets": [len(bucket) for bucket in self._buckets],
+            "built_at": self.built_at,
+        }
+
+
+similarity_index = SimilarityIndex()
+
+
+def find_similar_listings(product_name: str, price: float, category: Optional[str],
+                          description: str = "", limit: int = 10,
+                          exclude_order_id: Optional[str] = None) -> dict:
+    """
+    Similar and duplicate listings from the catalogue.
+
+    Returns the /ai/find-similar response shape:
+        {
+            "similar_products": [{"id", "name", "price", "seller_phone",
+                                  "price_difference", "match_score", "is_duplicate"}],
+            "market_positioning": "underpriced|competitive|overpriced|unknown",
+            "recommendation": str
+        }
+    """
+    matches = similarity_index.query(product_name, description, category, price,
+                                     limit=limit, exclude_id=exclude_order_id)
+
+    rows = {}
+    if matches:
+        with get_db() as conn:
+            cursor = conn.cursor()
+            placeholders = ",".join("?" * len(matches))
+            cursor.execute(f"""
+                SELECT id, product_name, product_price, seller_phone
+                FROM orders WHERE id IN ({placeholders})
+            """, [match["id"] for match in matches])
+            rows = {row["id"]: row for row in cursor.fetchall()}
+
+    similar = []
+    for match in matches:
+        row = rows.get(match["id"])
+        if not row:
+            continue
+        other_price = row["product_price"] or 0
+        if other_price and price:
+            change = round((price - other_price) / other_price * 100)
+            price_difference = "same price" if change == 0 else f"{abs(change)}% {'higher' if change > 0 else 'lower'}"
+        else:
+            price_difference = "unknown"
+        similar.append({
+            "id": row["id"],
+            "name": row["product_name"],
+            "price": other_price,
+            "seller_phone": row["seller_phone"],
+            "price_difference": price_difference,
+            "match_score": match["match_score"],
+            "is_duplicate": match["match_score"] >= DUPLICATE_SCORE
+        })
+
+    prices = sorted(item["price"] for item in similar if item["price"])
+    if not prices or not price:
+        positioning = "unknown"
+        recommendation = "No similar listings found yet to compare prices against."
+    else:
+        median = prices[len(prices) // 2]
+        if price < median * 0.85:
+            positioning = "underpriced"
+            recommendation = f"Priced below similar listings (median KES {median:,.0f}). Buyers may be suspicious of a price this low."
+        elif price > median * 1.15:
+            positioning = "overpriced"
+            recommendation = f"Priced above similar listings (median KES {median:,.0f}). Highlight condition, warranty or extras to justify it."
+        else:
+            positioning = "competitive"
+            recommendation = f"Price is in line with similar listings (median KES {median:,.0f})."
+
+    duplicates = sum(1 for item in similar if item["is_duplicate"])
+    if duplicates:
+        recommendation += f" {duplicates} near-identical listing(s) found - possible duplicate."
+
+    return {
+        "similar_products": similar,
+        "market_positioning": positioning,
+        "recommendation": recommendation
+    }
@@ -0,0 +1,398 @@
+"""
+Request tracing for Soko Pay
+Lightweight in-process spans: a root span per sampled request, child
+spans for database connections, PayHero and Gemini calls, propagated with
+contextvars (including into asyncio.to_thread workers). Finished traces go
+to an in-memory ring buffer and, optionally, OTLP/JSON files.
+"""
+
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from app.services.metrics import route_template
+
+# Fraction of requests traced; an incoming W3C traceparent with the sampled
+# flag is always traced
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+
+# Finished traces kept in memory for /api/admin/traces
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "500"))
+
+# Directory for OTLP/JSON trace files (one ExportTraceServiceRequest per line); unset = off
+TRACE_EXPORT_DIR = os.getenv("TRACE_EXPORT_DIR", "")
+TRACE_EXPORT_SECONDS = float(os.getenv("TRACE_EXPORT_SECONDS", "5"))
+
+SERVICE_NAME = "soko-pay-api"
+
+# OTLP SpanKind values
+_KINDS = {"internal": 1, "server": 2, "client": 3}
+
+
+class Span:
+    """One timed operation; attributes are plain JSON values"""
+
+    __slots__ = ("trace", "span_id", "parent_id", "name", "kind", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, trace: "Trace", name: str, kind: str = "internal", parent_id: Optional[str] = None,
+                 attributes: Optional[dict] = None):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = {k: v for k, v in (attributes or {}).items() if v is not None}
+        self.error: Optional[str] = None
+        trace.spans.append(self)
+
+    def set(self, key: str, value):
+        if value is not None:
+            self.attributes[key] = value
+
+    def record_error(self, error: BaseException):
+        self.error = f"{type(error).__name__}: {error}"[:500]
+
+    def finish(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end - self.start_ns) / 1e6
+
+
+class _NoopSpan:
+    """Returned when the current request isn't sampled"""
+
+    def set(self, key: str, value):
+        pass
+
+    def record_error(self, error: BaseException):
+        pass
+
+    def finish(self):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    __slots__ = ("trace_id", "spans", "root")
+
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.spans: List[Span] = []  # Appended from worker threads too (atomic under the GIL)
+        self.root: Optional[Span] = None
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("soko_current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    """Active span of a sampled request, or None"""
+    return _current_span.get()
+
+
+@contextmanager
+def span(name: str, kind: str = "internal", **attributes):
+    """
+    Child span of the current one for the duration of the block.
+
+    A no-op (yields NOOP_SPAN) outside a sampled request, so it can wrap
+    hot paths. Exceptions are recorded on the span and re-raised.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield NOOP_SPAN
+        return
+
+    child = Span(parent.trace, name, kind, parent.span_id, attributes)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.record_error(e)
+        raise
+    finally:
+        child.finish()
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            pass  # Finished from another context (e.g. a generator closed elsewhere)
+
+
+def start_span(name: str, kind: str = "internal", **attributes):
+    """
+    Child span that is NOT made current; call .finish() yourself.
+
+    For async generators, where setting the context variable would leak
+    into the consumer between yields.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return NOOP_SPAN
+    return Span(parent.trace, name, kind, parent.span_id, attributes)
+
+
+def caller_name(depth: int = 2) -> Optional[str]:
+    """Name of the function `depth` frames up, only worked out for sampled requests"""
+    if _current_span.get() is None:
+        return None
+    return sys._getframe(depth + 1).f_code.co_name
+
+
+def _parse_traceparent(header: Optional[str]):
+    """(trace_id, parent_span_id, sampled) from a W3C traceparent, or None"""
+    if not header:
+        return None
+    parts = header.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        sampled = bool(int(parts[3], 16) & 1)
+        int(parts[1], 16), int(parts[2], 16)
+    except ValueError:
+        return None
+    if parts[1] == "0" * 32:
+        return None
+    return parts[1], parts[2], sampled
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class Tracer:
+    """Sampling decision, finished-trace ring buffer and OTLP/JSON export"""
+
+    def __init__(self, sample_rate: float = TRACE_SAMPLE_RATE, buffer_size: int = TRACE_BUFFER_SIZE,
+                 export_dir: str = TRACE_EXPORT_DIR):
+        self.sample_rate = sample_rate
+        self.export_dir = export_dir
+        self.traces: deque = deque(maxlen=buffer_size)
+        self._export_queue: deque = deque()
+        self.started = 0
+        self.exported = 0
+
+    def start_root(self, name: str, traceparent: Optional[str] = None, **attributes) -> Optional[Span]:
+        """Root span for a request, or None if it isn't sampled"""
+        parent = _parse_traceparent(traceparent)
+        if parent is not None:
+            trace_id, parent_id, sampled = parent
+        else:
+            trace_id, parent_id = None, None
+            sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        if not sampled:
+            return None
+
+        trace = Trace(trace_id or os.urandom(16).hex())
+        root = Span(trace, name, "server", parent_id, attributes)
+        trace.root = root
+        self.started += 1
+        return root
+
+    def finish_trace(self, trace: Trace):
+        self.traces.append(trace)
+        if self.export_dir:
+            self._export_queue.append(trace)
+
+    # ------------------------------------------------------------------------
+    # Views
+    # ------------------------------------------------------------------------
+
+    @staticmethod
+    def _breakdown(trace: Trace) -> Dict[str, float]:
+        """Time per span family (sqlite, gemini, payhero, ...) - where did the request go?"""
+        families = {s.span_id: s.name.split(".", 1)[0] for s in trace.spans}
+        totals: Dict[str, float] = {}
+        for s in trace.spans:
+            family = families[s.span_id]
+            # Nested spans of the same family (gemini.generate > gemini.request) count once
+            if s is trace.root or families.get(s.parent_id) == family:
+                continue
+            totals[family] = round(totals.get(family, 0.0) + s.duration_ms, 3)
+        return totals
+
+    def summary(self, trace: Trace) -> dict:
+        root = trace.root
+        return {
+            "trace_id": trace.trace_id,
+            "name": root.name,
+            "started_at": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(root.start_ns / 1e9)),
+            "duration_ms": round(root.duration_ms, 3),
+            "status_code": root.attributes.get("http.status_code"),
+            "error": root.error or any(s.error for s in trace.spans),
+            "spans": len(trace.spans),
+            "breakdown_ms": self._breakdown(trace),
+        }
+
+    def recent(self, limit: int = 50, min_ms: float = 0.0, name: Optional[str] = None) -> List[dict]:
+        """Newest finished traces first"""
+        results = []
+        for trace in reversed(self.traces):
+            if trace.root.duration_ms < min_ms or (name and name not in trace.root.name):
+                continue
+            results.append(self.summary(trace))
+            if len(results) >= limit:
+                break
+        return results
+
+    def get(self, trace_id: str) -> Optional[dict]:
+        """One trace with every span, offsets relative to the root"""
+        for trace in self.traces:
+            if trace.trace_id != trace_id:
+                continue
+            origin = trace.root.start_ns
+            spans = [
+                {
+                    "span_id": s.span_id,
+                    "parent_id": s.parent_id,
+                    "name": s.name,
+                    "kind": s.kind,
+                    "offset_ms": round((s.start_ns - origin) / 1e6, 3),
+                    "duration_ms": round(s.duration_ms, 3),
+                    "attributes": s.attributes,
+                    "error": s.error,
+                }
+                for s in sorted(trace.spans, key=lambda s: s.start_ns)
+            ]
+            return {**self.summary(trace), "span_list": spans}
+        return None
+
+    # ------------------------------------------------------------------------
+    # OTLP/JSON export
+    # ------------------------------------------------------------------------
+
+    @staticmethod
+    def to_otlp(traces: List[Trace]) -> dict:
+        """ExportTraceServiceRequest (OTLP/JSON) for the given traces"""
+        spans = []
+        for trace in traces:
+            for s in trace.spans:
+                otlp_span = {
+                    "traceId": trace.trace_id,
+                    "spanId": s.span_id,
+                    "name": s.name,
+                    "kind": _KINDS.get(s.kind, 1),
+                    "startTimeUnixNano": str(s.start_ns),
+                    "endTimeUnixNano": str(s.end_ns or s.start_ns),
+                    "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s.attributes.items()],
+                    "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+                }
+                if s.parent_id:
+                    otlp_span["parentSpanId"] = s.parent_id
+                spans.append(otlp_span)
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+                "scopeSpans": [{"scope": {"name": "soko-pay"}, "spans": spans}],
+            }]
+        }
+
+    def export_pending(self) -> int:
+        """Append queued traces to today's OTLP/JSON file. Returns traces written."""
+        pending = []
+        while self._export_queue:
+            pending.append(self._export_queue.popleft())
+        if not self.export_dir or not pending:
+            return 0
+        os.makedirs(self.export_dir, exist_ok=True)
+        path = os.path.join(self.export_dir, f"traces-{time.strftime('%Y%m%d')}-{os.getpid()}.jsonl")
+        with open(path, "a") as f:
+            f.write(json.dumps(self.to_otlp(pending), separators=(",", ":")) + "\n")
+        self.exported += len(pending)
+        return len(pending)
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "sample_rate": self.sample_rate,
+            "traces_started": self.started,
+            "traces_buffered": len(self.traces),
+            "traces_exported": self.exported,
+            "export_dir": self.export_dir or None,
+        }
+
+
+tracer = Tracer()
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware opening the root span of each sampled request.
+
+    The response carries a traceparent header (and X-Trace-Id) so a slow
+    request seen by a client can be looked up at /api/admin/traces/{id}.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        traceparent = None
+        for key, value in scope["headers"]:
+            if key == b"traceparent":
+                traceparent = value.decode("latin-1")
+                break
+        root = tracer.start_root(scope["method"], traceparent, **{"http.target": scope["path"]})
+        if root is None:
+            await self.app(scope, receive, send)
+            return
+
+        header = f"00-{root.trace.trace_id}-{root.span_id}-01".encode()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                root.set("http.status_code", message["status"])
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"traceparent", header), (b"x-trace-id", root.trace.trace_id.encode())
+                ]
+            await send(message)
+
+        token = _current_span.set(root)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException as e:
+            root.record_error(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            route = route_template(scope)
+            root.name = f"{scope['method']} {route}"
+            root.set("http.method", scope["method"])
+            root.set("http.route", route)
+            root.finish()
+            tracer.finish_trace(root.trace)
+
+
+async def run_trace_export():
+    """Background task: write queued traces every TRACE_EXPORT_SECONDS"""
+    if not tracer.export_dir:
+        return
+    while True:
+        await asyncio.sleep(TRACE_EXPORT_SECONDS)
+        try:
+            await asyncio.to_thread(tracer.export_pending)
+        except Exception as e:
+            print(f"Trace export warning: {e}")
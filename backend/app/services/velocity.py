@@ -0,0 +1,252 @@
+"""
+Sliding-window transaction velocity counters for Soko Pay
+Counts payments per seller, buyer and device over the last hour
+"""
+
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from database import get_db
+
+# Window answered by count(): "transactions in the last hour"
+VELOCITY_WINDOW_SECONDS = 3600
+VELOCITY_BUCKET_SECONDS = 60
+
+# How often in-memory deltas are written to velocity_buckets (and other
+# workers' counts merged back in)
+VELOCITY_FLUSH_SECONDS = int(os.getenv("VELOCITY_FLUSH_SECONDS", "30"))
+
+# calculate_composite_risk maxes out velocity risk at 10 transactions an
+# hour, which fits one buyer or device. A busy seller legitimately takes
+# far more payments, so seller counts are scaled: this many initiations
+# an hour count as 10.
+VELOCITY_MAX_RISK_COUNT = 10
+VELOCITY_SELLER_MAX_PER_HOUR = int(os.getenv("VELOCITY_SELLER_MAX_PER_HOUR", "200"))
+
+
+class SlidingWindowCounter:
+    """
+    Ring buffer of fixed-width time buckets with a running total.
+
+    count() is O(1): expired buckets are subtracted from the total as the
+    head moves forward, touching at most one slot per elapsed bucket.
+    """
+
+    __slots__ = ("bucket_seconds", "size", "counts", "head", "total")
+
+    def __init__(
+        self,
+        window_seconds: int = VELOCITY_WINDOW_SECONDS,
+        bucket_seconds: int = VELOCITY_BUCKET_SECONDS
+    ):
+        self.bucket_seconds = bucket_seconds
+        self.size = max(1, window_seconds // bucket_seconds)
+        self.counts = [0] * self.size
+        self.head = None  # Bucket epoch of the newest slot
+        self.total = 0
+
+    def _advance(self, epoch: int):
+        if self.head is None:
+            self.head = epoch
+            return
+        if epoch <= self.head:
+            return
+
+        # Clear every slot that fell out of the window (at most `size`)
+        for expired in range(max(self.head + 1, epoch - self.size + 1), epoch + 1):
+            slot = expired % self.size
+            self.total -= self.counts[slot]
+            self.counts[slot] = 0
+        self.head = epoch
+
+    def add(self, amount: int = 1, now: Optional[float] = None) -> int:
+        """Add to the bucket for `now`. Returns the bucket epoch used."""
+        epoch = int((now if now is not None else time.time()) // self.bucket_seconds)
+        self._advance(epoch)
+
+        if epoch <= self.head - self.size:
+            return epoch  # Older than the window, nothing to count
+
+        self.counts[epoch % self.size] += amount
+        self.total += amount
+        return epoch
+
+    def count(self, now: Optional[float] = None) -> int:
+        """Number of events in the window ending at `now`"""
+        epoch = int((now if now is not None else time.time()) // self.bucket_seconds)
+        self._advance(epoch)
+        return self.total
+
+
+class VelocityTracker:
+    """
+    Keyed sliding-window counters with periodic persistence.
+
+    Counts live in memory per process. Each flush writes only the deltas
+    since the previous flush, so several gunicorn workers can share the
+    velocity_buckets table, then reloads the window from the table. So
+    count() covers every worker's transactions, except the ones other
+    workers recorded since their last flush (up to VELOCITY_FLUSH_SECONDS).
+    """
+
+    def __init__(
+        self,
+        window_seconds: int = VELOCITY_WINDOW_SECONDS,
+        bucket_seconds: int = VELOCITY_BUCKET_SECONDS
+    ):
+        self.window_seconds = window_seconds
+        self.bucket_seconds = bucket_seconds
+        self._counters: Dict[str, SlidingWindowCounter] = {}
+        self._pending: Dict[Tuple[str, int], int] = {}
+        self._lock = threading.Lock()
+
+    def _counter(self, key: str) -> SlidingWindowCounter:
+        counter = self._counters.get(key)
+        if counter is None:
+            counter = SlidingWindowCounter(self.window_seconds, self.bucket_seconds)
+            self._counters[key] = counter
+        return counter
+
+    def record(self, keys: List[str], now: Optional[float] = None):
+        """Count one transaction against each key"""
+        with self._lock:
+            for key in keys:
+                epoch = self._counter(key).add(1, now)
+                self._pending[(key, epoch)] = self._pending.get((key, epoch), 0) + 1
+
+    def count(self, key: str, now: Optional[float] = None) -> int:
+        """Transactions for `key` in the window (O(1))"""
+        with self._lock:
+            counter = self._counters.get(key)
+            return counter.count(now) if counter else 0
+
+    def _oldest_epoch(self) -> int:
+        return int((time.time() - self.window_seconds) // self.bucket_seconds)
+
+    def _read_window(self, cursor) -> list:
+        cursor.execute("""
+            SELECT key, bucket_epoch, count FROM velocity_buckets
+            WHERE bucket_epoch >= ?
+            ORDER BY bucket_epoch
+        """, (self._oldest_epoch(),))
+        return cursor.fetchall()
+
+    def _rebuild(self, rows: list):
+        """Replace the counters with persisted buckets plus unflushed deltas (caller holds the lock)"""
+        self._counters.clear()
+        for row in rows:
+            self._counter(row["key"]).add(row["count"], row["bucket_epoch"] * self.bucket_seconds)
+        for (key, epoch), delta in self._pending.items():
+            self._counter(key).add(delta, epoch * self.bucket_seconds)
+
+    def flush(self) -> int:
+        """
+        Persist pending deltas and drop expired buckets, then reload the
+        window so counts include the other workers' flushed transactions
+        (idle keys drop out on the way).
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.executemany("""
+                INSERT INTO velocity_buckets (key, bucket_epoch, count)
+                VALUES (?, ?, ?)
+                ON CONFLICT(key, bucket_epoch) DO UPDATE SET
+                    count = count + excluded.count
+            """, [(key, epoch, delta) for (key, epoch), delta in pending.items()])
+            cursor.execute("DELETE FROM velocity_buckets WHERE bucket_epoch < ?", (self._oldest_epoch(),))
+            conn.commit()
+            rows = self._read_window(cursor)
+
+        # Transactions recorded since the swap are still in _pending
+        with self._lock:
+            self._rebuild(rows)
+
+        return len(pending)
+
+    def load(self) -> int:
+        """Rebuild in-memory counters from persisted buckets still in the window"""
+        with get_db() as conn:
+            rows = self._read_window(conn.cursor())
+
+        with self._lock:
+            self._rebuild(rows)
+
+        return len(rows)
+
+
+velocity_tracker = VelocityTracker()
+
+
+# ============================================================================
+# Payment flow helpers
+# ============================================================================
+
+def get_device_id(headers: dict, client_host: Optional[str]) -> str:
+    """
+    Identify the paying device.
+
+    Uses the frontend's X-Device-Id header when present, otherwise a
+    hash of client IP and User-Agent.
+    """
+    device_id = headers.get("x-device-id")
+    if device_id:
+        return device_id[:64]
+
+    fingerprint = f"{client_host or ''}|{headers.get('user-agent', '')}"
+    return hashlib.sha1(fingerprint.encode()).hexdigest()[:16]
+
+
+def velocity_keys(seller_phone: str, buyer_phone: Optional[str] = None, device_id: Optional[str] = None) -> List[str]:
+    keys = [f"seller:{seller_phone}"]
+    if buyer_phone:
+        keys.append(f"buyer:{buyer_phone}")
+    if device_id:
+        keys.append(f"device:{device_id}")
+    return keys
+
+
+def record_payment_attempt(seller_phone: str, buyer_phone: str, device_id: Optional[str] = None):
+    """Count a payment initiation against seller, buyer and device"""
+    velocity_tracker.record(velocity_keys(seller_phone, buyer_phone, device_id))
+
+
+def get_transaction_velocity(seller_phone: str, buyer_phone: Optional[str] = None, device_id: Optional[str] = None) -> dict:
+    """
+    Transactions in the last hour per key.
+
+    The buyer and device counts are used as they are. The seller count is
+    scaled so VELOCITY_SELLER_MAX_PER_HOUR scores like 10 from one buyer;
+    otherwise any seller with 10 sales an hour would look like fraud.
+
+    Returns:
+        {
+            "velocity": int (highest buyer/device count or scaled seller count),
+            "counts": {key: count}
+        }
+    """
+    counts = {
+        key: velocity_tracker.count(key)
+        for key in velocity_keys(seller_phone, buyer_phone, device_id)
+    }
+    scores = [
+        count * VELOCITY_MAX_RISK_COUNT // VELOCITY_SELLER_MAX_PER_HOUR if key.startswith("seller:") else count
+        for key, count in counts.items()
+    ]
+    return {"velocity": max(scores), "counts": counts}
+
+
+async def run_velocity_persistence():
+    """Background task: flush velocity deltas every VELOCITY_FLUSH_SECONDS"""
+    while True:
+        await asyncio.sleep(VELOCITY_FLUSH_SECONDS)
+        try:
+            await asyncio.to_thread(velocity_tracker.flush)
+        except Exception as e:
+            print(f"Velocity persistence warning: {e}")
@@ -0,0 +1,25 @@
+"""
+Startup warm-up for Soko Pay
+The Gemini SDK and geopy are imported on first use so a new worker binds
+its port without waiting for them. This imports them in a worker thread
+shortly after startup, so the first AI or GPS request doesn't pay for it.
+"""
+
+import asyncio
+import time
+
+from app.config import WARMUP_DELAY_SECONDS
+from app.services import gis_verification
+from app.services.gemini_gateway import gemini_gateway
+
+
+async def run_warmup():
+    """Background task: import the deferred libraries after WARMUP_DELAY_SECONDS"""
+    await asyncio.sleep(WARMUP_DELAY_SECONDS)
+    started = time.perf_counter()
+    for name, warm in (("Gemini SDK", gemini_gateway.start), ("geopy", gis_verification.warm_up)):
+        try:
+            await asyncio.to_thread(warm)
+        except Exception as e:
+            print(f"Warm-up warning (non-blocking): {name}: {e}")
+    print(f"🔥 Warm-up finished in {(time.perf_counter() - started) * 1000:.0f}ms")
@@ -0,0 +1,137 @@
+"""
+HTTP file serving helpers for Soko Pay
+Conditional GET (ETag / If-None-Match), single byte ranges, and a file
+response that uses the server's zero-copy send when it offers one
+"""
+
+import os
+from typing import Mapping, Optional, Tuple
+
+import anyio
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+# Content-addressed files never change, so browsers and CDNs may keep them forever
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class RangeNotSatisfiable(Exception):
+    """Range header doesn't overlap the file (answer 416)"""
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    If-None-Match check (weak comparison, as RFC 9110 requires for GET).
+
+    Args:
+        if_none_match: Header value, e.g. '"abc", W/"def"' or '*'
+        etag: The resource's quoted ETag
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single byte range.
+
+    Multiple ranges and malformed headers are ignored (the full file is
+    sent, which RFC 9110 allows).
+
+    Args:
+        range_header: e.g. "bytes=0-1023", "bytes=1024-", "bytes=-500"
+        size: File size in bytes
+
+    Returns:
+        (start, end) inclusive, or None to send the whole file
+
+    Raises:
+        RangeNotSatisfiable: the range starts past the end of the file
+    """
+    if not range_header or not range_header.startswith("bytes="):
+        return None
+    spec = range_header[len("bytes="):].strip()
+    if "," in spec or "-" not in spec:
+        return None
+
+    first, last = (part.strip() for part in spec.split("-", 1))
+    try:
+        if not first:
+            # Suffix range: the last N bytes
+            length = int(last)
+            if length <= 0:
+                raise RangeNotSatisfiable()
+            return max(0, size - length), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+
+    if start >= size:
+        raise RangeNotSatisfiable()
+    if start < 0 or end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+class FileRangeResponse(Response):
+    """
+    Send a file, or one byte range of it.
+
+    With a server that supports the ASGI zero-copy extension the kernel
+    copies the file straight to the socket (sendfile); otherwise it is
+    read 64KB at a time in a worker thread.
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, path: str, size: int, byte_range: Optional[Tuple[int, int]] = None,
+                 headers: Optional[Mapping[str, str]] = None, media_type: Optional[str] = None):
+        self.path = path
+        self.media_type = media_type
+        self.background = None
+        self.start, self.end = byte_range if byte_range else (0, size - 1)
+        self.status_code = 206 if byte_range else 200
+        self.init_headers(headers)
+        self.headers["content-length"] = str(self.end - self.start + 1)
+        if byte_range:
+            self.headers["content-range"] = f"bytes {self.start}-{self.end}/{size}"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        count = self.end - self.start + 1
+        if scope["method"].upper() == "HEAD" or count <= 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        if "http.response.zerocopysend" in scope.get("extensions", {}):
+            fd = await anyio.to_thread.run_sync(os.open, self.path, os.O_RDONLY)
+            try:
+                await send({"type": "http.response.zerocopysend", "file": fd,
+                            "offset": self.start, "count": count, "more_body": False})
+            finally:
+                os.close(fd)
+            return
+
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.start)
+            remaining = count
+            while remaining > 0:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                # File shrank under us; close the response cleanly
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
@@ -0,0 +1,179 @@
+"""
+Incremental JSON parsing for streamed model output
+Feeds text chunks as they arrive and reports top-level fields of a JSON
+object as soon as they complete, plus string fields character by character
+"""
+
+import json
+from typing import List, Optional
+
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+# Parser states
+_BEFORE_OBJECT = 0   # Skipping prose / ``` fences before the opening brace
+_EXPECT_KEY = 1      # After { or , - waiting for a key (or })
+_IN_KEY = 2
+_EXPECT_COLON = 3
+_EXPECT_VALUE = 4
+_IN_STRING_VALUE = 5
+_IN_OTHER_VALUE = 6  # Number, literal, nested object or array
+_AFTER_VALUE = 7     # Waiting for , or }
+_DONE = 8
+
+
+class IncrementalJSONParser:
+    """
+    Streaming parser for one top-level JSON object.
+
+    feed() returns events for what became known in that chunk:
+        {"type": "delta", "field": str, "text": str}   - more of a string field
+        {"type": "field", "field": str, "value": any}  - a field is complete
+
+    Text before the first "{" (markdown fences, prose) is ignored, as is
+    anything after the closing "}". Nested values are reported whole once
+    they close; only top-level string values stream as deltas.
+    """
+
+    def __init__(self):
+        self.state = _BEFORE_OBJECT
+        self.fields: dict = {}
+        self._key: List[str] = []
+        self._value: List[str] = []
+        self._escape: Optional[str] = None  # Pending escape sequence, e.g. "\\u00"
+        self._depth = 0
+        self._nested_in_string = False
+        self._nested_escape = False
+
+    @property
+    def done(self) -> bool:
+        return self.state == _DONE
+
+    def _decode_escape(self) -> Optional[str]:
+        """Character for a complete escape sequence, or None if more input is needed"""
+        sequence = self._escape
+        if sequence[1] != "u":
+            return _ESCAPES.get(sequence[1], sequence[1])
+        if len(sequence) < 6:
+            return None
+        return chr(int(sequence[2:6], 16))
+
+    def _finish_other(self, events: list):
+        raw = "".join(self._value).strip()
+        key = "".join(self._key)
+        try:
+            value = json.loads(raw)
+        except json.JSONDecodeError:
+            value = raw
+        self.fields[key] = value
+        events.append({"type": "field", "field": key, "value": value})
+        self._value = []
+
+    def feed(self, chunk: str) -> List[dict]:
+        events: List[dict] = []
+        delta: List[str] = []
+
+        def flush_delta():
+            if delta:
+                events.append({"type": "delta", "field": "".join(self._key), "text": "".join(delta)})
+                delta.clear()
+
+        for char in chunk:
+            state = self.state
+
+            if state == _BEFORE_OBJECT:
+                if char == "{":
+                    self.state = _EXPECT_KEY
+
+            elif state == _EXPECT_KEY:
+                if char == '"':
+                    self._key = []
+                    self.state = _IN_KEY
+                elif char == "}":
+                    self.state = _DONE
+
+            elif state == _IN_KEY:
+                if self._escape is not None:
+                    self._escape += char
+                    decoded = self._decode_escape()
+                    if decoded is not None:
+                        self._key.append(decoded)
+                        self._escape = None
+                elif char == "\\":
+                    self._escape = char
+                elif char == '"':
+                    self.state = _EXPECT_COLON
+                else:
+                    self._key.append(char)
+
+            elif state == _EXPECT_COLON:
+                if char == ":":
+                    self.state = _EXPECT_VALUE
+
+            elif state == _EXPECT_VALUE:
+                if char == '"':
+                    self._value = []
+                    self.state = _IN_STRING_VALUE
+                elif not char.isspace():
+                    self._value = [char]
+                    self._depth = 1 if char in "{[" else 0
+                    self._nested_in_string = False
+                    self._nested_escape = False
+                    self.state = _IN_OTHER_VALUE
+
+            elif state == _IN_STRING_VALUE:
+                if self._escape is not None:
+                    self._escape += char
+                    decoded = self._decode_escape()
+                    if decoded is not None:
+                        self._value.append(decoded)
+                        delta.append(decoded)
+                        self._escape = None
+                elif char == "\\":
+                    self._escape = char
+                elif char == '"':
+                    flush_delta()
+                    key = "".join(self._key)
+                    self.fields[key] = "".join(self._value)
+                    events.append({"type": "field", "field": key, "value": self.fields[key]})
+                    self._value = []
+                    self.state = _AFTER_VALUE
+                else:
+                    self._value.append(char)
+                    delta.append(char)
+
+            elif state == _IN_OTHER_VALUE:
+                if self._nested_in_string:
+                    self._value.append(char)
+                    if self._nested_escape:
+                        self._nested_escape = False
+                    elif char == "\\":
+                        self._nested_escape = True
+                    elif char == '"':
+                        self._nested_in_string = False
+                elif self._depth == 0 and char in ",}":
+                    # End of a number or literal
+                    self._finish_other(events)
+                    self.state = _EXPECT_KEY if char == "," else _DONE
+                else:
+                    self._value.append(char)
+                    if char == '"':
+                        self._nested_in_string = True
+                    elif char in "{[":
+                        self._depth += 1
+                    elif char in "}]":
+                        self._depth -= 1
+                        if self._depth == 0:
+                            self._finish_other(events)
+                            self.state = _AFTER_VALUE
+
+            elif state == _AFTER_VALUE:
+                if char == ",":
+                    self.state = _EXPECT_KEY
+                elif char == "}":
+                    self.state = _DONE
+
+            if self.state == _DONE:
+                break
+
+        flush_delta()
+        return events
@@ -0,0 +1,45 @@
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Tuple, Union
+
+# Platform fee charged on every released escrow (3%)
+PLATFORM_FEE_RATE = Decimal("0.03")
+
+CENT = Decimal("0.01")
+
+Amount = Union[Decimal, float, int, str]
+
+
+def to_decimal(amount: Amount) -> Decimal:
+    """
+    Convert an amount in KES to an exact Decimal rounded to the cent.
+
+    Floats go through str() first so 4500.1 becomes Decimal("4500.10")
+    instead of its binary approximation.
+    """
+    if amount is None:
+        return Decimal("0.00")
+    if not isinstance(amount, Decimal):
+        amount = Decimal(str(amount))
+    return amount.quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def to_cents(amount: Amount) -> int:
+    """Convert an amount in KES to integer cents."""
+    return int(to_decimal(amount) * 100)
+
+
+def from_cents(cents: int) -> Decimal:
+    """Convert integer cents back to a KES Decimal."""
+    return (Decimal(cents) / 100).quantize(CENT)
+
+
+def split_platform_fee(gross: Amount) -> Tuple[Decimal, Decimal]:
+    """
+    Split a gross order amount into (platform_fee, seller_net).
+
+    The fee is rounded half-up to the cent and the seller gets the rest,
+    so fee + net always equals gross exactly.
+    """
+    gross = to_decimal(gross)
+    fee = (gross * PLATFORM_FEE_RATE).quantize(CENT, rounding=ROUND_HALF_UP)
+    return fee, gross - fee
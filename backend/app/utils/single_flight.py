@@ -0,0 +1,104 @@
+"""
+Single-flight request coalescing for Soko Pay
+Concurrent calls with the same arguments share one in-flight result
+instead of each starting their own (e.g. one Gemini call per viral listing)
+"""
+
+import asyncio
+import copy
+import functools
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+def call_key(name: str, args: tuple, kwargs: dict) -> str:
+    """Stable key for a call: function name plus a hash of its JSON-encoded arguments"""
+    payload = json.dumps([args, kwargs], sort_keys=True, default=str, separators=(",", ":"))
+    return f"{name}:{hashlib.sha1(payload.encode('utf-8')).hexdigest()}"
+
+
+class SingleFlight:
+    """
+    Shares one in-flight future between concurrent identical calls.
+
+    The first caller (the leader) starts the work as its own task, so a
+    caller that disconnects doesn't cancel it for everyone else. Callers
+    that arrive while it runs await the same future. Once it finishes the
+    key is released, so later calls start fresh - nothing is cached.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._metrics: Dict[str, Dict[str, int]] = {}
+
+    def _count(self, name: str, field: str):
+        counts = self._metrics.setdefault(name, {"calls": 0, "executed": 0, "coalesced": 0, "errors": 0})
+        counts[field] += 1
+
+    async def do(self, key: str, work: Callable[[], Awaitable[Any]], name: Optional[str] = None) -> Any:
+        """
+        Run work() unless an identical call is already in flight.
+
+        Args:
+            key: Call identity (see call_key)
+            work: Zero-argument coroutine function doing the real call
+            name: Metrics label (defaults to the key prefix)
+
+        Returns:
+            The shared result. Every caller gets its own deep copy, so
+            one caller mutating the dict can't affect another.
+        """
+        name = name or key.split(":", 1)[0]
+        self._count(name, "calls")
+
+        future = self._in_flight.get(key)
+        if future is None:
+            self._count(name, "executed")
+            future = asyncio.ensure_future(work())
+            self._in_flight[key] = future
+
+            def release(done: asyncio.Future):
+                if self._in_flight.get(key) is done:
+                    del self._in_flight[key]
+                if not done.cancelled() and done.exception() is not None:
+                    self._count(name, "errors")
+
+            future.add_done_callback(release)
+        else:
+            self._count(name, "coalesced")
+
+        result = await asyncio.shield(future)
+        return copy.deepcopy(result)
+
+    @property
+    def stats(self) -> dict:
+        """Per-function counters plus how many calls are in flight right now"""
+        functions = {}
+        for name, counts in sorted(self._metrics.items()):
+            functions[name] = {
+                **counts,
+                "coalesced_rate": round(counts["coalesced"] / counts["calls"], 4) if counts["calls"] else 0.0,
+            }
+        return {"in_flight": len(self._in_flight), "functions": functions}
+
+
+single_flight = SingleFlight()
+
+
+def coalesce(func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    """
+    Decorator: concurrent calls to an async function with the same
+    arguments share one execution.
+
+    Arguments must be JSON-serializable (dicts, lists, strings, numbers);
+    anything else is keyed by its str().
+    """
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        key = call_key(name, args, kwargs)
+        return await single_flight.do(key, lambda: func(*args, **kwargs), name)
+
+    return wrapper
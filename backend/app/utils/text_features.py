@@ -0,0 +1,57 @@
+import math
+import re
+import zlib
+from typing import Dict, Iterable, List
+
+# Size of the hashed feature space (must be a power of two)
+DEFAULT_FEATURE_BITS = 18
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens (letters and digits)."""
+    return _TOKEN_RE.findall((text or "").lower())
+
+
+def word_ngrams(tokens: List[str], prefix: str = "") -> List[str]:
+    """Unigrams and bigrams, namespaced with `prefix` so fields don't collide."""
+    grams = [prefix + token for token in tokens]
+    grams.extend(f"{prefix}{a}_{b}" for a, b in zip(tokens, tokens[1:]))
+    return grams
+
+
+def price_bucket(price: float) -> str:
+    """Coarse log-scale price band, e.g. "price:13" for 5,000-11,000 KES."""
+    if not price or price <= 0:
+        return "price:0"
+    return f"price:{int(math.log2(price))}"
+
+
+def hash_feature(feature: str, bits: int = DEFAULT_FEATURE_BITS) -> int:
+    """
+    Stable feature index.
+
+    Uses crc32 rather than hash(), which is salted per process and would
+    make a saved model useless after a restart.
+    """
+    return zlib.crc32(feature.encode("utf-8")) & ((1 << bits) - 1)
+
+
+def hashed_features(features: Iterable[str], bits: int = DEFAULT_FEATURE_BITS) -> Dict[int, float]:
+    """
+    Sparse vector {index: value} for a bag of string features.
+
+    Values are counts scaled to unit length, so long descriptions don't
+    outweigh short ones.
+    """
+    vector: Dict[int, float] = {}
+    for feature in features:
+        index = hash_feature(feature, bits)
+        vector[index] = vector.get(index, 0.0) + 1.0
+
+    norm = math.sqrt(sum(value * value for value in vector.values()))
+    if norm:
+        for index in vector:
+            vector[index] /= norm
+    return vector
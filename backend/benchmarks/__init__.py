@@ -0,0 +1,4 @@
+"""
+Benchmarks for Soko Pay
+load_test: end-to-end scenarios against the app with fake PayHero/Gemini
+"""
@@ -0,0 +1,164 @@
+"""
+Stand-ins for PayHero and Gemini used by the load test
+Both answer like the real services do on the happy path, after a
+configurable delay, so a benchmark measures our code and not theirs
+"""
+
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+
+def _delay(latency_ms: float, jitter: float):
+    """Sleep latency_ms, +/- jitter (a fraction of it)"""
+    if latency_ms > 0:
+        time.sleep(latency_ms * random.uniform(1 - jitter, 1 + jitter) / 1000)
+
+
+# ============================================================================
+# PayHero
+# ============================================================================
+
+class FakePayHero:
+    """
+    PayHero API on 127.0.0.1 (point PAYHERO_BASE_URL at .base_url).
+
+    POST /payments answers like an accepted STK push; GET /payments/<ref>
+    answers like a completed one.
+    """
+
+    def __init__(self, latency_ms: float = 300, jitter: float = 0.2):
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.calls = 0
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/api/v2"
+
+    def _count(self):
+        with self._lock:
+            self.calls += 1
+
+    def start(self) -> "FakePayHero":
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _reply(self, body: dict):
+                data = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                self.rfile.read(length)
+                fake._count()
+                _delay(fake.latency_ms, fake.jitter)
+                self._reply({
+                    "success": True,
+                    "status": "QUEUED",
+                    "reference": f"PH{uuid.uuid4().hex[:10].upper()}",
+                    "CheckoutRequestID": f"ws_CO_{uuid.uuid4().hex[:16]}",
+                })
+
+            def do_GET(self):
+                fake._count()
+                _delay(fake.latency_ms, fake.jitter)
+                self._reply({"status": "SUCCESS", "reference": self.path.rsplit("/", 1)[-1]})
+
+            def log_message(self, format, *args):
+                pass  # One line per request would drown the report
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+# ============================================================================
+# Gemini
+# ============================================================================
+
+class _Response:
+    """The parts of a google.generativeai response the gateway reads"""
+
+    usage_metadata = None  # Gateway falls back to estimating tokens
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeGeminiModel:
+    """
+    GenerativeModel stand-in.
+
+    Fraud prompts get a fraud verdict; anything else gets an empty JSON
+    object. Streaming replies arrive in a few chunks over the same delay.
+    """
+
+    def __init__(self, latency_ms: float = 800, jitter: float = 0.3):
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _reply(self, prompt: str) -> str:
+        if "fraud" in prompt.lower():
+            score = random.randint(5, 60)
+            return json.dumps({
+                "risk_score": score,
+                "risk_level": "low" if score <= 40 else "medium",
+                "reason": "Price and description look consistent with the category",
+                "flags": [],
+            })
+        return "{}"
+
+    def generate_content(self, prompt: str, stream: bool = False):
+        with self._lock:
+            self.calls += 1
+        text = self._reply(prompt)
+        if not stream:
+            _delay(self.latency_ms, self.jitter)
+            return _Response(text)
+        return self._stream(text)
+
+    def _stream(self, text: str):
+        chunks = 4
+        size = max(1, len(text) // chunks)
+        for i in range(0, len(text), size):
+            _delay(self.latency_ms / chunks, self.jitter)
+            yield _Response(text[i:i + size])
+
+
+def install_fake_gemini(gateway, latency_ms: float = 800, jitter: float = 0.3) -> FakeGeminiModel:
+    """
+    Make `gateway` use a FakeGeminiModel for every call.
+
+    Replaces gateway.start, so the app's startup hook keeps the fake
+    instead of configuring the real SDK.
+    """
+    model = FakeGeminiModel(latency_ms, jitter)
+
+    def start():
+        gateway.json_mode = True
+        gateway._models = {"text": model, "json": model}
+
+    gateway.start = start
+    start()
+    return model
@@ -0,0 +1,141 @@
+"""
+Import-time profile for Soko Pay
+Runs `python -X importtime -c "import main"` in a fresh interpreter and
+reports the slowest modules and packages, so it's clear what a new
+worker pays for before it can bind its port.
+
+--check fails if a library that should be imported lazily (the Gemini SDK,
+geopy) is imported at startup again.
+
+Usage (from backend/):
+    python -m benchmarks.import_profile
+    python -m benchmarks.import_profile --runs 5 --top 30 --output imports.json
+    python -m benchmarks.import_profile --check
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from typing import Dict, List
+
+# Imported on first use or by app/services/warmup.py after startup
+DEFERRED_MODULES = ("google.generativeai", "geopy")
+
+_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def profile_once(module: str = "main") -> Dict[str, dict]:
+    """
+    Import `module` in a new interpreter.
+
+    Returns:
+        {module name: {"self_us", "cumulative_us", "depth"}}
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    modules = {}
+    for line in result.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules[name] = {
+                "self_us": int(self_us),
+                "cumulative_us": int(cumulative_us),
+                "depth": (len(indent) - 1) // 2,
+            }
+    return modules
+
+
+def _package(name: str) -> str:
+    """Group our own modules by file (app.services.x), libraries by top-level package"""
+    parts = name.split(".")
+    if parts[0] == "app":
+        return ".".join(parts[:3])
+    if parts[0] == "google" and len(parts) > 1:
+        return ".".join(parts[:2])
+    return parts[0]
+
+
+def profile(module: str = "main", runs: int = 3, top: int = 20) -> dict:
+    """Median over `runs` imports (after one discarded run that warms the bytecode cache)"""
+    profile_once(module)
+    samples = [profile_once(module) for _ in range(runs)]
+
+    names = set().union(*samples)
+    median = {
+        name: {
+            "self_us": int(statistics.median(s[name]["self_us"] for s in samples if name in s)),
+            "cumulative_us": int(statistics.median(s[name]["cumulative_us"] for s in samples if name in s)),
+        }
+        for name in names
+    }
+    packages: Dict[str, int] = defaultdict(int)
+    for name, stats in median.items():
+        packages[_package(name)] += stats["self_us"]
+
+    def ranked(items, key):
+        return sorted(items, key=key, reverse=True)[:top]
+
+    return {
+        "module": module,
+        "runs": runs,
+        "total_ms": round(median.get(module, {}).get("cumulative_us", 0) / 1000, 1),
+        "modules_imported": len(median),
+        "deferred_imported": [m for m in DEFERRED_MODULES if m in median],
+        "slowest_cumulative": [
+            {"module": name, "cumulative_ms": round(stats["cumulative_us"] / 1000, 1),
+             "self_ms": round(stats["self_us"] / 1000, 1)}
+            for name, stats in ranked(median.items(), lambda item: item[1]["cumulative_us"])
+        ],
+        "slowest_packages": [
+            {"package": package, "self_ms": round(us / 1000, 1)}
+            for package, us in ranked(packages.items(), lambda item: item[1])
+        ],
+    }
+
+
+def print_report(report: dict):
+    print(f"import {report['module']}: {report['total_ms']}ms, {report['modules_imported']} modules "
+          f"(median of {report['runs']} runs)\n")
+    print(f"{'package (self time summed)':<44} {'ms':>8}")
+    for row in report["slowest_packages"]:
+        print(f"{row['package']:<44} {row['self_ms']:>8}")
+    print(f"\n{'module (cumulative)':<60} {'cum ms':>8} {'self ms':>8}")
+    for row in report["slowest_cumulative"]:
+        print(f"{row['module']:<60} {row['cumulative_ms']:>8} {row['self_ms']:>8}")
+    if report["deferred_imported"]:
+        print(f"\n⚠️  Imported at startup but meant to be deferred: {', '.join(report['deferred_imported'])}")
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Import-time profile of the Soko Pay app")
+    parser.add_argument("--module", default="main", help="Module to import (default: main)")
+    parser.add_argument("--runs", type=int, default=3, help="Imports to take the median of")
+    parser.add_argument("--top", type=int, default=20, help="Rows per table")
+    parser.add_argument("--output", help="Also write the report as JSON")
+    parser.add_argument("--check", action="store_true",
+                        help="Exit 1 if a deferred library (Gemini SDK, geopy) is imported at startup")
+    args = parser.parse_args(argv)
+
+    report = profile(args.module, args.runs, args.top)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n📄 Report written to {args.output}")
+    if args.check and report["deferred_imported"]:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
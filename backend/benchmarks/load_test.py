@@ -0,0 +1,428 @@
+"""
+Load test for Soko Pay
+Starts the app in-process (uvicorn on a free port) against a fresh SQLite
+database, a fake PayHero server and a fake Gemini with configurable
+latency, then drives the main flows with N concurrent clients:
+
+    seller_links    POST /api/create-payment-link (fraud check on each)
+    buyer_pay       POST /api/pay/{order_id} (STK push via PayHero)
+    callback_storm  POST /api/payhero/callback, each one repeated as PayHero does
+    rider_pings     POST /api/track/{order_id}/update-location at N active deliveries
+
+Throughput and p50/p95/p99 per endpoint go to a JSON file tagged with the
+git commit, so runs on two commits can be compared with --compare.
+
+Usage (from backend/):
+    python -m benchmarks.load_test --concurrency 20 --links 200 --deliveries 50
+    python -m benchmarks.load_test --compare load-1a2b3c4.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+import httpx
+
+from benchmarks.fakes import FakePayHero, install_fake_gemini
+
+SCENARIOS = ("seller_links", "buyer_pay", "callback_storm", "rider_pings")
+
+# Pickup points around Nairobi riders start from
+NAIROBI_PICKUPS = [
+    ("CBD", -1.2864, 36.8172),
+    ("Westlands", -1.2676, 36.8108),
+    ("Kilimani", -1.2921, 36.7856),
+    ("Eastleigh", -1.2741, 36.8500),
+    ("Karen", -1.3197, 36.7076),
+    ("Kasarani", -1.2218, 36.8980),
+]
+
+LISTINGS = [
+    ("Nike Air Max 270", 9500, "Shoes", "Original Nike Air Max 270, size 42, worn twice, with box"),
+    ("Samsung Galaxy A54", 38000, "Electronics", "Samsung A54 128GB, 6 months old, no scratches, charger included"),
+    ("Ankara Maxi Dress", 2800, "Fashion", "Handmade Ankara maxi dress, sizes S to XL, made to order in 3 days"),
+    ("HP EliteBook 840 G5", 42000, "Electronics", "Core i5 8th gen, 8GB RAM, 256GB SSD, ex-UK, 3 months warranty"),
+    ("Sufuria Set 7 Pieces", 3500, "Home", "Stainless steel sufuria set, 7 pieces, new in box"),
+    ("PlayStation 5 Slim", 68000, "Electronics", "PS5 Slim disc edition, two controllers, receipt available"),
+    ("Maasai Beaded Necklace", 1200, "Fashion", "Hand-beaded Maasai necklace, made in Kajiado"),
+    ("Office Chair", 8500, "Furniture", "Ergonomic mesh office chair, adjustable height, delivery within Nairobi"),
+]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _git(*args: str) -> str:
+    try:
+        return subprocess.run(["git", *args], capture_output=True, text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def percentile(samples: List[float], p: float) -> float:
+    return round(samples[min(len(samples) - 1, int(len(samples) * p))], 2) if samples else 0.0
+
+
+# ============================================================================
+# Recording
+# ============================================================================
+
+class Recorder:
+    """Latency and status of every request, grouped by endpoint template"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    def add(self, endpoint: str, elapsed_ms: float, status: str, ok: bool):
+        self.latencies[endpoint].append(elapsed_ms)
+        self.statuses[endpoint][status] += 1
+        if not ok:
+            self.errors[endpoint] += 1
+
+    def summary(self, duration: float) -> dict:
+        endpoints = {}
+        for endpoint, latencies in sorted(self.latencies.items()):
+            ordered = sorted(latencies)
+            endpoints[endpoint] = {
+                "requests": len(ordered),
+                "errors": self.errors[endpoint],
+                "statuses": dict(self.statuses[endpoint]),
+                "throughput_rps": round(len(ordered) / duration, 2) if duration else 0.0,
+                "mean_ms": round(sum(ordered) / len(ordered), 2),
+                "p50_ms": percentile(ordered, 0.50),
+                "p95_ms": percentile(ordered, 0.95),
+                "p99_ms": percentile(ordered, 0.99),
+                "max_ms": round(ordered[-1], 2),
+            }
+        total = sum(len(v) for v in self.latencies.values())
+        return {
+            "duration_s": round(duration, 3),
+            "requests": total,
+            "errors": sum(self.errors.values()),
+            "throughput_rps": round(total / duration, 2) if duration else 0.0,
+            "endpoints": endpoints,
+        }
+
+
+class Runner:
+    """Sends requests with at most `concurrency` in flight, recording each one"""
+
+    def __init__(self, client: httpx.AsyncClient, concurrency: int):
+        self.client = client
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.recorder = Recorder()
+
+    async def request(self, endpoint: str, method: str, path: str, body: Optional[dict] = None) -> Optional[dict]:
+        """
+        Send one request.
+
+        Args:
+            endpoint: Label to group by, e.g. "POST /api/pay/{order_id}"
+
+        Returns:
+            The JSON body of a successful response, otherwise None
+        """
+        async with self.semaphore:
+            started = time.perf_counter()
+            try:
+                response = await self.client.request(method, path, json=body)
+            except httpx.HTTPError as e:
+                self.recorder.add(endpoint, (time.perf_counter() - started) * 1000, type(e).__name__, False)
+                return None
+            elapsed_ms = (time.perf_counter() - started) * 1000
+        try:
+            data = response.json()
+        except ValueError:
+            data = None
+        # Callback handlers answer 200 with {"status": "error"} on failure
+        ok = response.status_code < 400 and not (isinstance(data, dict) and data.get("status") == "error")
+        self.recorder.add(endpoint, elapsed_ms, str(response.status_code), ok)
+        return data if ok else None
+
+    async def run(self, calls: List[Callable]) -> list:
+        """Run every call (each returns a request coroutine) and collect the results in order"""
+        return await asyncio.gather(*(call() for call in calls))
+
+
+# ============================================================================
+# Scenarios
+# ============================================================================
+
+class State:
+    """Orders handed from one scenario to the next"""
+
+    def __init__(self):
+        self.created: List[str] = []
+        self.pay_started: List[str] = []
+        self.paid: List[str] = []
+
+
+def _listing(i: int) -> dict:
+    name, price, category, description = LISTINGS[i % len(LISTINGS)]
+    _, lat, lon = NAIROBI_PICKUPS[i % len(NAIROBI_PICKUPS)]
+    return {
+        "name": f"{name} #{i}",
+        "price": round(price * random.uniform(0.85, 1.15)),
+        "description": description,
+        "seller_phone": f"2547{12000000 + i % 500:08d}",
+        "seller_name": f"Seller {i % 500}",
+        "category": category,
+        "seller_location": {"latitude": lat, "longitude": lon},
+    }
+
+
+async def seller_links(runner: Runner, state: State, args):
+    calls = [
+        (lambda i=i: runner.request("POST /api/create-payment-link", "POST", "/api/create-payment-link", _listing(i)))
+        for i in range(args.links)
+    ]
+    results = await runner.run(calls)
+    state.created = [r["order_id"] for r in results if r]
+
+
+async def buyer_pay(runner: Runner, state: State, args):
+    calls = [
+        (lambda i=i, order_id=order_id: runner.request(
+            "POST /api/pay/{order_id}", "POST", f"/api/pay/{order_id}",
+            {"buyer_phone": f"2547{22000000 + i:08d}", "buyer_name": f"Buyer {i}"}
+        ))
+        for i, order_id in enumerate(state.created)
+    ]
+    results = await runner.run(calls)
+    state.pay_started = [order_id for order_id, r in zip(state.created, results) if r]
+
+
+async def callback_storm(runner: Runner, state: State, args):
+    # PayHero retries callbacks, so each payment's arrives several times, interleaved
+    calls = []
+    for order_id in state.pay_started:
+        body = {
+            "reference": f"PH{order_id[-10:]}",
+            "status": "success",
+            "amount": 1000,
+            "phone_number": "254722000000",
+            "mpesa_reference": f"SBK{order_id[-7:]}",
+            "external_reference": f"SOKO-{order_id}",
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        calls.extend(
+            (lambda body=body: runner.request("POST /api/payhero/callback", "POST", "/api/payhero/callback", body))
+            for _ in range(args.callback_repeats)
+        )
+    random.shuffle(calls)
+    await runner.run(calls)
+    state.paid = list(state.pay_started)
+
+
+async def rider_pings(runner: Runner, state: State, args):
+    deliveries = state.paid[:args.deliveries]
+    if len(deliveries) < args.deliveries:
+        print(f"  only {len(deliveries)} paid orders available for {args.deliveries} deliveries")
+    shipped = await runner.run([
+        (lambda order_id=order_id: runner.request("POST /api/ship/{order_id}", "POST", f"/api/ship/{order_id}"))
+        for order_id in deliveries
+    ])
+    active = [order_id for order_id, r in zip(deliveries, shipped) if r]
+
+    # Each rider heads off from a pickup point; all riders ping once per round
+    riders = {}
+    for i, order_id in enumerate(active):
+        _, lat, lon = NAIROBI_PICKUPS[i % len(NAIROBI_PICKUPS)]
+        riders[order_id] = [lat, lon, random.uniform(-0.0008, 0.0008), random.uniform(-0.0008, 0.0008)]
+
+    def ping(order_id: str):
+        rider = riders[order_id]
+        rider[0] += rider[2] + random.uniform(-0.0001, 0.0001)
+        rider[1] += rider[3] + random.uniform(-0.0001, 0.0001)
+        body = {
+            "latitude": round(rider[0], 6),
+            "longitude": round(rider[1], 6),
+            "accuracy": round(random.uniform(5, 25), 1),
+            "speed": round(random.uniform(10, 40), 1),
+            "heading": round(random.uniform(0, 360)),
+            "tracker_type": "delivery_person",
+        }
+        return runner.request("POST /api/track/{order_id}/update-location", "POST",
+                              f"/api/track/{order_id}/update-location", body)
+
+    for _ in range(args.pings):
+        await runner.run([(lambda order_id=order_id: ping(order_id)) for order_id in active])
+
+
+SCENARIO_FUNCS = {
+    "seller_links": seller_links,
+    "buyer_pay": buyer_pay,
+    "callback_storm": callback_storm,
+    "rider_pings": rider_pings,
+}
+
+
+# ============================================================================
+# Harness
+# ============================================================================
+
+def configure_environment(args, workdir: str, payhero_url: str):
+    """Point the app at throwaway storage and the fakes (before main is imported)"""
+    os.environ["DATABASE_PATH"] = os.path.join(workdir, "soko_pay.db")
+    os.environ["UPLOAD_DIR"] = os.path.join(workdir, "uploads")
+    os.environ["PAYOUT_DIR"] = os.path.join(workdir, "payouts")
+    os.environ["PAYHERO_BASE_URL"] = payhero_url
+    os.environ["PAYHERO_AUTH_TOKEN"] = "Basic bG9hZHRlc3Q6bG9hZHRlc3Q="
+    os.environ["TRACE_EXPORT_DIR"] = ""
+    os.environ["METRICS_DIR"] = ""
+    if args.gemini_rate:
+        os.environ["GEMINI_RATE_PER_MINUTE"] = str(args.gemini_rate)
+        os.environ["GEMINI_BURST"] = str(max(10, int(args.gemini_rate // 60)))
+
+
+def start_server(app, port: int):
+    """Run uvicorn in a background thread; returns the Server once it accepts connections"""
+    import uvicorn
+
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="on")
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    deadline = time.monotonic() + 30
+    while not server.started:
+        if time.monotonic() > deadline:
+            raise RuntimeError("App didn't start within 30s")
+        time.sleep(0.05)
+    return server
+
+
+async def drive(base_url: str, args) -> dict:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=args.timeout) as client:
+        for _ in range(5):
+            await client.get("/health")  # Warm up connections and lazy imports
+
+        state = State()
+        results = {}
+        for name in SCENARIOS:
+            runner = Runner(client, args.concurrency)
+            print(f"▶ {name}...")
+            started = time.perf_counter()
+            await SCENARIO_FUNCS[name](runner, state, args)
+            results[name] = runner.recorder.summary(time.perf_counter() - started)
+            print(f"  {results[name]['requests']} requests, {results[name]['errors']} errors, "
+                  f"{results[name]['throughput_rps']} req/s")
+        return results
+
+
+def run(args) -> dict:
+    random.seed(args.seed)
+    workdir = tempfile.mkdtemp(prefix="soko-load-")
+    payhero = FakePayHero(args.payhero_latency_ms).start()
+    configure_environment(args, workdir, payhero.base_url)
+
+    import main
+    from app.services.gemini_gateway import gemini_gateway
+
+    gemini = install_fake_gemini(gemini_gateway, args.gemini_latency_ms)
+    port = _free_port()
+    server = start_server(main.app, port)
+    try:
+        scenarios = asyncio.run(drive(f"http://127.0.0.1:{port}", args))
+    finally:
+        server.should_exit = True
+        payhero.stop()
+
+    return {
+        "meta": {
+            "commit": _git("rev-parse", "HEAD"),
+            "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": {
+                "concurrency": args.concurrency,
+                "links": args.links,
+                "callback_repeats": args.callback_repeats,
+                "deliveries": args.deliveries,
+                "pings": args.pings,
+                "payhero_latency_ms": args.payhero_latency_ms,
+                "gemini_latency_ms": args.gemini_latency_ms,
+                "gemini_rate": args.gemini_rate,
+                "seed": args.seed,
+            },
+            "fake_calls": {"payhero": payhero.calls, "gemini": gemini.calls},
+        },
+        "scenarios": scenarios,
+    }
+
+
+def _change(old: float, new: float) -> str:
+    if not old:
+        return "    n/a"
+    return f"{(new - old) / old * 100:+6.1f}%"
+
+
+def compare(baseline: dict, current: dict):
+    """Print throughput and p95/p99 per endpoint against a baseline report"""
+    print(f"\nBaseline {baseline['meta']['commit'][:10]} -> current {current['meta']['commit'][:10]}"
+          f"{' (dirty)' if current['meta']['dirty'] else ''}")
+    if baseline["meta"]["config"] != current["meta"]["config"]:
+        print("⚠️  Configs differ; numbers aren't directly comparable")
+    for name, scenario in current["scenarios"].items():
+        old_scenario = baseline["scenarios"].get(name)
+        if not old_scenario:
+            continue
+        print(f"\n{name}")
+        for endpoint, stats in scenario["endpoints"].items():
+            old = old_scenario["endpoints"].get(endpoint)
+            if not old:
+                print(f"  {endpoint:<48} (new)")
+                continue
+            print(f"  {endpoint:<48} req/s {old['throughput_rps']:>8} -> {stats['throughput_rps']:>8} "
+                  f"{_change(old['throughput_rps'], stats['throughput_rps'])}   "
+                  f"p95 {old['p95_ms']:>8} -> {stats['p95_ms']:>8} ms {_change(old['p95_ms'], stats['p95_ms'])}   "
+                  f"p99 {_change(old['p99_ms'], stats['p99_ms'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Soko Pay load test (app in-process, fake PayHero and Gemini)")
+    parser.add_argument("--concurrency", type=int, default=20, help="Requests in flight at once")
+    parser.add_argument("--links", type=int, default=200, help="Payment links sellers create (and buyers pay)")
+    parser.add_argument("--callback-repeats", type=int, default=3, help="Times each PayHero callback arrives")
+    parser.add_argument("--deliveries", type=int, default=50, help="Active deliveries during rider_pings")
+    parser.add_argument("--pings", type=int, default=20, help="Location pings per delivery")
+    parser.add_argument("--payhero-latency-ms", type=float, default=300, help="Fake PayHero response time")
+    parser.add_argument("--gemini-latency-ms", type=float, default=800, help="Fake Gemini response time")
+    parser.add_argument("--gemini-rate", type=float, default=0,
+                        help="GEMINI_RATE_PER_MINUTE for the run (default: the app's setting)")
+    parser.add_argument("--timeout", type=float, default=60, help="Client timeout per request (s)")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for listings and rider routes")
+    parser.add_argument("--output", help="Report path (default: load-<commit>.json)")
+    parser.add_argument("--compare", help="Earlier report to compare this run against")
+    args = parser.parse_args()
+
+    report = run(args)
+    output = args.output or f"load-{report['meta']['commit'][:7] or 'nogit'}.json"
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n📄 Report written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
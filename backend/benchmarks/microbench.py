@@ -0,0 +1,346 @@
+"""
+Microbenchmarks for Soko Pay
+The pure functions on the request path (GPS checks, rule-based fraud
+scoring, composite risk), timed on synthetic Nairobi rider tracks of 10 to
+10k points and synthetic listings.
+
+Each benchmark is calibrated so one repeat takes at least --min-time
+seconds, then repeated --repeats times with the garbage collector off (as
+timeit does). The median ns per call is reported with its interquartile
+range, plus the peak memory allocated during one call (tracemalloc).
+
+A run compared against a baseline flags a benchmark as a regression when
+its median is more than --threshold slower AND the two runs' IQRs don't
+overlap, so ordinary noise isn't reported.
+
+Usage (from backend/):
+    python -m benchmarks.microbench --save-baseline benchmarks/microbench_baseline.json
+    python -m benchmarks.microbench --compare benchmarks/microbench_baseline.json
+    python -m benchmarks.microbench --filter analyze_location_pattern
+"""
+
+import argparse
+import gc
+import itertools
+import json
+import math
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Tuple
+
+from app.services.ai_fraud import fallback_fraud_detection
+from app.services.gis_verification import (
+    analyze_location_pattern,
+    calculate_distance,
+    estimate_delivery_time,
+    validate_route,
+)
+from app.utils.risk_scoring import calculate_composite_risk
+
+TRACK_SIZES = (10, 100, 1000, 10000)
+
+# (name, lat, lon) - rider start points and buyer destinations
+NAIROBI_PLACES = [
+    ("CBD", -1.2864, 36.8172),
+    ("Westlands", -1.2676, 36.8108),
+    ("Kilimani", -1.2921, 36.7856),
+    ("Eastleigh", -1.2741, 36.8500),
+    ("Karen", -1.3197, 36.7076),
+    ("Kasarani", -1.2218, 36.8980),
+    ("Embakasi", -1.3225, 36.8941),
+    ("Ruaka", -1.2085, 36.7786),
+]
+
+PRODUCTS = [
+    ("iPhone 15 Pro", 135000, "Electronics"),
+    ("Nike Air Max", 9500, "Shoes"),
+    ("Samsung TV 55 inch", 62000, "Electronics"),
+    ("PlayStation 5", 70000, "Electronics"),
+    ("Ankara Dress", 2800, "Fashion"),
+    ("Sufuria Set", 3500, "Home"),
+    ("Office Chair", 8500, "Furniture"),
+    ("Maasai Necklace", 1200, "Fashion"),
+]
+
+DESCRIPTIONS = [
+    "Brand new, sealed in box, receipt available",
+    "Gently used for 3 months, no scratches, original charger included",
+    "Handmade locally, delivery within Nairobi, pay on delivery accepted",
+    "Pay now no refunds, send money first to reserve, limited stock",
+    "Urgent sale, ex-UK, price negotiable, call only",
+    "",
+]
+
+
+# ============================================================================
+# Synthetic data
+# ============================================================================
+
+def nairobi_track(points: int, seed: int = 0) -> List[Dict]:
+    """
+    A boda-boda track: one GPS fix every 15s at ~15-35 km/h with GPS
+    jitter, a few stops, and (1 in 500 fixes) a jump far enough to be
+    flagged as teleportation.
+    """
+    rng = random.Random(seed)
+    _, lat, lon = rng.choice(NAIROBI_PLACES)
+    heading = rng.uniform(0, 2 * math.pi)
+    at = datetime(2025, 1, 6, 9, 0, 0)
+    track = []
+    for i in range(points):
+        track.append({"latitude": lat, "longitude": lon, "created_at": at})
+        at += timedelta(seconds=15)
+        if rng.random() < 0.002:
+            lat += rng.uniform(-0.05, 0.05)  # Bad fix / spoofed location
+            continue
+        if rng.random() < 0.05:
+            continue  # Stopped (traffic, gate)
+        heading += rng.gauss(0, 0.3)
+        step_km = rng.uniform(15, 35) * 15 / 3600
+        lat += step_km / 111.0 * math.cos(heading) + rng.gauss(0, 0.00003)
+        lon += step_km / 111.0 * math.sin(heading) + rng.gauss(0, 0.00003)
+    return track
+
+
+def synthetic_listings(count: int = 1000, seed: int = 0) -> List[dict]:
+    """Fraud-check inputs: real-looking, underpriced, scammy and empty listings"""
+    rng = random.Random(seed)
+    listings = []
+    for i in range(count):
+        name, price, category = rng.choice(PRODUCTS)
+        listings.append({
+            "product_name": name,
+            "price": round(price * rng.choice([0.05, 0.4, 0.9, 1.0, 1.1])),
+            "description": rng.choice(DESCRIPTIONS),
+            "seller_phone": f"2547{rng.randint(10000000, 99999999)}",
+            "category": category,
+        })
+    return listings
+
+
+# ============================================================================
+# Benchmarks
+# ============================================================================
+
+def build_benchmarks(seed: int = 0) -> Dict[str, Callable[[], object]]:
+    """Name -> zero-argument callable; inputs are built here, not timed"""
+    rng = random.Random(seed)
+    pairs = itertools.cycle([
+        (rng.choice(NAIROBI_PLACES)[1:], rng.choice(NAIROBI_PLACES)[1:]) for _ in range(256)
+    ])
+    listings = itertools.cycle(synthetic_listings(seed=seed))
+    risk_inputs = itertools.cycle([
+        (rng.randint(0, 100), rng.randint(0, 100), rng.randint(0, 15)) for _ in range(256)
+    ])
+
+    def distance():
+        (a_lat, a_lon), (b_lat, b_lon) = next(pairs)
+        return calculate_distance(a_lat, a_lon, b_lat, b_lon)
+
+    def eta():
+        (a_lat, a_lon), (b_lat, b_lon) = next(pairs)
+        return estimate_delivery_time(a_lat, a_lon, b_lat, b_lon, 22)
+
+    benchmarks = {
+        "calculate_distance": distance,
+        "estimate_delivery_time": eta,
+        "fallback_fraud_detection": lambda: fallback_fraud_detection(next(listings)),
+        "calculate_composite_risk": lambda: calculate_composite_risk(*next(risk_inputs)),
+    }
+    for size in TRACK_SIZES:
+        track = nairobi_track(size, seed + size)
+        start = (track[0]["latitude"], track[0]["longitude"])
+        end = (track[-1]["latitude"], track[-1]["longitude"])
+        benchmarks[f"analyze_location_pattern[{size}]"] = lambda track=track: analyze_location_pattern(track)
+        benchmarks[f"validate_route[{size}]"] = (
+            lambda track=track, start=start, end=end: validate_route(start, end, track)
+        )
+    return benchmarks
+
+
+# ============================================================================
+# Measurement
+# ============================================================================
+
+def _time_loop(func: Callable, number: int) -> float:
+    """Seconds for `number` calls, with the GC off (as timeit does)"""
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        return time.perf_counter() - started
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+def calibrate(func: Callable, min_time: float) -> int:
+    """Smallest 1-2-5 loop count whose run takes at least min_time seconds"""
+    for exponent in itertools.count():
+        for factor in (1, 2, 5):
+            number = factor * 10 ** exponent
+            if _time_loop(func, number) >= min_time:
+                return number
+
+
+def measure_allocations(func: Callable, calls: int = 3) -> Tuple[int, int]:
+    """
+    (peak, retained) bytes per call, as the median over `calls` calls.
+
+    Peak is the most memory the call held at once above what was live
+    before it; retained is what was still allocated after it returned.
+    """
+    func()  # First call may fill caches (rule pack, regexes)
+    peaks, retained = [], []
+    tracemalloc.start()
+    try:
+        for _ in range(calls):
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            result = func()
+            after, peak = tracemalloc.get_traced_memory()
+            del result
+            peaks.append(peak - before)
+            retained.append(after - before)
+    finally:
+        tracemalloc.stop()
+    return int(statistics.median(peaks)), int(statistics.median(retained))
+
+
+def measure(func: Callable, repeats: int, min_time: float) -> dict:
+    """Timing statistics (ns per call) and allocations for one benchmark"""
+    number = calibrate(func, min_time)
+    _time_loop(func, number)  # Warm-up repeat, discarded
+    per_call = sorted(_time_loop(func, number) / number * 1e9 for _ in range(repeats))
+    q1, _, q3 = statistics.quantiles(per_call, n=4) if len(per_call) > 1 else (per_call[0],) * 3
+    peak, retained = measure_allocations(func)
+    return {
+        "ns_per_call": round(statistics.median(per_call), 1),
+        "q1_ns": round(q1, 1),
+        "q3_ns": round(q3, 1),
+        "min_ns": round(per_call[0], 1),
+        "max_ns": round(per_call[-1], 1),
+        "loops": number,
+        "repeats": repeats,
+        "alloc_peak_bytes": peak,
+        "alloc_retained_bytes": retained,
+    }
+
+
+def _git(*args: str) -> str:
+    try:
+        return subprocess.run(["git", *args], capture_output=True, text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def run(repeats: int, min_time: float, name_filter: str = "", seed: int = 0) -> dict:
+    results = {}
+    for name, func in build_benchmarks(seed).items():
+        if name_filter and name_filter not in name:
+            continue
+        results[name] = stats = measure(func, repeats, min_time)
+        print(f"{name:<36} {_format_ns(stats['ns_per_call']):>12}/call  "
+              f"IQR {_format_ns(stats['q1_ns'])}-{_format_ns(stats['q3_ns'])}  "
+              f"peak {stats['alloc_peak_bytes']:>9,} B")
+    return {
+        "meta": {
+            "commit": _git("rev-parse", "HEAD"),
+            "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+            "platform": platform.platform(),
+            "repeats": repeats,
+            "min_time": min_time,
+            "seed": seed,
+        },
+        "results": results,
+    }
+
+
+# ============================================================================
+# Comparison
+# ============================================================================
+
+def _format_ns(ns: float) -> str:
+    for unit, scale in (("s", 1e9), ("ms", 1e6), ("µs", 1e3)):
+        if ns >= scale:
+            return f"{ns / scale:.2f}{unit}"
+    return f"{ns:.0f}ns"
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> List[str]:
+    """
+    Print each benchmark's change against the baseline.
+
+    Returns:
+        Names of benchmarks that regressed: median slower by more than
+        `threshold` (0.1 = 10%) with non-overlapping IQRs, or peak
+        allocations up by more than `threshold`
+    """
+    if baseline["meta"].get("machine") != current["meta"]["machine"] or \
+            baseline["meta"].get("python") != current["meta"]["python"]:
+        print("⚠️  Baseline was recorded on a different machine or Python; timings may not compare")
+
+    regressions = []
+    print(f"\n{'benchmark':<36} {'baseline':>10} {'current':>10} {'change':>8}  alloc")
+    for name, new in current["results"].items():
+        old = baseline["results"].get(name)
+        if not old:
+            print(f"{name:<36} {'(new)':>10} {_format_ns(new['ns_per_call']):>10}")
+            continue
+        change = (new["ns_per_call"] - old["ns_per_call"]) / old["ns_per_call"]
+        slower = change > threshold and new["q1_ns"] > old["q3_ns"]
+        faster = change < -threshold and new["q3_ns"] < old["q1_ns"]
+        old_peak, new_peak = old["alloc_peak_bytes"], new["alloc_peak_bytes"]
+        more_memory = new_peak > old_peak * (1 + threshold) and new_peak - old_peak > 256
+        mark = "REGRESSION" if slower or more_memory else ("faster" if faster else "")
+        alloc_change = f"{old_peak:,} -> {new_peak:,} B" if old_peak != new_peak else f"{new_peak:,} B"
+        print(f"{name:<36} {_format_ns(old['ns_per_call']):>10} {_format_ns(new['ns_per_call']):>10} "
+              f"{change * 100:+7.1f}%  {alloc_change}  {mark}")
+        if slower or more_memory:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Soko Pay microbenchmarks")
+    parser.add_argument("--repeats", type=int, default=7, help="Timed repeats per benchmark")
+    parser.add_argument("--min-time", type=float, default=0.2, help="Minimum seconds per repeat")
+    parser.add_argument("--filter", default="", help="Only run benchmarks whose name contains this")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic tracks and listings")
+    parser.add_argument("--output", help="Write this run's results to a JSON file")
+    parser.add_argument("--save-baseline", metavar="PATH", help="Write this run as the new baseline")
+    parser.add_argument("--compare", metavar="BASELINE", help="Compare against a baseline file")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Slowdown (fraction) flagged as a regression, default 0.10")
+    args = parser.parse_args()
+
+    report = run(args.repeats, args.min_time, args.filter, args.seed)
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"📄 Results written to {path}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regression(s): {', '.join(regressions)}")
+            return 1
+        print("\n✅ No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
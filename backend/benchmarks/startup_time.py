@@ -0,0 +1,113 @@
+"""
+Startup benchmark for Soko Pay
+Starts the app the way the Procfile does (uvicorn main:app) and measures
+the time from process spawn to the first 200 from /health, over several
+runs, against a throwaway database.
+
+Usage (from backend/):
+    python -m benchmarks.startup_time --runs 5 --output startup.json
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _healthy(port: int) -> bool:
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+    try:
+        connection.request("GET", "/health")
+        return connection.getresponse().status == 200
+    except OSError:
+        return False
+    finally:
+        connection.close()
+
+
+def time_to_healthy(timeout: float = 60) -> float:
+    """
+    Spawn one server and poll /health every 10ms.
+
+    Returns:
+        Seconds from spawn to the first healthy response
+    """
+    workdir = tempfile.mkdtemp(prefix="soko-startup-")
+    env = {
+        **os.environ,
+        "DATABASE_PATH": os.path.join(workdir, "soko_pay.db"),
+        "PAYOUT_DIR": os.path.join(workdir, "payouts"),
+        "TRACE_EXPORT_DIR": "",
+        "METRICS_DIR": "",
+    }
+    port = _free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    try:
+        while not _healthy(port):
+            if process.poll() is not None:
+                raise RuntimeError(f"Server exited:\n{process.stderr.read().decode()[-2000:]}")
+            if time.perf_counter() - started > timeout:
+                raise RuntimeError(f"Not healthy within {timeout}s")
+            time.sleep(0.01)
+        return time.perf_counter() - started
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time from process start to first healthy response")
+    parser.add_argument("--runs", type=int, default=5, help="Server starts to measure")
+    parser.add_argument("--output", help="Also write the results as JSON")
+    args = parser.parse_args(argv)
+
+    time_to_healthy()  # Warm the bytecode and OS file caches
+    samples = []
+    for run in range(args.runs):
+        seconds = time_to_healthy()
+        samples.append(seconds * 1000)
+        print(f"run {run + 1}: {seconds * 1000:.0f}ms to first healthy response")
+
+    report = {
+        "runs": args.runs,
+        "median_ms": round(statistics.median(samples), 1),
+        "min_ms": round(min(samples), 1),
+        "max_ms": round(max(samples), 1),
+        "samples_ms": [round(s, 1) for s in samples],
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+    }
+    print(f"\nTime to first healthy response: median {report['median_ms']}ms "
+          f"(min {report['min_ms']}, max {report['max_ms']})")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"📄 Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,15 +1,20 @@
-import os
 import sqlite3
 from contextlib import contextmanager
 from datetime import datetime
 
-# Use /tmp on Heroku (ephemeral filesystem) or local path
-DATABASE_PATH = os.getenv("DATABASE_PATH", "soko_pay.db")
+from app.config import DATABASE_PATH
+from app.services.metrics import timed_db
+from app.services.query_profiler import query_profiler
+from app.services.tracing import caller_name, span
 
 def init_db():
     """Initialize database with schema"""
     conn = sqlite3.connect(DATABASE_PATH)
     cursor = conn.cursor()
+
+    # WAL lets long reads (similarity index build, rebuild jobs) run
+    # without blocking writes from request handlers. Persists in the file.
+    cursor.execute("PRAGMA journal_mode=WAL")
     
     # Orders table
     cursor.execute("""
@@ -32,6 +37,7 @@ def init_db():
             fraud_risk_level TEXT,
             fraud_flags TEXT,
             product_photos TEXT,
+            buyer_device_id TEXT,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             paid_at TIMESTAMP,
             shipped_at TIMESTAMP,
@@ -39,6 +45,10 @@ def init_db():
         )
     """)
     
+    # Columns added after the first release - CREATE TABLE IF NOT EXISTS
+    # won't add them to an existing database
+    _ensure_column(cursor, "orders", "buyer_device_id", "TEXT")
+    
     # Transactions table for logging
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS transactions (
@@ -101,21 +111,272 @@ def init_db():
             FOREIGN KEY (order_id) REFERENCES orders(id)
         )
     """)
-    
+
+    # Payout batches - one per settlement cycle
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS payout_batches (
+            id TEXT PRIMARY KEY,
+            window_start TIMESTAMP,
+            window_end TIMESTAMP NOT NULL,
+            status TEXT DEFAULT 'pending',
+            seller_count INTEGER DEFAULT 0,
+            release_count INTEGER DEFAULT 0,
+            gross_cents INTEGER DEFAULT 0,
+            fee_cents INTEGER DEFAULT 0,
+            net_cents INTEGER DEFAULT 0,
+            payout_file TEXT,
+            provider_ref TEXT,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            submitted_at TIMESTAMP
+        )
+    """)
+
+    # Per-seller lines of a payout batch
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS payout_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            batch_id TEXT NOT NULL,
+            seller_phone TEXT NOT NULL,
+            release_count INTEGER NOT NULL,
+            gross_cents INTEGER NOT NULL,
+            fee_cents INTEGER NOT NULL,
+            net_cents INTEGER NOT NULL,
+            FOREIGN KEY (batch_id) REFERENCES payout_batches(id)
+        )
+    """)
+
+    # Which funds_released transactions have been paid out, and in which batch
+    # (superseded by settled_orders; kept so older databases can be migrated)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS settled_releases (
+            transaction_id INTEGER PRIMARY KEY,
+            batch_id TEXT NOT NULL,
+            FOREIGN KEY (transaction_id) REFERENCES transactions(id),
+            FOREIGN KEY (batch_id) REFERENCES payout_batches(id)
+        )
+    """)
+
+    # Orders whose ledger release has been paid out - at most once per order
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS settled_orders (
+            order_id TEXT PRIMARY KEY,
+            batch_id TEXT NOT NULL,
+            settled_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (order_id) REFERENCES orders(id),
+            FOREIGN KEY (batch_id) REFERENCES payout_batches(id)
+        )
+    """)
+    cursor.execute("""
+        INSERT OR IGNORE INTO settled_orders (order_id, batch_id)
+        SELECT t.order_id, s.batch_id
+        FROM settled_releases s
+        JOIN transactions t ON t.id = s.transaction_id
+    """)
+
+    # Append-only double-entry ledger (integer cents, each journal sums to zero)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ledger_entries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            journal_id TEXT NOT NULL,
+            order_id TEXT,
+            entry_type TEXT NOT NULL,
+            account TEXT NOT NULL,
+            amount_cents INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS ledger_entries_no_update
+        BEFORE UPDATE ON ledger_entries
+        BEGIN
+            SELECT RAISE(ABORT, 'ledger_entries is append-only');
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS ledger_entries_no_delete
+        BEFORE DELETE ON ledger_entries
+        BEGIN
+            SELECT RAISE(ABORT, 'ledger_entries is append-only');
+        END
+    """)
+
+    # Materialized running balance per ledger account
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ledger_balances (
+            account TEXT PRIMARY KEY,
+            balance_cents INTEGER NOT NULL DEFAULT 0,
+            entry_count INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # Persisted per-minute transaction velocity buckets
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS velocity_buckets (
+            key TEXT NOT NULL,
+            bucket_epoch INTEGER NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (key, bucket_epoch)
+        )
+    """)
+
+    # Materialized per-seller stats and reputation, updated on order events
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS seller_stats (
+            seller_phone TEXT PRIMARY KEY,
+            seller_name TEXT,
+            order_count INTEGER NOT NULL DEFAULT 0,
+            paid_count INTEGER NOT NULL DEFAULT 0,
+            completed_count INTEGER NOT NULL DEFAULT 0,
+            disputed_count INTEGER NOT NULL DEFAULT 0,
+            refunded_count INTEGER NOT NULL DEFAULT 0,
+            price_sum_cents INTEGER NOT NULL DEFAULT 0,
+            photo_order_count INTEGER NOT NULL DEFAULT 0,
+            photo_count INTEGER NOT NULL DEFAULT 0,
+            category_counts TEXT,
+            recent_orders REAL NOT NULL DEFAULT 0,
+            recent_completed REAL NOT NULL DEFAULT 0,
+            recent_disputed REAL NOT NULL DEFAULT 0,
+            recent_refunded REAL NOT NULL DEFAULT 0,
+            recent_updated_at REAL,
+            reputation_score INTEGER NOT NULL DEFAULT 50,
+            first_order_at TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # Batch fraud re-scoring jobs with resumable checkpoints
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS fraud_rescore_jobs (
+            id TEXT PRIMARY KEY,
+            status TEXT DEFAULT 'pending',
+            use_ai INTEGER DEFAULT 0,
+            chunk_size INTEGER NOT NULL,
+            pack_size INTEGER NOT NULL,
+            total INTEGER DEFAULT 0,
+            processed INTEGER DEFAULT 0,
+            updated INTEGER DEFAULT 0,
+            last_order_id TEXT,
+            error TEXT,
+            runner_id TEXT,
+            started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    """)
+    _ensure_column(cursor, "fraud_rescore_jobs", "runner_id", "TEXT")
+
+    # Market analytics rollups, one row per category per day
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS market_daily (
+            category TEXT NOT NULL,
+            day TEXT NOT NULL,
+            created_count INTEGER NOT NULL DEFAULT 0,
+            paid_count INTEGER NOT NULL DEFAULT 0,
+            completed_count INTEGER NOT NULL DEFAULT 0,
+            disputed_count INTEGER NOT NULL DEFAULT 0,
+            refunded_count INTEGER NOT NULL DEFAULT 0,
+            price_sum_cents INTEGER NOT NULL DEFAULT 0,
+            price_min_cents INTEGER,
+            price_max_cents INTEGER,
+            PRIMARY KEY (category, day)
+        )
+    """)
+
+    # Listing price histogram per category (log-scale buckets)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS market_price_buckets (
+            category TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (category, bucket)
+        )
+    """)
+
+    # Computed market insights served by /ai/market-insights
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS market_insights_cache (
+            category TEXT PRIMARY KEY,
+            insights TEXT NOT NULL,
+            computed_at REAL NOT NULL,
+            tips TEXT,
+            tips_at REAL
+        )
+    """)
+
+    # Content-addressed product photos; ref_count is the number of
+    # orders.product_photos entries pointing at the blob
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS photo_blobs (
+            sha256 TEXT PRIMARY KEY,
+            extension TEXT NOT NULL,
+            content_type TEXT NOT NULL,
+            size_bytes INTEGER NOT NULL,
+            ref_count INTEGER NOT NULL DEFAULT 0,
+            width INTEGER,
+            height INTEGER,
+            derivatives_at TIMESTAMP,
+            last_uploaded_at TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    _ensure_column(cursor, "photo_blobs", "width", "INTEGER")
+    _ensure_column(cursor, "photo_blobs", "height", "INTEGER")
+    _ensure_column(cursor, "photo_blobs", "derivatives_at", "TIMESTAMP")
+    _ensure_column(cursor, "photo_blobs", "last_uploaded_at", "TIMESTAMP")
+
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_orders_buyer_phone
+        ON orders(buyer_phone, created_at)
+    """)
+
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_ledger_entries_journal
+        ON ledger_entries(journal_id)
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_ledger_entries_order
+        ON ledger_entries(order_id)
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_ledger_entries_type_created
+        ON ledger_entries(entry_type, created_at)
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_transactions_type_created
+        ON transactions(type, created_at)
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_payout_items_batch
+        ON payout_items(batch_id)
+    """)
+
     conn.commit()
     conn.close()
     print("✅ Database initialized successfully")
 
+def _ensure_column(cursor, table: str, column: str, definition: str):
+    """Add a column to an existing table if it is missing"""
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
 @contextmanager
 def get_db():
     """Context manager for database connections"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row  # Enable dict-like access
-    try:
-        yield conn
-    finally:
-        conn.close()
+    # Traced requests get one span per connection (lock waits included),
+    # named after the function that opened it
+    with span("sqlite", **{"db.caller": caller_name(2)}):
+        # Profiling connections when QUERY_PROFILING is on (see app/services/query_profiler.py)
+        conn = sqlite3.connect(DATABASE_PATH, factory=query_profiler.connection_factory)
+        conn.row_factory = sqlite3.Row  # Enable dict-like access
+        try:
+            yield conn
+        finally:
+            conn.close()
 
+@timed_db
 def get_order_by_id(order_id: str):
     """Get order by ID"""
     with get_db() as conn:
@@ -126,6 +387,7 @@ def get_order_by_id(order_id: str):
             return dict(row)
         return None
 
+@timed_db
 def create_order(**order_data):
     """Create a new order"""
     with get_db() as conn:
@@ -154,6 +416,7 @@ def create_order(**order_data):
         conn.commit()
         return order_data['order_id']
 
+@timed_db
 def update_order_status(order_id: str, status: str, **kwargs):
     """Update order status and additional fields"""
     with get_db() as conn:
@@ -203,6 +466,37 @@ def update_order_status(order_id: str, status: str, **kwargs):
         
         return cursor.rowcount > 0
 
+@timed_db
+def claim_order_status(order_id: str, from_status: str, to_status: str, conn=None) -> bool:
+    """
+    Move an order from one status to another only if it is still in from_status.
+
+    Args:
+        conn: Existing connection to claim inside the caller's transaction,
+              so the claim only sticks if the caller's other writes do.
+              The caller is then responsible for committing.
+
+    Returns:
+        True for the one caller that made the transition, False if the
+        order had already moved on (e.g. a re-delivered callback)
+    """
+    def _claim(connection):
+        cursor = connection.cursor()
+        cursor.execute(
+            "UPDATE orders SET status = ? WHERE id = ? AND status = ?",
+            (to_status, order_id, from_status)
+        )
+        return cursor.rowcount == 1
+
+    if conn is not None:
+        return _claim(conn)
+
+    with get_db() as own_conn:
+        claimed = _claim(own_conn)
+        own_conn.commit()
+        return claimed
+
+@timed_db
 def log_transaction(order_id: str, transaction_type: str = None, trans_type: str = None, **kwargs):
     """Log a transaction"""
     tx_type = transaction_type or trans_type or "unknown"
@@ -222,6 +516,7 @@ def log_transaction(order_id: str, transaction_type: str = None, trans_type: str
         ))
         conn.commit()
 
+@timed_db
 def log_location(order_id: str, tracker_type: str, latitude: float, longitude: float, **kwargs):
     """Log a location update for real-time tracking"""
     with get_db() as conn:
@@ -246,6 +541,7 @@ def log_location(order_id: str, tracker_type: str, latitude: float, longitude: f
         conn.commit()
         return cursor.lastrowid
 
+@timed_db
 def get_location_history(order_id: str, limit: int = 50):
     """Get location history for an order"""
     with get_db() as conn:
@@ -259,6 +555,7 @@ def get_location_history(order_id: str, limit: int = 50):
         rows = cursor.fetchall()
         return [dict(row) for row in rows]
 
+@timed_db
 def get_latest_location(order_id: str, tracker_type: str = None):
     """Get the latest location for an order"""
     with get_db() as conn:
@@ -280,6 +577,7 @@ def get_latest_location(order_id: str, tracker_type: str = None):
         row = cursor.fetchone()
         return dict(row) if row else None
 
+@timed_db
 def log_location_event(order_id: str, event: str, latitude: float = None, longitude: float = None, description: str = None):
     """Log a location event (like 'delivery_started', 'delivery_completed')"""
     with get_db() as conn:
@@ -292,6 +590,7 @@ def log_location_event(order_id: str, event: str, latitude: float = None, longit
         conn.commit()
         return cursor.lastrowid
 
+@timed_db
 def get_location_events(order_id: str):
     """Get all location events for an order"""
     with get_db() as conn:
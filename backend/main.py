@@ -1,12 +1,26 @@
-from dotenv import load_dotenv
-load_dotenv()
+# Loads .env; must come before any module that reads settings at import
+from app import config
 
-import os
+import asyncio
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from pathlib import Path
 from database import init_db
+from app.services.velocity import velocity_tracker, run_velocity_persistence
+from app.services.fraud_model import load_fraud_model
+from app.services.fraud_batch import interrupt_stale_rescore_jobs
+from app.services.ledger import backfill_ledger
+from app.services.categorizer import load_categorizer
+from app.services.similarity_index import similarity_index
+from app.services.recommender import load_recommender
+from app.services.photo_derivatives import shutdown_pool as shutdown_photo_pool
+from app.services.photo_storage import PHOTO_URL_PREFIX
+from app.services import metrics
+from app.services.query_profiler import run_query_profile_log
+from app.services.tracing import TracingMiddleware, run_trace_export, tracer
+from app.services.warmup import run_warmup
 
 # Import routers
 from app.routes.orders import router as orders_router
@@ -14,6 +28,10 @@ from app.routes.payments import router as payments_router
 from app.routes.disputes import router as disputes_router
 from app.routes.tracking import router as tracking_router
 from app.routes.ai import router as ai_router
+from app.routes.settlements import router as settlements_router
+from app.routes.ledger import router as ledger_router
+from app.routes.photos import router as photos_router
+from app.routes.admin import router as admin_router
 
 app = FastAPI(
     title="Soko Pay API",
@@ -24,9 +42,8 @@ app = FastAPI(
 )
 
 # CORS Configuration - use FRONTEND_URL env var in production
-frontend_url = os.getenv("FRONTEND_URL", "http://localhost:3001")
 allowed_origins = [
-    frontend_url,
+    config.FRONTEND_URL,
     "http://localhost:3000",
     "http://localhost:3001",
 ]
@@ -39,20 +56,53 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Root span for sampled requests (see /api/admin/traces)
+app.add_middleware(TracingMiddleware)
+
+# Per-route latency, status counts and in-flight requests for /metrics
+app.add_middleware(metrics.MetricsMiddleware)
+
 # Create uploads directory if it doesn't exist
-uploads_dir = Path("uploads/products")
-uploads_dir.mkdir(parents=True, exist_ok=True)
+Path(config.UPLOAD_DIR).mkdir(parents=True, exist_ok=True)
+
+# Content-addressed photos and their WebP sizes (generated on first request
+# if missing); must be registered before the static mount to take precedence
+app.include_router(photos_router, tags=["photos"])
 
 # Mount static files for serving uploaded photos
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+app.mount(PHOTO_URL_PREFIX, StaticFiles(directory=config.UPLOAD_DIR), name="uploads")
 
 # Initialize database on startup
 @app.on_event("startup")
 async def startup_event():
     init_db()
+    # Journals for orders from before the ledger; a no-op once posted
+    backfilled = backfill_ledger()
+    if any(backfilled.values()):
+        print(f"📒 Ledger backfill: {backfilled}")
+    interrupt_stale_rescore_jobs()
+    velocity_tracker.load()
+    load_fraud_model()
+    load_categorizer()
+    load_recommender()
+    # Gemini SDK and geopy are imported after the port binds (or on first use)
+    asyncio.create_task(run_warmup())
+    asyncio.create_task(run_velocity_persistence())
+    asyncio.create_task(metrics.run_metrics_snapshots())
+    asyncio.create_task(run_query_profile_log())
+    asyncio.create_task(run_trace_export())
+    # Built off the event loop; /ai/find-similar falls back to the AI until ready
+    asyncio.create_task(asyncio.to_thread(similarity_index.build))
     print("🚀 Soko Pay API started successfully!")
     print("📚 API Documentation: http://localhost:8000/docs")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    velocity_tracker.flush()
+    shutdown_photo_pool()
+    metrics.final_snapshot()
+    tracer.export_pending()
+
 # Health check endpoint
 @app.get("/health")
 async def health_check():
@@ -63,6 +113,14 @@ async def health_check():
         "version": "1.0.0"
     }
 
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def prometheus_metrics():
+    """Prometheus scrape endpoint (summed over all workers when METRICS_DIR is set)"""
+    # Refresh hooks read event-loop state, so this worker's snapshot is
+    # taken here; only the file I/O and formatting run in a thread
+    text = await asyncio.to_thread(metrics.render, metrics.METRICS_DIR, metrics.snapshot())
+    return PlainTextResponse(text, media_type=metrics.CONTENT_TYPE)
+
 @app.get("/")
 async def root():
     """Root endpoint"""
@@ -78,6 +136,9 @@ app.include_router(payments_router, prefix="/api", tags=["payments"])
 app.include_router(disputes_router, prefix="/api", tags=["disputes"])
 app.include_router(tracking_router, prefix="/api", tags=["tracking"])
 app.include_router(ai_router, prefix="/api", tags=["ai"])
+app.include_router(settlements_router, prefix="/api", tags=["settlements"])
+app.include_router(ledger_router, prefix="/api", tags=["ledger"])
+app.include_router(admin_router, prefix="/api", tags=["admin"])
 
 if __name__ == "__main__":
     import uvicorn